@@ -0,0 +1,99 @@
+"""
+Benchmark de la recherche des villes des adresses : merge sur le nom seul vs CityIndex (code postal + nom, trigrammes)
+
+Ne nécessite pas de base de données, les villes et adresses sont générées en mémoire
+Les adresses générées contiennent des villes à plusieurs codes postaux, des fautes de frappe et des villes inconnues
+
+Ex: `python -m benchmarks.bench_city_index --rows 100000`
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from migration_mdps_proeco_sigale.city_index import CityIndex
+
+
+def generer_villes(nb_villes: int, rng) -> pd.DataFrame:
+    """
+    Génère des villes triées par code postal, une partie des villes ayant plusieurs codes postaux
+    """
+    syllabes = np.array(['BRU', 'LIE', 'NAM', 'MON', 'CHAR', 'LE', 'ROI', 'WA', 'VRE', 'GEM', 'BOUR', 'SAINT', 'VILLE'])
+    noms = {''.join(rng.choice(syllabes, rng.integers(2, 5))) for _ in range(nb_villes)}
+    villes = []
+    for numero, nom in enumerate(sorted(noms)):
+        for decalage in range(rng.choice([1, 1, 1, 2, 3])):
+            villes.append({'postal_code': str(1000 + numero * 5 + decalage), 'city_name': nom})
+    villes = pd.DataFrame(villes).sort_values('postal_code', ignore_index=True)
+    villes['id'] = np.arange(1, len(villes) + 1)
+    return villes
+
+
+def generer_adresses(villes: pd.DataFrame, nb_lignes: int, rng) -> pd.DataFrame:
+    """
+    Génère des adresses à partir des villes, avec la ville attendue dans expected_id
+    - 75% code postal et nom exacts, 10% code postal inconnu, 10% faute de frappe, 5% ville inconnue
+    """
+    adresses = villes.sample(nb_lignes, replace=True, random_state=42).reset_index(drop=True)
+    adresses = adresses.rename(columns={'postal_code': 'cpost', 'city_name': 'comm', 'id': 'expected_id'})
+    cas = rng.random(nb_lignes)
+
+    cp_inconnu = (cas >= 0.75) & (cas < 0.85)
+    adresses.loc[cp_inconnu, 'cpost'] = '9999'
+    # Avec un code postal inconnu, la ville attendue est celle du plus petit code postal
+    premier_id = villes.drop_duplicates('city_name').set_index('city_name')['id']
+    adresses.loc[cp_inconnu, 'expected_id'] = adresses.loc[cp_inconnu, 'comm'].map(premier_id)
+
+    faute = (cas >= 0.85) & (cas < 0.95)
+    adresses.loc[faute, 'comm'] = adresses.loc[faute, 'comm'].str.slice_replace(2, 3, 'X')
+
+    inconnue = cas >= 0.95
+    adresses.loc[inconnue, 'comm'] = 'VILLE INCONNUE'
+    adresses.loc[inconnue, 'expected_id'] = np.nan
+    return adresses
+
+
+def merge_sur_le_nom(villes: pd.DataFrame, adresses: pd.DataFrame) -> pd.Series:
+    # Ancienne méthode de migrate_adresses : merge sur le nom, en gardant le plus petit code postal
+    villes_sigale = villes[['id', 'city_name']].drop_duplicates(subset=['city_name'], keep='first')
+    return adresses.merge(villes_sigale, left_on='comm', right_on='city_name', how='left', validate='m:1')['id']
+
+
+def rapporter(label: str, city_ids: pd.Series, adresses: pd.DataFrame, duree: float, methodes: pd.Series = None):
+    trouvees = city_ids.notna().sum()
+    correctes = (city_ids.values == adresses['expected_id'].values).sum()
+    print(f"{label:<22} {duree:8.3f}s  {len(adresses) / duree:12.0f} lignes/s  "
+          f"trouvées {trouvees / len(adresses):6.1%}  correctes {correctes / len(adresses):6.1%}")
+    if methodes is not None:
+        print(' ' * 24 + ', '.join(f"{methode}: {nombre}" for methode, nombre in methodes.value_counts().items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la recherche des villes")
+    parser.add_argument('--rows', type=int, default=100000, help="Nombre d'adresses")
+    parser.add_argument('--cities', type=int, default=2500, help="Nombre de noms de villes")
+    parser.add_argument('--seuil', type=float, default=0.5, help="Seuil de similarité des trigrammes")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    villes = generer_villes(args.cities, rng)
+    adresses = generer_adresses(villes, args.rows, rng)
+    print(f"{len(villes)} villes, {len(adresses)} adresses")
+
+    debut = time.perf_counter()
+    city_ids = merge_sur_le_nom(villes, adresses)
+    rapporter('merge nom seul', city_ids, adresses, time.perf_counter() - debut)
+
+    debut = time.perf_counter()
+    index = CityIndex(villes)
+    print(f"{'construction index':<22} {time.perf_counter() - debut:8.3f}s")
+
+    for label, approchant in [('CityIndex', False), ('CityIndex trigrammes', True)]:
+        debut = time.perf_counter()
+        detail = index.match_detail(adresses['comm'], adresses['cpost'], approchant=approchant, seuil=args.seuil)
+        rapporter(label, detail['city_id'], adresses, time.perf_counter() - debut, detail['methode'])
+
+
+if __name__ == '__main__':
+    main()
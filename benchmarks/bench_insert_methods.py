@@ -0,0 +1,82 @@
+"""
+Benchmark des méthodes d'insertion dans Sigale : INSERT par défaut de pandas vs COPY FROM STDIN
+
+Utilise la base définie dans la variable d'environnement BENCHMARK_DATABASE_URL, ou à défaut la connexion Sigale du .env
+Les lignes sont insérées dans une table temporaire de benchmark, supprimée à la fin
+
+Ex: `python -m benchmarks.bench_insert_methods --rows 50000`
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from migration_mdps_proeco_sigale.db.sigale_connector import SigaleConnector
+from migration_mdps_proeco_sigale.db.sql_write_methods import WriteMethods
+
+BENCHMARK_TABLE = 'benchmark_insert_methods'
+
+
+def generer_personnes(nb_lignes: int) -> pd.DataFrame:
+    """
+    Génère des lignes ressemblant aux nouvelles personnes insérées par migrate_personnes
+    """
+    rng = np.random.default_rng(42)
+    return pd.DataFrame({
+        'matric_mdp': np.arange(nb_lignes),
+        'nom': [f"Nom{i}" for i in range(nb_lignes)],
+        'prenom': [f"Prénom {i}" for i in range(nb_lignes)],
+        'registre_national_numero': [f"{i:011d}" for i in range(nb_lignes)],
+        'date_naissance': pd.to_datetime('1970-01-01') + pd.to_timedelta(rng.integers(0, 15000, nb_lignes), unit='D'),
+        # city_id en float avec des valeurs nulles, comme après un merge en left join
+        'city_id_naissance': np.where(rng.random(nb_lignes) < 0.2, np.nan, rng.integers(1, 3000, nb_lignes)),
+        'lieu_naissance_hors_belgique': np.where(rng.random(nb_lignes) < 0.8, None, 'PARIS'),
+        'est_membre_personnel': True,
+        'created_by': 1,
+        'created_on': datetime.now(),
+    })
+
+
+def mesurer(df: pd.DataFrame, engine, method, label: str) -> float:
+    with engine.begin() as conn:
+        conn.execute(text(f"truncate table {BENCHMARK_TABLE}"))
+    debut = time.perf_counter()
+    df.to_sql(BENCHMARK_TABLE, con=engine, index=False, if_exists='append', method=method)
+    duree = time.perf_counter() - debut
+    print(f"{label:<8} {len(df):>9} lignes en {duree:8.2f}s -> {len(df) / duree:12.0f} lignes/s")
+    return duree
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark INSERT vs COPY")
+    parser.add_argument('--rows', type=int, default=20000, help="Nombre de lignes à insérer")
+    args = parser.parse_args()
+
+    url = os.getenv('BENCHMARK_DATABASE_URL')
+    engine = create_engine(url) if url else SigaleConnector().create_engine()
+
+    df = generer_personnes(args.rows)
+    with engine.begin() as conn:
+        conn.execute(text(f"drop table if exists {BENCHMARK_TABLE}"))
+        conn.execute(text(f"""
+        create table {BENCHMARK_TABLE} (
+            matric_mdp integer, nom varchar, prenom varchar, registre_national_numero varchar,
+            date_naissance date, city_id_naissance integer, lieu_naissance_hors_belgique varchar,
+            est_membre_personnel boolean, created_by integer, created_on timestamp
+        )"""))
+
+    try:
+        duree_insert = mesurer(df, engine, None, 'insert')
+        duree_copy = mesurer(df, engine, WriteMethods.insert_method(engine, 'copy'), 'copy')
+        print(f"COPY est {duree_insert / duree_copy:.1f}x plus rapide")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"drop table if exists {BENCHMARK_TABLE}"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark de la mémoire utilisée par l'extraction Proeco : lecture en une fois avec les types par défaut de pandas,
+lecture par lots (read_sql_stream) et lecture par lots avec le plan de types compacts
+
+Génère une table PERSONNE synthétique dans une base SQLite temporaire, puis pour chaque mode, dans un processus séparé :
+lecture des colonnes de SQL_MDPS_PROECO, nettoyage des numéros de registre national et conversion des dates de naissance
+Affiche la mémoire de la dataframe et le pic de mémoire (RSS) du processus
+
+Ex: `python -m benchmarks.bench_memoire --rows 500000`
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from migration_mdps_proeco_sigale.date_utils import DateUtils
+from migration_mdps_proeco_sigale.db.requetes_sql import COLONNES_MDPS_PROECO
+from migration_mdps_proeco_sigale.db.sql_read_methods import read_sql_stream
+from migration_mdps_proeco_sigale.dtypes import lire_sql_compact, STRING_DTYPE
+
+
+def generer_personnes(nb_lignes: int) -> pd.DataFrame:
+    """
+    Génère une table PERSONNE avec les colonnes lues par SQL_MDPS_PROECO
+    """
+    rng = np.random.default_rng(42)
+
+    def choix(valeurs: list):
+        return np.array(valeurs, dtype=object)[rng.integers(0, len(valeurs), nb_lignes)]
+
+    communes = ['Liège', 'Namur', 'Bruxelles', 'Mons', 'Charleroi', 'Wavre', 'Arlon', 'Huy', 'Verviers', 'Spa']
+    adresse = {
+        'rue': [f"Rue {i % 5000} {i % 97}" for i in range(nb_lignes)],
+        'pays': choix(['BE', 'BE', 'BE', 'FR', 'NL']),
+        'cpost': choix([str(1000 + 10 * i) for i in range(300)]),
+        'comm': choix(communes),
+        'loca': choix([None, 'Centre', 'Nord']),
+        'zone': choix([None, 'A', 'B']),
+    }
+    personnes = pd.DataFrame({
+        'matric': np.arange(1, nb_lignes + 1),
+        'nom': [f"Nom{i}" for i in range(nb_lignes)],
+        'prenom': choix([f"Prénom{i}" for i in range(2000)]),
+        'sexe': choix(['m', 'f']),
+        'nation': choix(['BE', 'FR', 'IT', 'NL', 'MA']),
+        'paynaiss': choix(['BE', 'FR', 'IT', 'NL', 'MA']),
+        'lieunaiss': choix(communes),
+        'etatcivil': choix(['C', 'M', 'D', 'V']),
+        **{f"{champ}domi": valeurs for champ, valeurs in adresse.items()},
+        **{f"{champ}resi": np.roll(valeurs, 1) for champ, valeurs in adresse.items()},
+        'teldomi': [f"04 {i % 100:02d} {i % 1000:03d}" for i in range(nb_lignes)],
+        'telresi': choix([None, '081 22 33 44']),
+        'gsm': [f"0470/{i:06d}" for i in range(nb_lignes)],
+        'email': [f"personne{i}@exemple.be" for i in range(nb_lignes)],
+        'email2': choix([None, 'secretariat@ecole.be']),
+        'telbureau': choix([None, '02 123 45 67']),
+        'matriche': choix([None, 'X']),
+        'reserved': choix([None, 'R']),
+        'reservef': choix([None, 'F']),
+        'regnat1': [f"{i:011d}" for i in range(nb_lignes)],
+        'datnaiss': rng.integers(500101, 1051231, nb_lignes),
+    })
+    return personnes
+
+
+# SQLite ne supportant pas SIMILAR TO, on lit les colonnes de SQL_MDPS_PROECO sans les filtres Proeco
+SQL_PERSONNES = text(f"select {COLONNES_MDPS_PROECO} from PERSONNE order by matric")
+
+
+def extraire(url: str, mode: str, resultat):
+    engine = create_engine(url)
+    debut = time.perf_counter()
+    if mode == 'compact':
+        enseignants = lire_sql_compact(SQL_PERSONNES, engine, dtype={'registre_national_numero': str})
+    elif mode == 'lots':
+        enseignants = read_sql_stream(SQL_PERSONNES, engine, dtype={'registre_national_numero': str})
+    else:
+        enseignants = pd.read_sql_query(SQL_PERSONNES, engine, dtype={'registre_national_numero': str})
+    enseignants['registre_national_numero'] = enseignants['registre_national_numero'].str.replace(r'\D+', '', regex=True)
+    enseignants['date_naissance'] = DateUtils.dateproeco_to_datetime64(enseignants['date_naissance'])
+    duree = time.perf_counter() - debut
+    # ru_maxrss est en Ko sous Linux, en octets sous macOS
+    pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    resultat.put((enseignants.memory_usage(deep=True).sum(), pic, duree))
+
+
+def mesurer(url: str, mode: str):
+    # Un processus par mode, pour que le pic de mémoire d'un mode ne fausse pas l'autre
+    contexte = multiprocessing.get_context('spawn')
+    resultat = contexte.Queue()
+    processus = contexte.Process(target=extraire, args=(url, mode, resultat))
+    processus.start()
+    memoire, pic, duree = resultat.get()
+    processus.join()
+    print(f"{mode:<10} dataframe {memoire / 2 ** 20:8.1f} Mo   pic RSS {pic / 2 ** 20:8.1f} Mo   en {duree:6.2f}s")
+    return memoire, pic
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mémoire de l'extraction Proeco")
+    parser.add_argument('--rows', type=int, default=500000, help="Nombre de lignes dans PERSONNE")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dossier:
+        url = f"sqlite:///{os.path.join(dossier, 'proeco.db')}"
+        generer_personnes(args.rows).to_sql('PERSONNE', create_engine(url), index=False, chunksize=50000)
+        print(f"{args.rows} lignes dans PERSONNE, chaînes {STRING_DTYPE!r}")
+
+        memoire_defaut, pic_defaut = mesurer(url, 'défaut')
+        mesurer(url, 'lots')
+        memoire_compact, pic_compact = mesurer(url, 'compact')
+        print(f"Dataframe {memoire_defaut / memoire_compact:.1f}x plus petite, pic RSS {pic_defaut / pic_compact:.1f}x plus petit")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""
+Suite de benchmarks de la migration complète sur données synthétiques : temps de run_migrations et de chaque étape
+(migrate_personnes, migrate_users, migrate_emails, migrate_phones, migrate_adresses), lignes par seconde et pic de
+mémoire (RSS), enregistrés en json pour comparer les performances d'une version à l'autre
+
+Pour chaque nombre de personnes, génère une table PERSONNE et FONCTION Proeco et un Sigale vide avec ses données de
+référence (voir donnees_synthetiques), puis mesure, chacun dans un processus séparé :
+- initial : première migration, toutes les personnes et contacts sont ajoutés
+- synchro : nouvelle migration après modification de 10% des personnes dans Proeco
+
+Les schémas core et personnes de la base sont supprimés et recréés : la base doit être dédiée aux benchmarks,
+elle est donnée par --url ou la variable d'environnement BENCHMARK_DATABASE_URL (jamais la connexion Sigale du .env)
+
+Ex: `python -m benchmarks.bench_suite --rows 1000 10000 100000 --output resultats.json`
+    `python -m benchmarks.bench_suite --rows 10000 --reference resultats.json --tolerance 0.2`
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from types import ModuleType
+
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import create_engine
+
+from benchmarks.donnees_synthetiques import generer_villes, generer_personnes, generer_fonctions, creer_sigale, \
+    creer_proeco, modifier_proeco, proeco_engine, verifier_base
+from migration_mdps_proeco_sigale import config as default_config, run
+from migration_mdps_proeco_sigale.db.connection_manager import dispose_engines
+
+ETAPES = ['migrate_personnes', 'migrate_users', 'migrate_emails', 'migrate_phones', 'migrate_adresses']
+SCENARIOS = ['initial', 'synchro']
+
+
+class Chronometre:
+    """
+    Mesure la durée et le nombre de lignes de chaque étape de migration, en remplaçant temporairement les fonctions
+    migrate_* appelées par le module run
+    Les étapes pouvant être exécutées en parallèle (PARALLEL_STAGES), les mesures sont protégées par un verrou
+    """
+
+    def __init__(self):
+        self.etapes: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def envelopper(self, nom: str, fonction):
+        @wraps(fonction)
+        def etape(donnees, *args, **kwargs):
+            debut = time.perf_counter()
+            try:
+                return fonction(donnees, *args, **kwargs)
+            finally:
+                duree = time.perf_counter() - debut
+                with self._lock:
+                    mesure = self.etapes.setdefault(nom, {'duree': 0.0, 'appels': 0, 'lignes': 0})
+                    mesure['duree'] += duree
+                    mesure['appels'] += 1
+                    mesure['lignes'] += len(donnees)
+        return etape
+
+    @contextmanager
+    def installer(self):
+        originales = {nom: getattr(run, nom) for nom in ETAPES}
+        for nom, fonction in originales.items():
+            setattr(run, nom, self.envelopper(nom, fonction))
+        try:
+            yield self
+        finally:
+            for nom, fonction in originales.items():
+                setattr(run, nom, fonction)
+
+
+def config_benchmark(dossier: str, options: dict) -> ModuleType:
+    """
+    Copie de la config par défaut, les fichiers produits par le run étant écrits dans un dossier temporaire
+    """
+    config = ModuleType('config_benchmark')
+    config.__dict__.update({nom: valeur for nom, valeur in vars(default_config).items() if not nom.startswith('__')})
+    config.EXPORT_PATH = os.path.join(dossier, 'exports')
+    config.DELTA_STATE_FILE = os.path.join(dossier, 'delta_sync.pkl')
+    config.REFERENCE_CACHE_SNAPSHOT = None
+    for nom, valeur in options.get('config', {}).items():
+        setattr(config, nom, valeur)
+    return config
+
+
+def executer(url: str, options: dict, dossier: str, resultat):
+    """
+    Lance run_migrations sur les bases synthétiques, dans un processus dédié
+    """
+    logging.basicConfig(level=options['loglevel'].upper(), format='%(asctime)s | %(levelname)s | %(message)s')
+    logger = logging.getLogger('benchmark_migration')
+    chronometre = Chronometre()
+    with chronometre.installer():
+        debut = time.perf_counter()
+        run.run_migrations(
+            proeco_engine=proeco_engine(url),
+            sigale_engine=create_engine(url),
+            logger=logger,
+            action_when_duplicates='drop',
+            contrat_en_cours_uniquement=not options['historique'],
+            create_users=options['create_users'],
+            update=True,
+            staging_merge=options['staging_merge'],
+            chunk_size=options['chunk_size'],
+            parallel_stages=options['parallel_stages'],
+            config=config_benchmark(dossier, options),
+        )
+        duree = time.perf_counter() - debut
+    dispose_engines()
+    # ru_maxrss est en Ko sous Linux, en octets sous macOS
+    pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    resultat.put((duree, pic, chronometre.etapes))
+
+
+def mesurer(url: str, nb_personnes: int, scenario: str, options: dict, dossier: str) -> dict:
+    # Un processus par mesure, pour que le pic de mémoire d'une mesure ne fausse pas les suivantes
+    contexte = multiprocessing.get_context('spawn')
+    resultat = contexte.Queue()
+    processus = contexte.Process(target=executer, args=(url, options, dossier, resultat))
+    processus.start()
+    processus.join()
+    if processus.exitcode != 0:
+        raise RuntimeError(f"Échec du benchmark {scenario} sur {nb_personnes} personnes (code {processus.exitcode})")
+    duree, pic, etapes = resultat.get()
+
+    print(f"{nb_personnes:>9} personnes {scenario:<8} {duree:8.2f}s -> {nb_personnes / duree:10.0f} personnes/s   "
+          f"pic RSS {pic / 2 ** 20:8.1f} Mo")
+    for nom, mesure in etapes.items():
+        mesure['lignes_par_seconde'] = mesure['lignes'] / mesure['duree'] if mesure['duree'] else None
+        print(f"{'':>20} {nom:<18} {mesure['duree']:8.2f}s   {mesure['lignes']:>9} lignes")
+    return {
+        'personnes': nb_personnes,
+        'scenario': scenario,
+        'duree': duree,
+        'personnes_par_seconde': nb_personnes / duree,
+        'pic_rss_mo': pic / 2 ** 20,
+        'etapes': etapes,
+    }
+
+
+def comparer(resultats: list[dict], reference: list[dict], tolerance: float) -> list[str]:
+    """
+    Compare les durées et pics de mémoire à ceux d'un json de référence
+    :return: la liste des régressions, mesures dépassant la référence de plus de tolerance (0.2 = 20%)
+    """
+    references = {(mesure['personnes'], mesure['scenario']): mesure for mesure in reference}
+    regressions = []
+
+    def verifier(libelle: str, valeur: float | None, valeur_reference: float | None):
+        if valeur is None or not valeur_reference:
+            return
+        ecart = valeur / valeur_reference - 1
+        print(f"{libelle:<45} {valeur_reference:10.2f} -> {valeur:10.2f} ({ecart:+7.1%})")
+        if ecart > tolerance:
+            regressions.append(f"{libelle} : {ecart:+.1%}")
+
+    for mesure in resultats:
+        mesure_reference = references.get((mesure['personnes'], mesure['scenario']))
+        if mesure_reference is None:
+            continue
+        prefixe = f"{mesure['personnes']} {mesure['scenario']}"
+        verifier(f"{prefixe} durée", mesure['duree'], mesure_reference['duree'])
+        verifier(f"{prefixe} pic RSS", mesure['pic_rss_mo'], mesure_reference['pic_rss_mo'])
+        for nom, etape in mesure['etapes'].items():
+            verifier(f"{prefixe} {nom}", etape['duree'], mesure_reference['etapes'].get(nom, {}).get('duree'))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la migration complète sur données synthétiques")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Nombres de personnes dans PERSONNE, une mesure par nombre")
+    parser.add_argument('--url', default=os.getenv('BENCHMARK_DATABASE_URL'),
+                        help="Base postgresql dédiée aux benchmarks, BENCHMARK_DATABASE_URL par défaut")
+    parser.add_argument('--output', default='benchmark_migration.json', help="Fichier json des résultats")
+    parser.add_argument('--reference', help="Fichier json d'un précédent benchmark, pour détecter les régressions")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Écart toléré par rapport à la référence avant de signaler une régression (0.2 = 20%%)")
+    parser.add_argument('--villes', type=int, default=2500, help="Nombre de villes dans core.cities")
+    parser.add_argument('--historique', action='store_true', help="Migre aussi les contrats terminés")
+    parser.add_argument('--create-users', action='store_true', dest='create_users')
+    parser.add_argument('--staging-merge', action='store_true', dest='staging_merge')
+    parser.add_argument('--chunk-size', type=int, dest='chunk_size', default=None)
+    parser.add_argument('--parallel-stages', type=int, dest='parallel_stages', default=1)
+    parser.add_argument('--config', type=json.loads, default={},
+                        help='Options de config modifiées, en json, ex: \'{"COMPACT_DTYPES": false}\'')
+    parser.add_argument('-log', '--loglevel', default='warning')
+    args = parser.parse_args()
+
+    if not args.url:
+        parser.error("Indiquez une base dédiée aux benchmarks avec --url ou BENCHMARK_DATABASE_URL")
+    engine = create_engine(args.url)
+    if engine.dialect.name != 'postgresql':
+        parser.error("La suite de benchmarks nécessite postgresql (SIMILAR TO de Proeco, schémas de Sigale)")
+    verifier_base(engine)
+
+    options = {cle: getattr(args, cle) for cle in ('historique', 'create_users', 'staging_merge', 'chunk_size',
+                                                   'parallel_stages', 'config', 'loglevel')}
+    villes = generer_villes(args.villes)
+    resultats = []
+    for nb_personnes in args.rows:
+        debut = time.perf_counter()
+        personnes = generer_personnes(nb_personnes, villes)
+        creer_proeco(engine, personnes, generer_fonctions(personnes))
+        creer_sigale(engine, villes)
+        print(f"{nb_personnes:>9} personnes générées en {time.perf_counter() - debut:.2f}s")
+        del personnes
+
+        with tempfile.TemporaryDirectory() as dossier:
+            for scenario in SCENARIOS:
+                if scenario == 'synchro':
+                    modifier_proeco(engine, 0.1)
+                resultats.append(mesurer(args.url, nb_personnes, scenario, options, dossier))
+
+    with open(args.output, 'w', encoding='utf-8') as fichier:
+        json.dump({
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'sqlalchemy': sqlalchemy.__version__,
+            'options': options,
+            'resultats': resultats,
+        }, fichier, indent=2)
+    print(f"Résultats enregistrés dans {args.output}")
+
+    if args.reference:
+        with open(args.reference, encoding='utf-8') as fichier:
+            regressions = comparer(resultats, json.load(fichier)['resultats'], args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} régression(s) au-delà de {args.tolerance:.0%} :")
+            for regression in regressions:
+                print(f"- {regression}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Micro-benchmark des transformations de migrations.py : apply ligne par ligne vs version vectorisée
+
+Ne nécessite pas de base de données, les données sont générées en mémoire
+
+Ex: `python -m benchmarks.bench_vectorisation --rows 100000`
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from unidecode import unidecode
+
+from migration_mdps_proeco_sigale import config
+from migration_mdps_proeco_sigale.date_utils import DateUtils
+from migration_mdps_proeco_sigale.tools import normaliser_texte, champs_config
+
+
+def generer_enseignants(nb_lignes: int) -> pd.DataFrame:
+    """
+    Génère des lignes ressemblant aux enseignants extraits de Proeco
+    """
+    rng = np.random.default_rng(42)
+    communes = np.array(['Liège', 'Namur', 'Bruxelles', ' Paris ', 'Mons', None], dtype=object)
+    pays = np.array(['BE', 'be', 'FR', 'IT ', None], dtype=object)
+    return pd.DataFrame({
+        'prenom': [f"Prénom{i % 997}" for i in range(nb_lignes)],
+        'nom': [f"Nöm-{i % 1009}" for i in range(nb_lignes)],
+        'lieunaiss': communes[rng.integers(0, len(communes), nb_lignes)],
+        'paynaiss': pays[rng.integers(0, len(pays), nb_lignes)],
+        'champ_proeco': np.where(rng.random(nb_lignes) < 0.5, 'teldomi', 'gsm'),
+        'numero': [f"0{i % 500:03d}/12.34 56" for i in range(nb_lignes)],
+        # dates Proeco entre 1901 et 2050, avec quelques valeurs sentinelles
+        'date_naissance': np.where(rng.random(nb_lignes) < 0.05, 0,
+                                   DateUtils.datetime64_to_dateproeco(pd.Series(
+                                       pd.to_datetime('1901-01-01')
+                                       + pd.to_timedelta(rng.integers(0, 54000, nb_lignes), unit='D')))),
+    })
+
+
+def apply_ligne_par_ligne(df: pd.DataFrame) -> pd.DataFrame:
+    resultat = pd.DataFrame(index=df.index)
+    resultat['eid'] = df.apply(lambda row: config.get_eid(row), 1)
+    resultat['lieunaiss'] = df['lieunaiss'].apply(lambda x: unidecode(str(x).upper()).strip() if pd.notna(x) else None)
+    resultat['paynaiss'] = df['paynaiss'].apply(lambda x: unidecode(str(x).upper()).strip() if pd.notna(x) else None)
+    resultat['lieu_naissance_hors_belgique'] = resultat.apply(
+        lambda row: row['lieunaiss'] if row['paynaiss'] != 'BE' else None, axis=1)
+    for option in ['code_domaine', 'code_type', 'est_individuel', 'est_principal']:
+        resultat[option] = df.apply(lambda row: config.PHONE_FIELDS.get(row['champ_proeco']).get(option), axis=1)
+    resultat['numero'] = df['numero'].apply(lambda x: x.replace(' ', '').replace('.', '').replace('/', ''))
+    resultat['date_naissance'] = df['date_naissance'].apply(lambda x: DateUtils.convert_dateproeco_to_date(x))
+    return resultat
+
+
+def vectorise(df: pd.DataFrame) -> pd.DataFrame:
+    resultat = pd.DataFrame(index=df.index)
+    resultat['eid'] = config.get_eids(df)
+    resultat['lieunaiss'] = normaliser_texte(df['lieunaiss'])
+    resultat['paynaiss'] = normaliser_texte(df['paynaiss'])
+    resultat['lieu_naissance_hors_belgique'] = resultat['lieunaiss'].where(resultat['paynaiss'] != 'BE', None)
+    champs_phones = champs_config(config.PHONE_FIELDS, ['code_domaine', 'code_type', 'est_individuel', 'est_principal'])
+    resultat = resultat.join(df[['champ_proeco']].join(champs_phones, on='champ_proeco').drop(columns='champ_proeco'))
+    resultat['numero'] = df['numero'].str.replace(r'[ ./]', '', regex=True)
+    resultat['date_naissance'] = DateUtils.dateproeco_to_datetime64(df['date_naissance'])
+    return resultat
+
+
+def mesurer(fonction, df: pd.DataFrame, label: str) -> tuple[float, pd.DataFrame]:
+    debut = time.perf_counter()
+    resultat = fonction(df)
+    duree = time.perf_counter() - debut
+    print(f"{label:<10} {len(df):>9} lignes en {duree:8.2f}s -> {len(df) / duree:12.0f} lignes/s")
+    return duree, resultat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark apply vs vectorisation")
+    parser.add_argument('--rows', type=int, default=100000, help="Nombre de lignes à transformer")
+    args = parser.parse_args()
+
+    df = generer_enseignants(args.rows)
+    duree_apply, attendu = mesurer(apply_ligne_par_ligne, df, 'apply')
+    duree_vectorise, obtenu = mesurer(vectorise, df, 'vectorisé')
+
+    # Les EID contiennent une partie aléatoire, on ne compare que l'alias
+    attendu['eid'] = attendu['eid'].str.rsplit('_', n=1).str[0]
+    obtenu['eid'] = obtenu['eid'].str.rsplit('_', n=1).str[0]
+    pd.testing.assert_frame_equal(attendu.astype(object).where(attendu.notna(), None),
+                                  obtenu.astype(object).where(obtenu.notna(), None))
+    print(f"La version vectorisée est {duree_apply / duree_vectorise:.1f}x plus rapide")
+
+
+if __name__ == '__main__':
+    main()
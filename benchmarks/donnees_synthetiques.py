@@ -0,0 +1,261 @@
+"""
+Données synthétiques pour les benchmarks : base Sigale de substitution (schémas core et personnes avec les données
+de référence) et tables Proeco PERSONNE et FONCTION, dans une base postgresql de test
+
+Les tables Proeco sont créées dans le schéma SCHEMA_PROECO de la même base, lu via le search_path de proeco_engine
+La base doit être dédiée aux benchmarks : les schémas core et personnes sont supprimés puis recréés,
+ce qui n'est fait que s'ils n'existent pas encore ou s'ils ont été créés par ce module (table MARQUEUR)
+"""
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text, Engine, inspect
+
+from migration_mdps_proeco_sigale.date_utils import DateUtils
+from migration_mdps_proeco_sigale.db.sql_write_methods import WriteMethods
+
+SCHEMA_PROECO = 'bench_proeco'
+# Table créée avec les schémas de substitution, pour ne jamais supprimer un vrai Sigale
+MARQUEUR = 'benchmark_stand_in'
+
+DDL_SIGALE = f"""
+create schema core;
+create schema personnes;
+create table core.{MARQUEUR} (created_on timestamp default now());
+create table core.parameter_types (id serial primary key, code text);
+create table core.parameter_values (id serial primary key, parameter_type_id int, code text);
+create table core.countries (id serial primary key, code text);
+create table core.cities (id serial primary key, name text, postal_code text);
+create table core.oauth_users (id serial primary key, technical_id text, business_id text, display_name text,
+ is_active bool, default_role_id int, culture_id int, created_by int, created_by_display text, created_on timestamp,
+ updated_by int, updated_by_display text, updated_on timestamp, optimistic_lock_version int);
+create table core.roles (id serial primary key, code text);
+create table core.i18n_cultures (id serial primary key, code text);
+create table core.oauth_users_roles_roles ("rolesId" int, "oauthUsersId" int);
+create table personnes.personnes (id serial primary key, matric_mdp int, nom text, prenom text, eid text,
+ registre_national_numero text unique, date_naissance date, sexe_id int, pays_id_nationalite int,
+ pays_id_naissance_pays int, city_id_naissance int, lieu_naissance_hors_belgique text, etat_civil_id int,
+ est_collaborateur_rh bool, est_confidentielle bool, est_membre_personnel bool,
+ created_by int not null, created_by_display text, created_on timestamp, updated_by int, updated_by_display text,
+ updated_on timestamp, optimistic_lock_version int);
+create table personnes.personne_emails (id serial primary key, personne_id int not null, valeur text,
+ email_domaine_id int, est_individuel bool, est_principal bool,
+ created_by int not null, created_by_display text, created_on timestamp, updated_by int, updated_by_display text,
+ updated_on timestamp, optimistic_lock_version int);
+create table personnes.personne_telephones (id serial primary key, personne_id int not null, numero text,
+ telephone_domaine_id int, telephone_type_id int, est_individuel bool, est_principal bool,
+ created_by int not null, created_by_display text, created_on timestamp, updated_by int, updated_by_display text,
+ updated_on timestamp, optimistic_lock_version int);
+create table personnes.personne_adresses (id serial primary key, personne_id int not null, street text,
+ postal_code text, city_name text, city_id int, country_id int not null, adresse_type_id int, est_principale bool,
+ created_by int not null, created_by_display text, created_on timestamp, updated_by int, updated_by_display text,
+ updated_on timestamp, optimistic_lock_version int);
+create index on personnes.personne_emails (personne_id);
+create index on personnes.personne_telephones (personne_id);
+create index on personnes.personne_adresses (personne_id);
+"""
+
+# Codes des paramètres utilisés par la config par défaut
+PARAMETRES_SIGALE = {
+    'sexes_sigale': ['feminin', 'masculin'],
+    'etats_civils': ['cohabitant_legal', 'celibataire', 'divorce', 'marie', 'veuf', 'cohabitant', 'separe',
+                     'separe_corp', 'religieux', 'decede', 'remarie'],
+    'email_domaines': ['prive', 'institutionnel'],
+    'telephone_domaines': ['institutionnel', 'etablissement', 'prive', 'professionnel'],
+    'telephone_types': ['fixe', 'mobile'],
+    'adresse_types': ['domicile', 'residence', 'professionnelle'],
+}
+PAYS = ['BE', 'FR', 'NL', 'DE', 'IT', 'LU', 'ES', 'MA', 'TR', 'PL']
+COMMUNES = ['Liège', 'Namur', 'Bruxelles', 'Ixelles', 'Mons', 'Charleroi', 'Wavre', 'Arlon', 'Huy', 'Verviers', 'Spa',
+            'Tournai', 'Nivelles', 'Ottignies-Louvain-la-Neuve', 'Braine-l\'Alleud', 'Seraing', 'Herstal', 'Dinant',
+            'Bastogne', 'Marche-en-Famenne', 'Mouscron', 'La Louvière', 'Waterloo', 'Gembloux', 'Ciney']
+ETATS_CIVILS_PROECO = list('LCDMVOSYGZR')
+
+COLONNES_PERSONNE = ['matric', 'nom', 'prenom', 'sexe', 'nation', 'paynaiss', 'lieunaiss', 'etatcivil',
+                     'ruedomi', 'paysdomi', 'cpostdomi', 'commdomi', 'locadomi', 'zonedomi', 'teldomi',
+                     'rueresi', 'paysresi', 'cpostresi', 'commresi', 'locaresi', 'zoneresi', 'telresi', 'gsm',
+                     'email', 'email2', 'telbureau', 'matriche', 'reserved', 'reservef', 'regnat1', 'datnaiss']
+
+
+def verifier_base(engine: Engine):
+    """
+    Refuse une base contenant des schémas core ou personnes qui n'ont pas été créés par ce module
+    """
+    inspecteur = inspect(engine)
+    schemas = set(inspecteur.get_schema_names())
+    if schemas & {'core', 'personnes'} and MARQUEUR not in inspecteur.get_table_names(schema='core'):
+        raise RuntimeError(f"La base {engine.url.render_as_string(hide_password=True)} contient un schéma core ou "
+                           f"personnes qui n'a pas été créé par les benchmarks, utilisez une base dédiée")
+
+
+def generer_villes(nb_villes: int) -> pd.DataFrame:
+    """
+    Villes de core.cities : les communes de COMMUNES puis des communes fictives, un ou plusieurs codes postaux par nom
+    """
+    noms = COMMUNES + [f"Commune {i}" for i in range(max(nb_villes - len(COMMUNES), 0))]
+    villes = pd.DataFrame({'name': noms[:nb_villes]})
+    villes['postal_code'] = (1000 + np.arange(len(villes)) * 7 % 9000).astype(str)
+    # Quelques communes avec plusieurs codes postaux, comme Liège (4000, 4020, ...)
+    sections = villes.head(len(COMMUNES)).assign(postal_code=lambda v: (v['postal_code'].astype(int) + 20).astype(str))
+    return pd.concat([villes, sections], ignore_index=True)
+
+
+def creer_sigale(engine: Engine, villes: pd.DataFrame):
+    """
+    (Re)crée les schémas core et personnes avec les données de référence, sans personnes
+    """
+    verifier_base(engine)
+    with engine.begin() as conn:
+        conn.execute(text("drop schema if exists personnes cascade"))
+        conn.execute(text("drop schema if exists core cascade"))
+        conn.exec_driver_sql(DDL_SIGALE)
+        for type_code, codes in PARAMETRES_SIGALE.items():
+            type_id = conn.execute(text("insert into core.parameter_types (code) values (:code) returning id"),
+                                   {'code': type_code}).scalar()
+            conn.execute(text("insert into core.parameter_values (parameter_type_id, code) values (:type_id, :code)"),
+                         [{'type_id': type_id, 'code': code} for code in codes])
+        conn.execute(text("insert into core.countries (code) values (:code)"), [{'code': code} for code in PAYS])
+        conn.execute(text("insert into core.roles (code) values ('unknown')"))
+        conn.execute(text("insert into core.i18n_cultures (code) values ('fr')"))
+        villes.to_sql('cities', conn, schema='core', index=False, if_exists='append',
+                      method=WriteMethods.insert_method(conn))
+
+
+def registres_nationaux(dates_naissance: pd.Series, numeros: np.ndarray) -> pd.Series:
+    """
+    Numéros de registre national valides : date de naissance aammjj, numéro d'ordre sur 3 chiffres et checksum modulo 97
+    (le checksum des personnes nées à partir de 2000 est calculé sur 2 suivi des 9 premiers chiffres)
+    """
+    base = ((dates_naissance.dt.year % 100) * 10 ** 7 + dates_naissance.dt.month * 10 ** 5
+            + dates_naissance.dt.day * 10 ** 3 + numeros).astype('int64')
+    checksum = 97 - np.where(dates_naissance.dt.year >= 2000, (2_000_000_000 + base) % 97, base % 97)
+    return base.astype(str).str.zfill(9) + pd.Series(checksum, index=base.index).astype(str).str.zfill(2)
+
+
+def generer_personnes(nb_personnes: int, villes: pd.DataFrame, seed: int = 42) -> pd.DataFrame:
+    """
+    Génère la table PERSONNE de Proeco, avec quelques cas particuliers en proportion réaliste :
+    registres nationaux formatés (points et tirets), checksums invalides, doublons, villes en majuscules ou inconnues,
+    contacts manquants
+    """
+    rng = np.random.default_rng(seed)
+
+    def choix(valeurs: list, probabilites: list | None = None):
+        return np.array(valeurs, dtype=object)[rng.choice(len(valeurs), nb_personnes, p=probabilites)]
+
+    def proportion(p: float) -> np.ndarray:
+        return rng.random(nb_personnes) < p
+
+    def vide_si(masque: np.ndarray, valeurs, vide=None) -> np.ndarray:
+        return np.where(masque, vide, np.asarray(valeurs, dtype=object))
+
+    matric = np.arange(1, nb_personnes + 1)
+    # Dates et numéros d'ordre tirés d'une permutation : registres nationaux uniques jusqu'à 20 millions de personnes
+    jours = pd.date_range('1950-01-01', '2004-12-31', freq='D')
+    ordre = rng.permutation(nb_personnes)
+    dates_naissance = pd.Series(jours[ordre % len(jours)])
+    registres = registres_nationaux(dates_naissance, ordre // len(jours) % 998 + 1)
+    # Checksums invalides
+    invalides = proportion(0.005)
+    registres[invalides] = registres[invalides].str[:-2] + ((registres[invalides].str[-2:].astype(int) + 1) % 100)\
+        .astype(str).str.zfill(2)
+    # Numéros formatés comme dans Proeco, nettoyés par la migration
+    formates = proportion(0.03)
+    registres[formates] = registres[formates].str.replace(r'^(\d{2})(\d{2})(\d{2})(\d{3})(\d{2})$',
+                                                          r'\1.\2.\3-\4.\5', regex=True)
+    # Doublons : le registre national de la personne précédente
+    doublons = np.flatnonzero(proportion(0.001))
+    doublons = doublons[doublons > 0]
+    registres.iloc[doublons] = registres.iloc[doublons - 1].to_numpy()
+
+    def adresse(suffixe: str, absente: float) -> dict:
+        ville = villes.iloc[rng.integers(0, len(villes), nb_personnes)]
+        sans_adresse = proportion(absente)
+        nom_ville = ville['name'].to_numpy(dtype=object)
+        # Variantes de saisie : majuscules, espaces, ville inconnue de Sigale
+        nom_ville = np.where(proportion(0.2), np.char.upper(nom_ville.astype(str)).astype(object), nom_ville)
+        nom_ville = np.where(proportion(0.02), 'Localité inconnue', nom_ville)
+        return {
+            f"rue{suffixe}": vide_si(sans_adresse, [f"Rue {i % 4999} {i % 97 + 1}" for i in range(nb_personnes)], ''),
+            f"pays{suffixe}": vide_si(sans_adresse, choix(['BE', 'be', 'FR', 'NL', 'LU'], [0.9, 0.03, 0.04, 0.02, 0.01]), ''),
+            f"cpost{suffixe}": vide_si(sans_adresse, ville['postal_code'], ''),
+            f"comm{suffixe}": vide_si(sans_adresse, nom_ville, ''),
+            f"loca{suffixe}": '',
+            f"zone{suffixe}": '',
+        }
+
+    personnes = pd.DataFrame({
+        'matric': matric,
+        'nom': [f"Nom{i}" for i in matric],
+        'prenom': choix([f"Prénom{i}" for i in range(3000)]),
+        'sexe': choix(['M', 'F', 'm', 'f'], [0.35, 0.55, 0.04, 0.06]),
+        'nation': choix(['BE', 'be', 'FR', 'IT', 'NL', 'MA'], [0.85, 0.02, 0.05, 0.03, 0.02, 0.03]),
+        'paynaiss': choix(['BE', 'FR', 'IT', 'MA', None], [0.8, 0.06, 0.04, 0.05, 0.05]),
+        'lieunaiss': np.where(proportion(0.1), choix(['PARIS', 'ROME', 'CASABLANCA']),
+                              np.char.upper(villes['name'].to_numpy(dtype=str)[rng.integers(0, len(villes),
+                                                                                            nb_personnes)]).astype(object)),
+        'etatcivil': choix(ETATS_CIVILS_PROECO),
+        **adresse('domi', 0.01),
+        'teldomi': vide_si(proportion(0.4), [f"04/{i % 1000:03d}.{i % 100:02d}.{i % 97:02d}" for i in matric]),
+        **adresse('resi', 0.9),
+        'telresi': None,
+        'gsm': vide_si(proportion(0.2), [f"0470 {i % 1000000:06d}" for i in matric]),
+        'email': vide_si(proportion(0.1), [f"personne{i}@exemple.be" for i in matric]),
+        'email2': vide_si(proportion(0.7), [f"p{i}@ecole.be" for i in matric]),
+        'telbureau': None,
+        'matriche': None,
+        'reserved': None,
+        'reservef': None,
+        'regnat1': registres.to_numpy(),
+        'datnaiss': DateUtils.datetime64_to_dateproeco(dates_naissance).to_numpy(),
+    })
+    return personnes[COLONNES_PERSONNE]
+
+
+def generer_fonctions(personnes: pd.DataFrame, seed: int = 42) -> pd.DataFrame:
+    """
+    Génère la table FONCTION : 1 à 3 fonctions par personne, sans date de fin (contrat en cours) ou terminées
+    """
+    rng = np.random.default_rng(seed)
+    matric = np.repeat(personnes['matric'].to_numpy(), rng.integers(1, 4, len(personnes)))
+    fins = pd.Series(pd.to_datetime('1990-01-01') + pd.to_timedelta(rng.integers(0, 15000, len(matric)), unit='D'))
+    datefin = DateUtils.datetime64_to_dateproeco(fins).mask(rng.random(len(matric)) < 0.6)
+    return pd.DataFrame({'matric': matric, 'datefin': datefin.to_numpy()})
+
+
+def creer_proeco(engine: Engine, personnes: pd.DataFrame, fonctions: pd.DataFrame):
+    """
+    (Re)crée les tables PERSONNE et FONCTION dans le schéma SCHEMA_PROECO
+    """
+    with engine.begin() as conn:
+        conn.execute(text(f"drop schema if exists {SCHEMA_PROECO} cascade"))
+        conn.execute(text(f"create schema {SCHEMA_PROECO}"))
+        conn.exec_driver_sql(f"create table {SCHEMA_PROECO}.personne ("
+                             + ', '.join(f"{colonne} {'int' if colonne in ('matric', 'datnaiss') else 'text'}"
+                                         for colonne in COLONNES_PERSONNE) + ")")
+        conn.exec_driver_sql(f"create table {SCHEMA_PROECO}.fonction (matric int, datefin int)")
+        methode = WriteMethods.insert_method(conn)
+        personnes.to_sql('personne', conn, schema=SCHEMA_PROECO, index=False, if_exists='append', method=methode,
+                         chunksize=100000)
+        fonctions.to_sql('fonction', conn, schema=SCHEMA_PROECO, index=False, if_exists='append', method=methode,
+                         chunksize=100000)
+        conn.exec_driver_sql(f"create index on {SCHEMA_PROECO}.fonction (matric)")
+
+
+def modifier_proeco(engine: Engine, proportion: float = 0.1):
+    """
+    Modifie une partie des personnes Proeco (nom, gsm, adresse), pour mesurer une synchro après une première migration
+    """
+    modulo = max(round(1 / proportion), 1)
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+update {SCHEMA_PROECO}.personne
+set nom = nom || ' bis', gsm = '0499 ' || lpad(matric::text, 6, '0'), ruedomi = 'Rue modifiée ' || matric
+where matric % :modulo = 0
+"""), {'modulo': modulo})
+
+
+def proeco_engine(url: str) -> Engine:
+    """
+    Engine lisant les tables Proeco synthétiques, PERSONNE et FONCTION résolus dans SCHEMA_PROECO
+    """
+    return create_engine(url, connect_args={'options': f"-csearch_path={SCHEMA_PROECO}"})
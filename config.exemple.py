@@ -4,6 +4,25 @@ from typing import Dict, Literal
 # Options de connection à Firebird
 FIREBIRD_CONNECT_ARGS:dict = {"charset" : "ISO8859_1"}
 
+# Bases Proeco à migrer (une par établissement), dans FIREBIRD_DB_BASE_PATH. Les bases sont lues en parallèle
+# puis fusionnées, les doublons de registre national entre bases suivent la même règle (--drop-duplicates)
+PROECO_DATABASES: list[str] = ['PROF.FDB']
+
+# Pool de connexions des engines Proeco et Sigale, un seul engine par base pour tout le run
+POOL_SIZE: int = 5
+POOL_MAX_OVERFLOW: int = 5
+# Durée maximale d'une connexion en secondes, avant qu'elle soit coupée par le serveur ou un firewall
+POOL_RECYCLE: int = 1800
+# Vérifie les connexions avant de les utiliser, une connexion coupée est remplacée
+POOL_PRE_PING: bool = True
+# Niveau d'isolation de la connexion partagée par les lectures de Sigale d'un run, REPEATABLE READ pour que
+# toutes les lectures voient un même état de Sigale. None pour le niveau par défaut du serveur
+SIGALE_READ_ISOLATION_LEVEL: str | None = 'REPEATABLE READ'
+# Nombre de lignes récupérées par fetch, les lectures passent par un curseur côté serveur
+# et la dataframe est construite lot par lot, sans charger tout le résultat dans le driver
+SIGALE_ITERSIZE: int = 10000
+PROECO_FETCH_SIZE: int = 10000
+
 # Code culture par défaut des nouveaux utilisateurs
 USERS_DEFAULT_CULTURE_CODE = 'fr'
 
@@ -23,6 +42,23 @@ SIGALE_METADATA_FIELDS:dict = {
     'optimistic_lock_version': 1
 }
 
+# Si à True, les lignes existantes dont les champs à mettre à jour ont déjà les mêmes valeurs dans Sigale
+# ne sont pas mises à jour (pas de réécriture de updated_on pour rien)
+SKIP_UNCHANGED_UPDATES: bool = True
+
+# Méthode d'insertion des nouvelles lignes dans Sigale
+# 'copy' utilise COPY FROM STDIN (postgresql uniquement, beaucoup plus rapide sur de gros volumes)
+# 'insert' utilise l'INSERT par défaut de pandas, utilisé automatiquement si la base n'est pas postgresql
+SIGALE_INSERT_METHOD: Literal['copy', 'insert'] = 'copy'
+
+# Nombre de lignes envoyées par requête lors des mises à jour (INSERT ... ON CONFLICT DO UPDATE)
+SIGALE_UPDATE_BATCH_SIZE: int = 1000
+# Si à True, la taille des lots est adaptée à la durée des requêtes (doublée si rapide, divisée par deux si lente)
+# en partant de SIGALE_UPDATE_BATCH_SIZE
+SIGALE_UPDATE_ADAPTIVE_BATCH: bool = False
+# Durée visée par requête de mise à jour, en secondes, si SIGALE_UPDATE_ADAPTIVE_BATCH est à True
+SIGALE_UPDATE_TARGET_LATENCY: float = 0.5
+
 # Si à True, s'assure de ne modifier que les lignes créées par la migration (pour adresses, téléphones et emails)
 # Cela permet de ne pas modifier des données manuellement saisies dans Sigale, des téléphones/adresses/emails ajoutés
 UPDATE_ONLY_CREATED_BY_MIGRATION:bool = True
@@ -167,15 +203,81 @@ ADRESSES_FIELDS: Dict[Literal['domi', 'resi'], Dict] = {
     }
 }
 
+# Contrôle du checksum (modulo 97) des numéros de registre national Proeco
+# Les enseignants dont le numéro est invalide sont rejetés et listés dans l'export EXPORT_PATH/rejets_registre_national
+CONTROLE_CHECKSUM_REGISTRE_NATIONAL: bool = True
+
+# Recherche approchante des villes (fautes de frappe) par trigrammes, quand ni le code postal + nom ni le nom seul
+# ne correspondent à une ville de Sigale. Le seuil est la similarité minimale entre les noms, de 0 à 1
+CITY_INDEX_TRIGRAMMES: bool = False
+CITY_INDEX_SEUIL_TRIGRAMMES: float = 0.7
+
+# Snapshot sur disque des données de référence de Sigale (parameter_values, pays, villes)
+# None pour toujours les recharger depuis Sigale, sinon chemin du fichier de snapshot, ex: 'cache/references.pkl'
+# Permet de démarrer instantanément les dry-run successifs. Utilisé uniquement en dry run, et relu seulement pour la même
+# base Sigale (url de connexion) : un run réel relit toujours les données de référence depuis Sigale
+REFERENCE_CACHE_SNAPSHOT: str | None = None
+# Durée de validité du snapshot en secondes, il est rechargé depuis Sigale au-delà
+REFERENCE_CACHE_TTL: int = 3600
+
+# Snapshot local de Proeco (et de Sigale avec --sigale), créé par `python main.py snapshot` et lu avec --from-snapshot
+# Les dry runs successifs lisent les fichiers du snapshot au lieu d'interroger Proeco (pyarrow requis)
+SNAPSHOT_PATH: str = 'snapshot'
+
+# Synchro delta : si à True, seuls les enseignants nouveaux ou modifiés dans Proeco depuis la dernière synchro
+# sont migrés (équivalent à l'option --delta), l'option --full force une synchro complète
+DELTA_SYNC: bool = False
+# Fichier où sont conservés les hash de contenu par matricule pour la synchro delta
+DELTA_STATE_FILE: str = 'state/delta_sync.pkl'
+
+# Traitement par lots : None pour lire toute la table PERSONNE en une fois, sinon nombre d'enseignants par lot
+# (équivalent à l'option --chunk-size), la mémoire utilisée dépend alors de la taille des lots et non de la table
+PROECO_CHUNK_SIZE: int | None = None
+
+# Types compacts pour les données extraites de Proeco (voir dtypes.DTYPES_PROECO) : category pour les codes,
+# entiers nullables, chaînes pyarrow si pyarrow est installé. False pour garder les types par défaut de pandas
+COMPACT_DTYPES: bool = True
+
+# Nombre d'étapes emails/téléphones/adresses exécutées en parallèle (équivalent à l'option --parallel-stages),
+# 1 pour les exécuter l'une après l'autre. Chaque étape lit via sa propre connexion Sigale, dans le même snapshot
+# (pg_export_snapshot) : le pool (POOL_SIZE + POOL_MAX_OVERFLOW) doit compter au moins 1 + 2 * PARALLEL_STAGES connexions
+PARALLEL_STAGES: int = 1
+
+# Points de reprise : les enseignants extraits de Proeco et les étapes terminées sont enregistrés dans
+# CHECKPOINT_PATH/<run-id> (parquet si pyarrow est installé), un run interrompu peut être repris avec --resume <run-id>
+# Pas de points de reprise en dry run
+CHECKPOINTS: bool = True
+CHECKPOINT_PATH: str = 'checkpoints'
+# Conserve les points de reprise d'un run terminé, supprimés par défaut
+CHECKPOINT_KEEP: bool = False
+
 # Chemin de fichier pour les exports
 EXPORT_PATH:str = 'exports'
+# Format des exports (équivalent à l'option --export-format) : csv, csv.gz (compressé) ou parquet (pyarrow requis),
+# parquet est recommandé pour les gros runs : plus rapide, plus compact et conserve les types des colonnes
+EXPORT_FORMAT: str = 'csv'
+# Nombre de lignes converties et écrites à la fois (row group en parquet)
+EXPORT_ROW_GROUP_SIZE: int = 50000
+# Rapport des différences (équivalent à l'option --diff-report) : pour les personnes, emails, téléphones et adresses
+# existants, nombre de changements par champ (export diff_champs) et champs modifiés avec leur valeur actuelle dans
+# Sigale et la valeur proposée (exports diff_<table>), pour relire un dry run sans ouvrir les exports complets
+DIFF_REPORT: bool = False
 
 # fichier de logs
 LOGS_FILE: str = 'logs/logs_migration.log'
 
+# Rapport des mesures du run (durée, lignes, insertions/mises à jour et mémoire par étape), écrit en json
+# dans le dossier de LOGS_FILE : metrics_<date>_<heure>.json
+METRICS_REPORT: bool = True
+# Fichier texte au format Prometheus (collecteur textfile de node_exporter) avec les mesures du dernier run,
+# ex: 'logs/metrics_migration.prom', None pour ne pas l'écrire
+METRICS_PROMETHEUS_FILE: str | None = None
+
 # Fonction qui calcule le EID en fonction des champs de Proeco
 # Vous pouvez utiliser n'importe quelle colonne présente dans la liste
 # attributs_personne dans run.py:75
+# Une version vectorisée get_eids(enseignants: pd.DataFrame) -> pd.Series (voir la config par défaut) peut être
+# ajoutée pour les gros volumes : elle est alors utilisée à la place de get_eid et doit donner les mêmes EID
 def get_eid(row: Dict) -> str:
     # pour l'exemple, ici l'EID est concaténé depuis les champs matric et reserved
     return str(row['matric']) + str(row['reserved'])
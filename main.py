@@ -12,22 +12,61 @@ from migration_mdps_proeco_sigale.db.proeco_connector import ProecoConnector
 import sys
 
 from migration_mdps_proeco_sigale.db.sigale_connector import SigaleConnector
+from migration_mdps_proeco_sigale.export import EXPORT_FORMATS
 from migration_mdps_proeco_sigale.run import run_migrations
+from migration_mdps_proeco_sigale.snapshot import creer_snapshot
 
 
 def test():
 
     logger = create_logger(loglevel='debug', write_to_file=False, write_to_stdout=True)
-    # On initie le connecteur Proeco
-    proeco_connector = ProecoConnector('PROF.FDB')
-    # test de la connexion
-    proeco_connector.test_connection(logger=logger)
+    # On initie un connecteur par base Proeco
+    for proeco_db in config.PROECO_DATABASES:
+        proeco_connector = ProecoConnector(proeco_db, config=config)
+        # test de la connexion
+        proeco_connector.test_connection(logger=logger)
 
     ## Même chose pour Sigale
-    sigale_connector = SigaleConnector()
+    sigale_connector = SigaleConnector(config=config)
     sigale_connector.test_connection(logger=logger)
 
 
+def create_proeco_engines(proeco_databases: list[str], logger: logging.Logger) -> dict:
+    # On initie un connecteur par base Proeco, les bases sont lues en parallèle puis fusionnées
+    proeco_engines = {}
+    for proeco_db in proeco_databases:
+        proeco_connector = ProecoConnector(proeco_db, config=config)
+        # test de la connexion
+        proeco_connector.test_connection(logger=logger)
+        # Création du connecteur, même engine que pour le test de connexion
+        proeco_engines[proeco_db] = proeco_connector.create_engine()
+    return proeco_engines
+
+
+def snapshot():
+    # Enregistre un snapshot local de Proeco (et de Sigale), pour les dry runs avec --from-snapshot
+    parser = argparse.ArgumentParser(prog='main.py snapshot',
+                                     description='Enregistre un snapshot local de Proeco, lu ensuite avec --from-snapshot')
+    parser.add_argument('--path', dest='snapshot_path', default=config.SNAPSHOT_PATH,
+                        help="Dossier du snapshot, SNAPSHOT_PATH de la config par défaut")
+    parser.add_argument('--sigale', action='store_true', dest='sigale', default=False,
+                        help="Enregistre aussi les données de référence et les contacts Sigale des enseignants, "
+                             "lus depuis le snapshot en dry run")
+    parser.add_argument('--proeco-db', action='append', dest='proeco_databases', default=None,
+                        help="Base Proeco à enregistrer (à répéter pour plusieurs bases, PROECO_DATABASES par défaut)")
+    parser.add_argument('-log', '--loglevel', default='info')
+    args = parser.parse_args(sys.argv[2:])
+
+    logger = create_logger(loglevel=args.loglevel)
+    proeco_engines = create_proeco_engines(args.proeco_databases or config.PROECO_DATABASES, logger)
+    sigale_engine = None
+    if args.sigale:
+        sigale_connector = SigaleConnector(config=config)
+        sigale_connector.test_connection(logger=logger)
+        sigale_engine = sigale_connector.create_engine()
+    creer_snapshot(args.snapshot_path, proeco_engines, sigale_engine, logger=logger, config=config)
+
+
 def create_logger(loglevel = 'INFO', write_to_file: bool = True, write_to_stdout: bool = True) -> logging.Logger:
 
     logger = logging.getLogger(name='logger_migration_mdps_sigale')
@@ -63,12 +102,36 @@ def main():
                         help='Supprime les registres nationaux en doublons (stop la synchro sinon)')
     parser.add_argument('--export', action='store_true', dest='export', default=False,
                         help='Exporte les données en csv')
+    parser.add_argument('--export-format', dest='export_format', choices=EXPORT_FORMATS, default=config.EXPORT_FORMAT,
+                        help="Format des exports : csv, csv.gz ou parquet (recommandé pour les gros runs, pyarrow requis)")
+    parser.add_argument('--diff-report', action='store_true', dest='diff_report', default=config.DIFF_REPORT,
+                        help="Exporte les changements champ par champ par rapport à Sigale des lignes existantes "
+                             "(exports diff_champs et diff_<table>)")
     parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False,
                         help="Tester la synchro, n'importe pas en db")
     parser.add_argument('--no-update', action='store_false', dest='update', default=True,
                         help="N'ajoute que les nouveaux enseignants, pas de mise à jour")
     parser.add_argument('--create-users', action='store_true', dest='create_users', default=False,
                         help="Créé les utilisateurs en même temps")
+    parser.add_argument('--staging-merge', action='store_true', dest='staging_merge', default=False,
+                        help="Ajout/mise à jour côté serveur via des tables de staging (postgresql uniquement)")
+    parser.add_argument('--delta', action='store_true', dest='delta_sync', default=config.DELTA_SYNC,
+                        help="Ne migre que les enseignants nouveaux ou modifiés depuis la dernière synchro delta")
+    parser.add_argument('--full', action='store_true', dest='full_sync', default=False,
+                        help="Force une synchro complète en mode delta (à utiliser après une modification de la config)")
+    parser.add_argument('--chunk-size', type=int, dest='chunk_size', default=config.PROECO_CHUNK_SIZE,
+                        help="Lit et migre les enseignants Proeco par lots de CHUNK_SIZE")
+    parser.add_argument('--parallel-stages', type=int, dest='parallel_stages', default=config.PARALLEL_STAGES,
+                        help="Exécute les étapes emails, téléphones et adresses en parallèle sur N threads")
+    parser.add_argument('--proeco-db', action='append', dest='proeco_databases', default=None,
+                        help="Base Proeco à migrer, dans FIREBIRD_DB_BASE_PATH (à répéter pour plusieurs bases, "
+                             "PROECO_DATABASES de la config par défaut)")
+    parser.add_argument('--resume', dest='resume', default=None, metavar='RUN_ID',
+                        help="Reprend un run interrompu à la première étape non terminée, à partir de ses points de reprise")
+    parser.add_argument('--from-snapshot', nargs='?', const=config.SNAPSHOT_PATH, dest='from_snapshot', default=None,
+                        metavar='SNAPSHOT_PATH',
+                        help="Lit Proeco (et Sigale en dry run) depuis un snapshot local créé par `main.py snapshot`, "
+                             "SNAPSHOT_PATH de la config par défaut")
     parser.add_argument('--no-stdout', action='store_false', dest='stdout', default=True, help="Pas d'impression des logs dans stdout")
     parser.add_argument('--no-logfile', action='store_false', dest='logfile', default=True,
                         help="Pas d'impression des logs dans le fichier")
@@ -84,25 +147,31 @@ def main():
     contrat_en_cours_uniquement = not args.historique
     action_when_duplicates: Literal['drop', 'stop'] = 'drop' if args.drop_duplicates else 'stop'
     export = args.export
+    export_format = args.export_format
     dry_run = args.dry_run
     update = args.update
     create_users = args.create_users
-
-    # On initie le connecteur Proeco
-    proeco_connector = ProecoConnector('PROF.FDB')
-    # test de la connexion
-    proeco_connector.test_connection(logger=logger)
-    # Création du connecteur
-    proeco_engine = proeco_connector.create_engine()
+    staging_merge = args.staging_merge
+    delta_sync = args.delta_sync
+    full_sync = args.full_sync
+    chunk_size = args.chunk_size
+    parallel_stages = args.parallel_stages
+    proeco_databases = args.proeco_databases or config.PROECO_DATABASES
+    resume = args.resume
+    from_snapshot = args.from_snapshot
+    diff_report = args.diff_report
+
+    # Avec un snapshot local, Proeco n'est pas interrogé
+    proeco_engines = None if from_snapshot else create_proeco_engines(proeco_databases, logger)
 
     ## Même chose pour Sigale
-    sigale_connector = SigaleConnector()
+    sigale_connector = SigaleConnector(config=config)
     sigale_connector.test_connection(logger=logger)
     sigale_engine = sigale_connector.create_engine()
 
     # On lance les migrations avec les options passées dans main
     run_migrations(
-        proeco_engine=proeco_engine,
+        proeco_engine=proeco_engines,
         sigale_engine=sigale_engine,
         logger=logger,
         contrat_en_cours_uniquement=contrat_en_cours_uniquement,
@@ -111,13 +180,23 @@ def main():
         dry_run=dry_run,
         update=update,
         export=export,
-        config=config
-
+        export_format=export_format,
+        staging_merge=staging_merge,
+        delta_sync=delta_sync,
+        full_sync=full_sync,
+        chunk_size=chunk_size,
+        parallel_stages=parallel_stages,
+        config=config,
+        resume=resume,
+        from_snapshot=from_snapshot,
+        diff_report=diff_report
     )
 
 
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == 'test':
         test()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'snapshot':
+        snapshot()
     else:
         main()
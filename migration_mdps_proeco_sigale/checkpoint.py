@@ -0,0 +1,136 @@
+import json
+import os
+import pickle
+import shutil
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_DISPONIBLE = True
+except ImportError:
+    PARQUET_DISPONIBLE = False
+
+
+class RunCheckpoint:
+    """
+    Points de reprise d'un run, dans le dossier checkpoint_path/run_id : dataframes extraites de Proeco et transformées,
+    et étapes de migration terminées (etat.json)
+    Un run interrompu peut être repris avec --resume run_id : les dataframes sont relues au lieu d'interroger Proeco
+    et Sigale, et les étapes déjà terminées sont ignorées
+    Les dataframes sont écrites en parquet si pyarrow est installé, sinon (ou si une colonne n'est pas convertible) en pickle
+    :param: checkpoint_path : dossier des points de reprise, CHECKPOINT_PATH de la config
+    :param: run_id : identifiant du run
+    :param: options : options du run, une reprise doit utiliser les mêmes
+    """
+
+    def __init__(self, checkpoint_path: str, run_id: str, options: dict):
+        self.run_id = run_id
+        self.dossier = os.path.join(checkpoint_path, run_id)
+        self.options = options
+        self.etapes_terminees: list[str] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def reprendre(cls, checkpoint_path: str, run_id: str, options: dict) -> 'RunCheckpoint':
+        """
+        Recharge les points de reprise d'un run interrompu
+        :raise FileNotFoundError: si le run n'a pas de points de reprise (run terminé ou identifiant inconnu)
+        :raise ValueError: si les options diffèrent de celles du run interrompu
+        """
+        checkpoint = cls(checkpoint_path, run_id, options)
+        path = os.path.join(checkpoint.dossier, 'etat.json')
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Aucun point de reprise pour le run {run_id} dans {checkpoint_path}")
+        with open(path, encoding='utf-8') as fichier:
+            etat = json.load(fichier)
+        differences = [nom for nom in set(etat['options']) | set(options)
+                       if etat['options'].get(nom) != options.get(nom)]
+        if differences:
+            raise ValueError(f"Le run {run_id} a été lancé avec d'autres options ({', '.join(sorted(differences))}), "
+                             f"relancez la reprise avec les mêmes options")
+        checkpoint.etapes_terminees = etat['etapes_terminees']
+        return checkpoint
+
+    def _path(self, nom: str) -> str:
+        return os.path.join(self.dossier, nom)
+
+    def _sauver_etat(self):
+        Path(self.dossier).mkdir(parents=True, exist_ok=True)
+        temporaire = self._path('etat.json.tmp')
+        with open(temporaire, 'w', encoding='utf-8') as fichier:
+            json.dump({'run_id': self.run_id, 'options': self.options, 'etapes_terminees': self.etapes_terminees},
+                      fichier, indent=2, default=str)
+        # Remplacement atomique, l'état reste lisible si le run est interrompu pendant l'écriture
+        os.replace(temporaire, self._path('etat.json'))
+
+    def save_frame(self, nom: str, data: pd.DataFrame):
+        """
+        Écrit une dataframe du run, en parquet si possible, sinon en pickle
+        """
+        with self._lock:
+            if not os.path.exists(self._path('etat.json')):
+                self._sauver_etat()
+            if PARQUET_DISPONIBLE:
+                try:
+                    data.to_parquet(self._path(f"{nom}.parquet"))
+                    return
+                except (ValueError, TypeError):
+                    # Colonne objet avec des types mélangés, non convertible en parquet
+                    Path(self._path(f"{nom}.parquet")).unlink(missing_ok=True)
+            with open(self._path(f"{nom}.pkl"), 'wb') as fichier:
+                pickle.dump(data, fichier, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load_frame(self, nom: str) -> pd.DataFrame | None:
+        """
+        Relit une dataframe écrite par save_frame, None si elle n'a pas été écrite
+        """
+        if os.path.exists(self._path(f"{nom}.parquet")):
+            return pd.read_parquet(self._path(f"{nom}.parquet"))
+        if os.path.exists(self._path(f"{nom}.pkl")):
+            return pd.read_pickle(self._path(f"{nom}.pkl"))
+        return None
+
+    def etape_terminee(self, etape: str) -> bool:
+        with self._lock:
+            return etape in self.etapes_terminees
+
+    def terminer_etape(self, etape: str):
+        """
+        Enregistre une étape terminée, ses modifications étant validées dans Sigale
+        """
+        with self._lock:
+            self.etapes_terminees.append(etape)
+            self._sauver_etat()
+
+    def verifier_lot(self, prefixe: str, cles: pd.DataFrame) -> bool:
+        """
+        Vérifie qu'un lot contient les mêmes enseignants qu'avant l'interruption du run : les lots étant relus
+        dans Proeco à la reprise, leur contenu peut avoir changé (enseignants ajoutés ou supprimés, contrats en cours
+        à une autre date). Les enseignants du lot sont enregistrés à sa première exécution, s'ils diffèrent à la reprise
+        les étapes terminées et les données du lot sont oubliées pour qu'il soit entièrement migré à nouveau
+        :param prefixe: préfixe des points de reprise du lot, ex: lot_PROF.FDB_1_500.
+        :param cles: enseignants du lot, colonnes source_proeco et matric
+        :return: False si le lot a changé depuis l'interruption
+        """
+        precedentes = self.load_frame(f"{prefixe}cles")
+        if precedentes is not None and pd.MultiIndex.from_frame(precedentes).sort_values().equals(
+                pd.MultiIndex.from_frame(cles).sort_values()):
+            return True
+        if precedentes is not None:
+            with self._lock:
+                self.etapes_terminees = [etape for etape in self.etapes_terminees if not etape.startswith(prefixe)]
+                self._sauver_etat()
+                for path in Path(self.dossier).glob(f"{prefixe}*"):
+                    path.unlink()
+        self.save_frame(f"{prefixe}cles", cles.reset_index(drop=True))
+        return precedentes is None
+
+    def terminer(self, conserver: bool = False):
+        """
+        Run terminé : supprime les points de reprise, sauf si conserver
+        """
+        if not conserver:
+            shutil.rmtree(self.dossier, ignore_errors=True)
@@ -0,0 +1,116 @@
+from collections import defaultdict, Counter
+
+import pandas as pd
+
+
+class CityIndex:
+    """
+    Index des villes de Sigale (core.cities) pour retrouver l'id d'une ville à partir du code postal et du nom
+    - index exact sur (code postal, nom normalisé)
+    - à défaut, index sur le nom normalisé seul, en gardant le plus petit code postal (4000 plutôt que 4020)
+    - optionnellement, recherche approchante par trigrammes sur le nom, pour les fautes de frappe
+    :param: cities : villes triées par code postal, colonnes ['id', 'postal_code', 'city_name'], voir ReferenceCache.cities
+    """
+
+    def __init__(self, cities: pd.DataFrame):
+        cities = cities.dropna(subset=['city_name'])
+        codes_postaux = normaliser_codes_postaux(cities['postal_code'])
+        # keep first, les villes étant triées par code postal
+        par_code_postal = pd.DataFrame({'postal_code': codes_postaux, 'city_name': cities['city_name'],
+                                        'id': cities['id']}).drop_duplicates(subset=['postal_code', 'city_name'])
+        par_nom = cities.drop_duplicates(subset=['city_name'], keep='first')
+
+        self._par_code_postal: dict[tuple[str, str], int] = dict(
+            zip(zip(par_code_postal['postal_code'], par_code_postal['city_name']), par_code_postal['id']))
+        self._par_nom: dict[str, int] = dict(zip(par_nom['city_name'], par_nom['id']))
+        self._trigrammes: dict[str, list[str]] | None = None
+        self._nb_trigrammes: dict[str, int] = {}
+
+    def match(self, noms: pd.Series, codes_postaux: pd.Series | None = None, approchant: bool = False,
+              seuil: float = 0.7) -> pd.Series:
+        """
+        Renvoie l'id de la ville de chaque ligne, NaN si aucune ville ne correspond, voir match_detail
+        """
+        return self.match_detail(noms, codes_postaux, approchant, seuil)['city_id']
+
+    def match_detail(self, noms: pd.Series, codes_postaux: pd.Series | None = None, approchant: bool = False,
+                     seuil: float = 0.7) -> pd.DataFrame:
+        """
+        Recherche les villes, une seule recherche par couple (code postal, nom) distinct
+        :param noms: noms de villes normalisés (majuscules, sans accents)
+        :param codes_postaux: codes postaux, None pour une recherche sur le nom seul
+        :param approchant: si aucune ville n'est trouvée, recherche le nom le plus proche par trigrammes
+        :param seuil: similarité minimale (0 à 1) entre les trigrammes pour une recherche approchante
+        :return: une dataframe avec le même index que noms, colonnes city_id et methode
+                 (code_postal, nom, trigrammes ou None si aucune ville ne correspond)
+        """
+        if codes_postaux is None:
+            codes_postaux = pd.Series(None, index=noms.index, dtype=object)
+        cles = pd.DataFrame({'postal_code': normaliser_codes_postaux(codes_postaux).values, 'city_name': noms.values})
+        uniques = cles.drop_duplicates().reset_index(drop=True)
+        resultats = [self._chercher(code_postal, nom, approchant, seuil)
+                     for code_postal, nom in zip(uniques['postal_code'], uniques['city_name'])]
+        uniques['city_id'] = pd.Series([city_id for city_id, _ in resultats], dtype=float)
+        uniques['methode'] = pd.Series([methode for _, methode in resultats], dtype=object)
+        detail = cles.merge(uniques, on=['postal_code', 'city_name'], how='left', validate='m:1')
+        return detail[['city_id', 'methode']].set_axis(noms.index)
+
+    def _chercher(self, code_postal, nom, approchant: bool, seuil: float) -> tuple[int | None, str | None]:
+        if not isinstance(nom, str):
+            return None, None
+        city_id = self._par_code_postal.get((code_postal, nom))
+        if city_id is not None:
+            return city_id, 'code_postal'
+        city_id = self._par_nom.get(nom)
+        if city_id is not None:
+            return city_id, 'nom'
+        if approchant:
+            nom_proche = self._nom_proche(nom, code_postal, seuil)
+            if nom_proche is not None:
+                return self._par_code_postal.get((code_postal, nom_proche), self._par_nom[nom_proche]), 'trigrammes'
+        return None, None
+
+    def _nom_proche(self, nom: str, code_postal, seuil: float) -> str | None:
+        # L'index des trigrammes n'est construit qu'à la première recherche approchante
+        if self._trigrammes is None:
+            index = defaultdict(list)
+            for nom_sigale in self._par_nom:
+                trigrammes_sigale = trigrammes(nom_sigale)
+                self._nb_trigrammes[nom_sigale] = len(trigrammes_sigale)
+                for trigramme in trigrammes_sigale:
+                    index[trigramme].append(nom_sigale)
+            self._trigrammes = dict(index)
+
+        trigrammes_nom = trigrammes(nom)
+        communs = Counter()
+        for trigramme in trigrammes_nom:
+            communs.update(self._trigrammes.get(trigramme, ()))
+
+        meilleur, meilleur_score = None, (seuil, False)
+        for candidat, nb_communs in communs.items():
+            # Similarité de Jaccard, à égalité on préfère le nom qui existe avec le même code postal
+            similarite = nb_communs / (len(trigrammes_nom) + self._nb_trigrammes[candidat] - nb_communs)
+            score = (similarite, (code_postal, candidat) in self._par_code_postal)
+            if score >= meilleur_score and (meilleur is None or score > meilleur_score):
+                meilleur, meilleur_score = candidat, score
+        return meilleur
+
+
+def normaliser_codes_postaux(codes_postaux: pd.Series) -> pd.Series:
+    """
+    Met les codes postaux sous forme de texte sans espaces ni décimale (4000.0 -> '4000'), les valeurs nulles restent nulles
+    """
+    codes_postaux = codes_postaux.astype(object)
+    codes_postaux = codes_postaux.where(codes_postaux.isna(), codes_postaux.astype(str))
+    return codes_postaux.str.strip().str.replace(r'\.0$', '', regex=True)
+
+
+def trigrammes(nom: str) -> set[str]:
+    """
+    Trigrammes d'un nom, avec des espaces en début et fin de mot comme pg_trgm
+    """
+    trigrammes_nom = set()
+    for mot in nom.split():
+        mot = f"  {mot} "
+        trigrammes_nom.update(mot[i:i + 3] for i in range(len(mot) - 2))
+    return trigrammes_nom
@@ -1,12 +1,16 @@
 from datetime import datetime, date
 
+import numpy as np
+import pandas as pd
+
 class DateUtils:
 
     @staticmethod
     def convert_dateproeco_to_date(date_proeco:int) -> datetime|None:
         if date_proeco <= 0 or date_proeco >= 2559999:
             return None
-        datestring = str(date_proeco)
+        # Les dates de 1900 ont moins de 6 chiffres, ex: 101 pour le 01/01/1900
+        datestring = str(date_proeco).zfill(6)
         day = int(datestring[-2:])
         month = int(datestring[-4:-2])
         year = int(datestring[:-4]) + 1900
@@ -19,4 +23,30 @@ class DateUtils:
         month = str(date.month).zfill(2)
         day = str(date.day).zfill(2)
 
-        return int(year + month + day)
\ No newline at end of file
+        return int(year + month + day)
+
+
+    @staticmethod
+    def dateproeco_to_datetime64(dates_proeco: pd.Series) -> pd.Series:
+        """
+        Version vectorisée de convert_dateproeco_to_date, pour toute une colonne
+        Les dates <= 0 ou >= 2559999 donnent NaT, de même que les valeurs nulles ou les dates invalides
+        """
+        # En float64, les valeurs écartées deviennent NaN : un entier nullable (Int32 du plan de types) les rendrait
+        # en <NA>, que divmod et to_datetime ne savent pas convertir
+        dates_proeco = pd.to_numeric(dates_proeco, errors='coerce').astype('float64')
+        dates_proeco = dates_proeco.where((dates_proeco > 0) & (dates_proeco < 2559999))
+        # date Proeco = (année - 1900) * 10000 + mois * 100 + jour
+        years, month_days = np.divmod(dates_proeco, 10000)
+        months, days = np.divmod(month_days, 100)
+        return pd.to_datetime(pd.DataFrame({'year': years + 1900, 'month': months, 'day': days}), errors='coerce')
+
+
+    @staticmethod
+    def datetime64_to_dateproeco(dates: pd.Series) -> pd.Series:
+        """
+        Version vectorisée de convert_date_to_dateproeco, pour toute une colonne
+        Les valeurs nulles (NaT) donnent <NA>
+        """
+        dates = pd.to_datetime(dates)
+        return ((dates.dt.year - 1900) * 10000 + dates.dt.month * 100 + dates.dt.day).astype('Int64')
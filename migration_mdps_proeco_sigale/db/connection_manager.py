@@ -0,0 +1,125 @@
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, Engine, Connection, text
+
+from migration_mdps_proeco_sigale import config as default_config
+
+# Engines déjà créés, par url de connexion : un seul pool par base pour tout le process
+_engines: dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(url: str, connect_args: dict | None = None, config = default_config) -> Engine:
+    """
+    Renvoie l'engine de l'url, créé au premier appel avec les options de pool de la config puis réutilisé
+    :param url: url sqlalchemy de la base de données
+    :param connect_args: arguments passés au driver
+    :param config: configuration, options POOL_SIZE, POOL_MAX_OVERFLOW, POOL_RECYCLE, POOL_PRE_PING
+    """
+    with _engines_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            engine = create_engine(
+                url,
+                connect_args=connect_args or {},
+                pool_size=config.POOL_SIZE,
+                max_overflow=config.POOL_MAX_OVERFLOW,
+                # Recyclage des connexions avant qu'elles soient coupées par le serveur ou un firewall
+                pool_recycle=config.POOL_RECYCLE,
+                # Vérifie la connexion à chaque checkout, une connexion coupée est remplacée au lieu de lever une erreur
+                pool_pre_ping=config.POOL_PRE_PING,
+            )
+            _engines[url] = engine
+        return engine
+
+
+def dispose_engines():
+    """
+    Ferme les connexions de tous les engines créés par get_engine
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+class SigaleSession:
+    """
+    Connexion à Sigale partagée par toutes les lectures d'un run, dans une même transaction (snapshot)
+    Les lectures voient donc un état cohérent de Sigale, même si Sigale est modifié pendant le run
+    Les écritures restent faites via l'engine : nouveau_snapshot() doit être appelé après une écriture
+    dont les lectures suivantes dépendent (ex: ids des personnes ajoutées)
+    La connexion est protégée par un verrou : les étapes exécutées en parallèle lisent chacune via sa propre session,
+    voir session_parallele()
+    :param: sigale_engine : connexion à Sigale
+    :param: isolation_level : niveau d'isolation de la transaction de lecture, ex: REPEATABLE READ,
+                              None pour le niveau par défaut du serveur
+    :param: itersize : nombre de lignes récupérées par fetch, voir sql_read_methods.iter_sql_stream
+    :param: snapshot_id : snapshot exporté par une autre transaction (pg_export_snapshot), importé par la première
+                          transaction de la connexion
+    """
+
+    def __init__(self, sigale_engine: Engine, isolation_level: str | None = 'REPEATABLE READ', itersize: int = 10000,
+                 snapshot_id: str | None = None):
+        self.sigale_engine = sigale_engine
+        self.isolation_level = isolation_level
+        self.itersize = itersize
+        self.snapshot_id = snapshot_id
+        self._connection: Connection | None = None
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def connexion(self):
+        """
+        Renvoie la connexion de lecture, ouverte à la première utilisation
+        La transaction démarre à la première requête et reste ouverte jusqu'à nouveau_snapshot() ou close()
+        """
+        with self._lock:
+            if self._connection is None:
+                self._connection = self.sigale_engine.connect()
+                if self.isolation_level:
+                    self._connection = self._connection.execution_options(isolation_level=self.isolation_level)
+                if self.snapshot_id:
+                    # Doit être la première instruction de la transaction, l'id vient de pg_export_snapshot
+                    self._connection.exec_driver_sql(f"SET TRANSACTION SNAPSHOT '{self.snapshot_id}'")
+            yield self._connection
+
+    def session_parallele(self) -> 'SigaleSession':
+        """
+        Nouvelle session de lecture sur sa propre connexion du pool, pour une étape exécutée en parallèle
+        Sur postgresql en REPEATABLE READ ou SERIALIZABLE, sa transaction importe le snapshot de cette session
+        (pg_export_snapshot) : les lectures parallèles voient le même état de Sigale que les lectures précédentes
+        Le snapshot n'est importable que tant que la transaction de cette session reste ouverte,
+        il est donc importé dès la création de la session parallèle
+        """
+        if self.sigale_engine.dialect.name != 'postgresql' \
+                or (self.isolation_level or '').upper() not in ('REPEATABLE READ', 'SERIALIZABLE'):
+            return SigaleSession(self.sigale_engine, self.isolation_level, self.itersize)
+        with self.connexion() as connection:
+            snapshot_id = connection.execute(text("select pg_export_snapshot()")).scalar()
+        session = SigaleSession(self.sigale_engine, self.isolation_level, self.itersize, snapshot_id)
+        with session.connexion():
+            pass
+        return session
+
+    def nouveau_snapshot(self):
+        """
+        Termine la transaction de lecture, la lecture suivante voit les modifications faites depuis
+        """
+        with self._lock:
+            if self._connection is not None:
+                # Transaction en lecture seule, rien à valider
+                self._connection.rollback()
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def __enter__(self) -> 'SigaleSession':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
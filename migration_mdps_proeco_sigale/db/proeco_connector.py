@@ -1,8 +1,8 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
 
-from migration_mdps_proeco_sigale.config import FIREBIRD_CONNECT_ARGS
+from migration_mdps_proeco_sigale import config as default_config
+from migration_mdps_proeco_sigale.db.connection_manager import get_engine
 
 DB_DRIVER: str = "firebird+fdb"
 
@@ -21,8 +21,9 @@ class ProecoConnector:
     db_user: str
     db_password: str
 
-    def __init__(self, db: str = 'PROF.FDB'):
+    def __init__(self, db: str = 'PROF.FDB', config = default_config):
         load_dotenv()
+        self.config = config
         self.db_url = os.getenv('FIREBIRD_URL')
         self.db_port = os.getenv('FIREBIRD_PORT')
         self.db_user = os.getenv('FIREBIRD_USER')
@@ -34,11 +35,13 @@ class ProecoConnector:
     def create_engine(self):
         """
         Renvoi l'instance de connection pour accèder à la DB avec pandas ou sqlalchemy
+        L'engine est créé une seule fois par base, test_connection et les migrations partagent le même pool
         :return:
         """
-        return create_engine(
+        return get_engine(
             f"{DB_DRIVER}://{self.db_user}:{self.db_password}@{self.db_url}:{self.db_port}/{self.database_path}",
-            connect_args=FIREBIRD_CONNECT_ARGS,
+            connect_args=self.config.FIREBIRD_CONNECT_ARGS,
+            config=self.config,
         )
 
     def test_connection(self, logger = None):
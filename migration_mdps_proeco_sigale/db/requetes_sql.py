@@ -1,7 +1,7 @@
-from sqlalchemy import text
+from sqlalchemy import text, bindparam, String
 
-SQL_MDPS_PROECO = text(f"""
-select
+# Colonnes de PERSONNE extraites pour la migration
+COLONNES_MDPS_PROECO = """
 matric,
 nom,
 prenom,
@@ -34,29 +34,72 @@ reserved,
 reservef,
 regnat1 as registre_national_numero, 
 datnaiss as date_naissance
+"""
+
+# Uniquement les clés des enseignants, pour détecter les doublons sur toute la table avant un traitement par lots
+COLONNES_CLES_PROECO = """
+matric,
+regnat1 as registre_national_numero
+"""
+
+# Filtres évalués par Firebird, pour ne pas transférer les enseignants qui seraient écartés ensuite
+# Numéro de registre national avec exactement 11 chiffres, séparateurs éventuels (points, tirets, espaces) compris
+FILTRE_REGISTRE_NATIONAL_PROECO = "regnat1 similar to '([^0-9]*[0-9]){11}[^0-9]*'"
+# Au moins un contrat en cours à la date :date_proeco
+FILTRE_CONTRAT_EN_COURS_PROECO = """exists (
+    select 1
+    from FONCTION
+    where FONCTION.matric = PERSONNE.matric
+    and (FONCTION.DATEFIN >= :date_proeco or FONCTION.DATEFIN is NULL)
+)"""
+
+
+def requete_personnes_proeco(colonnes: str, contrat_en_cours: bool = False, registre_national_valide: bool = True):
+    """
+    Construit une requête sur PERSONNE, les filtres étant évalués par Firebird
+    :param colonnes: colonnes à extraire, ex: COLONNES_MDPS_PROECO
+    :param contrat_en_cours: ne garde que les enseignants avec un contrat en cours, paramètre :date_proeco
+    :param registre_national_valide: True pour les numéros de registre national à 11 chiffres,
+                                     False pour les autres (rapport des rejets)
+    """
+    filtre_registre_national = FILTRE_REGISTRE_NATIONAL_PROECO if registre_national_valide \
+        else f"not {FILTRE_REGISTRE_NATIONAL_PROECO}"
+    filtre_contrat = f"and {FILTRE_CONTRAT_EN_COURS_PROECO}" if contrat_en_cours else ""
+    return text(f"""
+select
+{colonnes}
 from PERSONNE
 where regnat1 is not null
 and regnat1 != ''
 and datnaiss is not null
 and datnaiss > 0
--- and CHAR_LENGTH(regnat1) = 11
+and {filtre_registre_national}
+{filtre_contrat}
 order by matric
 """)
 
+
+SQL_MDPS_PROECO = requete_personnes_proeco(COLONNES_MDPS_PROECO)
+
+# Matricules ayant au moins un contrat en cours à la date :date_proeco (même condition que FILTRE_CONTRAT_EN_COURS_PROECO)
+# Le snapshot local de Proeco enregistre les enseignants sans ce filtre, il y est appliqué à la lecture
 SQL_CONTRATS_EN_COURS_PROECO = text("""
-select matric
+select distinct matric
 from FONCTION
-where DATEFIN >= :date_proeco
-or DATEFIN is NULL
+where FONCTION.DATEFIN >= :date_proeco or FONCTION.DATEFIN is NULL
+order by matric
 """)
 
+# Les requêtes de recoupement avec Sigale sont limitées aux enseignants traités (paramètre :ids, voir read_sql_by_ids)
+# Les ids textuels sont typés String, sinon une liste vide est rendue en CAST(NULL AS INTEGER)
 SQL_MDPS_SIGALE = text("""
 select registre_national_numero, id as personne_id
 from personnes.personnes
 where registre_national_numero != ''
 -- and est_membre_personnel = true
 and registre_national_numero is not null
-""")
+and registre_national_numero in :ids
+""").bindparams(bindparam('ids', expanding=True, type_=String))
 
 SQL_EIDS_MDPS_SIGALE = text("""
 select CONCAT(INITCAP(prenom), ' ', UPPER(nom)) as display_name, eid, id as personne_id
@@ -65,12 +108,21 @@ where est_membre_personnel = true
 and est_collaborateur_rh = true
  and registre_national_numero != ''
 and registre_national_numero is not null
-""")
+and id in :ids
+""").bindparams(bindparam('ids', expanding=True))
 
 SQL_UTILISATEURS_SIGALE = text("""
 select technical_id as eid
 from core.oauth_users
-""")
+where technical_id in :ids
+""").bindparams(bindparam('ids', expanding=True, type_=String))
+
+# Ids des utilisateurs qui viennent d'être ajoutés, pour leur attribuer le rôle par défaut
+SQL_IDS_UTILISATEURS_SIGALE = text("""
+select technical_id, id as user_id
+from core.oauth_users
+where technical_id in :ids
+""").bindparams(bindparam('ids', expanding=True, type_=String))
 
 SQL_PARAMETER_SIGALE = text("""
 select pv.id, pv.code
@@ -84,21 +136,24 @@ select e.id as email_id, e.personne_id, e.valeur, e.email_domaine_id, e.created_
 from personnes.personne_emails e
     inner join personnes.personnes p on p.id = e.personne_id
 where p.est_membre_personnel = true
-""")
+and e.personne_id in :ids
+""").bindparams(bindparam('ids', expanding=True))
 
 SQL_PHONES_SIGALE = text(f"""
 select t.id as telephone_id, t.personne_id, t.numero, t.telephone_domaine_id, t.telephone_type_id, t.created_by
 from personnes.personne_telephones t
     inner join personnes.personnes p on p.id = t.personne_id
 where p.est_membre_personnel = true
-""")
+and t.personne_id in :ids
+""").bindparams(bindparam('ids', expanding=True))
 
 SQL_ADRESSES_SIGALE = text(f"""
 select a.id as adresse_id, a.personne_id, a.adresse_type_id, a.created_by
 from personnes.personne_adresses a
     inner join personnes.personnes p on p.id = a.personne_id
 where p.est_membre_personnel = true
-""")
+and a.personne_id in :ids
+""").bindparams(bindparam('ids', expanding=True))
 
 SQL_DEFAULT_CULTURE = text("""
 select id as culture_id
@@ -110,4 +165,22 @@ SQL_DEFAULT_ROLE = text("""
 select id as role_id
 from core.roles
     where code = :code
-""")
\ No newline at end of file
+""")
+
+SQL_PARAMETERS_SIGALE = text("""
+select pv.id, pv.code, pt.code as type_parameter
+from core.parameter_values pv
+inner join core.parameter_types pt on pv.parameter_type_id = pt.id
+where pt.code in :types_parameter
+""").bindparams(bindparam('types_parameter', expanding=True))
+
+SQL_COUNTRIES_SIGALE = text("""
+select id, code
+from core.countries
+""")
+
+SQL_CITIES_SIGALE = text("""
+select id, name, postal_code
+from core.cities
+order by postal_code asc
+""")
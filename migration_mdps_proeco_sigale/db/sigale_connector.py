@@ -1,6 +1,8 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+
+from migration_mdps_proeco_sigale import config as default_config
+from migration_mdps_proeco_sigale.db.connection_manager import get_engine
 
 DB_DRIVER: str = "postgresql"
 CONNECT_ARGS: dict = {"connect_timeout" : 10}
@@ -22,8 +24,9 @@ class SigaleConnector:
     #: Base de données utilisée
     database: str
 
-    def __init__(self):
+    def __init__(self, config = default_config):
         load_dotenv()
+        self.config = config
         self.db_url = os.getenv('SIGALE_URL')
         self.db_port = os.getenv('SIGALE_PORT')
         self.db_user = os.getenv('SIGALE_USER')
@@ -33,11 +36,13 @@ class SigaleConnector:
     def create_engine(self):
         """
         Renvoi l'instance de connection pour accèder à la DB avec pandas ou sqlalchemy
+        L'engine est créé une seule fois par base, test_connection et les migrations partagent le même pool
         :return:
         """
-        return create_engine(
+        return get_engine(
             f"{DB_DRIVER}://{self.db_user}:{self.db_password}@{self.db_url}:{self.db_port}/{self.database}",
             connect_args=CONNECT_ARGS,
+            config=self.config,
         )
 
     def test_connection(self, logger = None):
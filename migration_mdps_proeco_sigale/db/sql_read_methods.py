@@ -0,0 +1,108 @@
+from abc import ABC, abstractmethod
+from typing import Iterator
+
+import pandas as pd
+from sqlalchemy import TextClause, Engine, text
+
+from migration_mdps_proeco_sigale.db.connection_manager import SigaleSession
+
+#: Nombre de lignes récupérées par fetch, si non précisé
+DEFAULT_ITERSIZE: int = 10000
+
+
+class SourceHorsLigne(ABC):
+    """
+    Source de données lue sans connexion, ex: snapshot local de Proeco ou de Sigale (voir snapshot.SnapshotLocal)
+    Les fonctions de lecture de ce module lui transmettent les requêtes au lieu de les exécuter,
+    la source renvoie le résultat qu'aurait renvoyé la base
+    """
+
+    @abstractmethod
+    def iter_sql(self, sql: TextClause | str, params: dict | None, itersize: int) -> Iterator[pd.DataFrame]:
+        """
+        Résultat de la requête par lots de itersize lignes
+        :raise ValueError: si la requête n'est pas disponible hors ligne (absente du snapshot)
+        """
+
+    @abstractmethod
+    def lire_table(self, schema: str, table: str, ids) -> pd.DataFrame:
+        """
+        Lignes d'une table dont l'id est dans ids, toutes colonnes, ex: valeurs actuelles (sigale_diff.read_current_values)
+        :raise ValueError: si la table n'est pas disponible hors ligne (absente du snapshot)
+        """
+
+
+def iter_sql_stream(sql: TextClause | str, con, itersize: int | None = None, **kwargs) -> Iterator[pd.DataFrame]:
+    """
+    Lit le résultat d'une requête par lots de itersize lignes, via un curseur côté serveur (curseur nommé avec psycopg2,
+    fetchmany avec Firebird) : le driver ne charge pas tout le résultat en mémoire avant que pandas le lise
+    :param con: engine, connexion sqlalchemy, SigaleSession ou SourceHorsLigne
+    :param itersize: lignes par lot, itersize de la SigaleSession ou DEFAULT_ITERSIZE par défaut
+    :param kwargs: arguments passés à pd.read_sql_query, ex: params, dtype
+    """
+    if isinstance(con, SourceHorsLigne):
+        dtype = kwargs.get('dtype')
+        for lot in con.iter_sql(sql, kwargs.get('params'), itersize or DEFAULT_ITERSIZE):
+            yield lot.astype(dtype) if dtype else lot
+        return
+    if isinstance(con, SigaleSession):
+        with con.connexion() as conn:
+            yield from iter_sql_stream(sql, conn, itersize or con.itersize, **kwargs)
+        return
+    if isinstance(con, Engine):
+        with con.connect() as conn:
+            yield from iter_sql_stream(sql, conn, itersize, **kwargs)
+        return
+
+    itersize = itersize or DEFAULT_ITERSIZE
+    sql = text(sql) if isinstance(sql, str) else sql
+    # yield_per active stream_results et récupère les lignes par fetchmany(itersize)
+    yield from pd.read_sql_query(sql.execution_options(yield_per=itersize), con, chunksize=itersize, **kwargs)
+
+
+def read_sql_stream(sql: TextClause | str, con, itersize: int | None = None, **kwargs) -> pd.DataFrame:
+    """
+    Comme pd.read_sql_query, mais la dataframe est construite lot par lot, voir iter_sql_stream
+    """
+    lots = list(iter_sql_stream(sql, con, itersize, **kwargs))
+    if len(lots) == 1:
+        return lots[0]
+
+    # Les types sont déduits lot par lot (ex: colonne entièrement nulle dans un lot),
+    # on les déduit à nouveau sur tout le résultat pour obtenir les mêmes types qu'une lecture en une fois
+    colonnes = [colonne for colonne in lots[0].columns if len({lot[colonne].dtype for lot in lots}) > 1]
+    data = pd.concat([lot.astype({colonne: object for colonne in colonnes}) for lot in lots], ignore_index=True)
+    if colonnes:
+        data[colonnes] = data[colonnes].infer_objects()
+    return data
+
+
+def read_sql(sql: TextClause, con, params: dict | None = None) -> pd.DataFrame:
+    """
+    pd.read_sql_query acceptant aussi une SigaleSession, la requête est alors lue dans le snapshot du run
+    :param con: engine, connexion sqlalchemy ou SigaleSession
+    """
+    return read_sql_stream(sql, con, params=params)
+
+
+def read_sql_by_ids(sql: TextClause, con, ids, param_name: str = 'ids', batch_size: int = 10000,
+                    params: dict | None = None, **kwargs) -> pd.DataFrame:
+    """
+    Exécute une requête filtrée sur une liste d'ids, par lots pour ne pas dépasser la limite de paramètres du serveur
+    La requête doit contenir un paramètre IN expanding, ex: `where id in :ids` avec bindparam('ids', expanding=True)
+    :param sql: requête sqlalchemy
+    :param con: engine, connexion sqlalchemy ou SigaleSession
+    :param ids: ids à récupérer
+    :param param_name: nom du paramètre des ids dans la requête
+    :param batch_size: nombre d'ids par requête
+    :param params: autres paramètres de la requête
+    :param kwargs: arguments passés à pd.read_sql_query, ex: dtype_backend
+    :return: la concaténation des résultats de chaque lot
+    """
+    # On convertit en types python, psycopg2 ne sait pas adapter les types numpy
+    ids = pd.Series(ids).dropna().drop_duplicates().tolist()
+    frames = []
+    for start in range(0, max(len(ids), 1), batch_size):
+        batch_params = {**(params or {}), param_name: ids[start:start + batch_size]}
+        frames.append(read_sql_stream(sql, con, params=batch_params, **kwargs))
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
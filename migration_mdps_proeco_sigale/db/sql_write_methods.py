@@ -1,3 +1,6 @@
+import time
+from io import StringIO
+from itertools import islice
 from typing import Literal
 
 from sqlalchemy import create_engine, update, bindparam, delete
@@ -11,13 +14,25 @@ class WriteMethods:
     :param: index_columns : Colonnes servant d'index
     :param: update_columns : Colonnes à mettre à jour
     :param: sql_dialect : dialect sql, mysql ou postgresql, postgresql par défaut
+    :param: batch_size : nombre de lignes par requête pour update_on_conflict ( taille initiale si adaptive_batch )
+    :param: adaptive_batch : adapte la taille des lots en fonction de la durée observée des requêtes
+    :param: target_latency : durée visée par requête en secondes, pour adaptive_batch
     """
 
+    #: Nombre maximum de paramètres par requête ( limite du protocole postgresql et mysql )
+    MAX_PARAMETERS: int = 65535
+    #: Taille minimale d'un lot en mode adaptatif
+    MIN_BATCH_SIZE: int = 50
+
     def __init__(self, index_columns: list[str], update_columns: list[str],
-                 sql_dialect: Literal['postgresql', 'mysql'] = 'postgresql'):
+                 sql_dialect: Literal['postgresql', 'mysql'] = 'postgresql',
+                 batch_size: int = 1000, adaptive_batch: bool = False, target_latency: float = 0.5):
         self.index_columns = index_columns
         self.update_columns = update_columns
         self.sql_dialect = sql_dialect
+        self.batch_size = batch_size
+        self.adaptive_batch = adaptive_batch
+        self.target_latency = target_latency
 
 
     def update_existing(self, table, conn, keys, data_iter):
@@ -52,11 +67,35 @@ class WriteMethods:
         """
         Tente d'insérer les rows, si existe ( sur base de index_columns ), alors met à jour les colonnes présentes dans
         update_columns
+        Les lignes sont envoyées par lots de batch_size, adaptés à la durée des requêtes si adaptive_batch
         Les paramètres sont automatiquement passés par pandas
         :return:
         """
-        # on récupère les données de la dataframe dans un dictionnaire
-        data = [dict(zip(keys, row)) for row in data_iter]
+        # Taille maximale d'un lot pour ne pas dépasser la limite de paramètres du serveur
+        max_batch_size = max(1, self.MAX_PARAMETERS // len(keys))
+        batch_size = min(self.batch_size, max_batch_size)
+
+        rowcount = 0
+        data_iter = iter(data_iter)
+        while True:
+            # on récupère le lot suivant de la dataframe dans un dictionnaire
+            data = [dict(zip(keys, row)) for row in islice(data_iter, batch_size)]
+            if not data:
+                break
+
+            start = time.perf_counter()
+            result = conn.execute(self._upsert_statement(table, data))
+            rowcount += result.rowcount
+
+            if self.adaptive_batch:
+                batch_size = self._adapt_batch_size(batch_size, time.perf_counter() - start, max_batch_size)
+
+        return rowcount
+
+    def _upsert_statement(self, table, data: list[dict]):
+        """
+        Construit la requête INSERT ... ON CONFLICT DO UPDATE ( ou ON DUPLICATE KEY UPDATE pour mysql ) pour un lot
+        """
         updates = {}
         # pour une db postgresql
         if self.sql_dialect == 'postgresql':
@@ -66,24 +105,84 @@ class WriteMethods:
             )
             for column in self.update_columns:
                 updates[column] = stmt.excluded[column]
-            stmt = stmt.on_conflict_do_update(
+            return stmt.on_conflict_do_update(
                 index_elements=self.index_columns,
                 set_=updates,
             )
-        else:
-            stmt = (
-                insert_mysql(table.table)
-                .values(data)
-            )
-            columns = [*self.index_columns, *self.update_columns]
-            for column in columns:
-                updates[column] = stmt.inserted[column]
-            stmt = stmt.on_duplicate_key_update(
-                updates
-            )
-        # index_columns = ['id_people']
-        # update_columns = ['ancservpo', 'ancservcf', 'ancadm']
-        # print(table, conn, keys, data_iter, index_columns, update_columns)
-        result = conn.execute(stmt)
-        return result.rowcount
+
+        stmt = (
+            insert_mysql(table.table)
+            .values(data)
+        )
+        columns = [*self.index_columns, *self.update_columns]
+        for column in columns:
+            updates[column] = stmt.inserted[column]
+        return stmt.on_duplicate_key_update(
+            updates
+        )
+
+    def _adapt_batch_size(self, batch_size: int, latency: float, max_batch_size: int) -> int:
+        """
+        Double la taille du lot si la requête est bien plus rapide que target_latency, la divise par deux si plus lente
+        """
+        if latency < self.target_latency / 2:
+            batch_size *= 2
+        elif latency > self.target_latency:
+            batch_size //= 2
+        return max(self.MIN_BATCH_SIZE, min(batch_size, max_batch_size))
+
+    @staticmethod
+    def copy_from_stdin(table, conn, keys, data_iter):
+        """
+        Insertion en masse via COPY FROM STDIN (postgresql + psycopg2 uniquement), beaucoup plus rapide que
+        l'INSERT multiple par défaut de pandas
+        Les paramètres sont automatiquement passés par pandas
+        :return:
+        """
+        # On écrit les lignes au format csv dans un buffer en mémoire
+        buffer = StringIO()
+        for row in data_iter:
+            buffer.write(','.join(WriteMethods._format_copy_value(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+
+        table_name = f'"{table.schema}"."{table.name}"' if table.schema else f'"{table.name}"'
+        columns = ', '.join(f'"{key}"' for key in keys)
+
+        # On passe par la connexion dbapi (psycopg2) pour accéder à copy_expert
+        dbapi_conn = conn.connection
+        with dbapi_conn.cursor() as cursor:
+            cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+            return cursor.rowcount
+
+    @staticmethod
+    def _format_copy_value(value) -> str:
+        """
+        Formate une valeur pour COPY au format csv :
+        None -> vide sans guillemets (NULL), les chaînes sont toujours entre guillemets pour conserver les chaînes vides
+        """
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, float):
+            # Les colonnes d'ids passent en float après un merge avec des valeurs nulles (123.0),
+            # refusé par COPY pour une colonne integer
+            return str(int(value)) if value.is_integer() else repr(value)
+        if isinstance(value, int):
+            return str(value)
+        return '"' + str(value).replace('"', '""') + '"'
+
+    @staticmethod
+    def insert_method(con, method: Literal['copy', 'insert'] = 'copy'):
+        """
+        Renvoie la méthode à passer à pandas.to_sql pour l'insertion de nouvelles lignes
+        COPY pour postgresql avec psycopg2, sinon l'INSERT par défaut de pandas (None)
+        :param con: engine ou connexion sqlalchemy utilisée pour l'insertion
+        :param method: 'copy' ou 'insert' pour forcer l'INSERT par défaut de pandas
+        :return:
+        """
+        if method == 'copy' and con.dialect.name == 'postgresql' and con.dialect.driver == 'psycopg2':
+            return WriteMethods.copy_from_stdin
+        return None
 
@@ -0,0 +1,88 @@
+import pandas as pd
+from sqlalchemy import text
+
+from migration_mdps_proeco_sigale.db.sql_write_methods import WriteMethods
+
+
+class StagingMerge:
+    """
+    Fusion ensembliste côté serveur (postgresql) :
+    les lignes transformées sont chargées dans une table temporaire de staging,
+    puis une requête UPDATE ... FROM et une requête INSERT ... WHERE NOT EXISTS font la séparation ajout/mise à jour
+    :param: table : table cible dans Sigale
+    :param: schema : schéma de la table cible
+    :param: key_columns : colonnes servant à recouper les lignes de staging avec celles de la table cible
+    :param: update_columns : colonnes à mettre à jour pour les lignes existantes
+    :param: created_by : si renseigné, seules les lignes existantes créées par cet utilisateur sont mises à jour
+    """
+
+    def __init__(self, table: str, schema: str, key_columns: list[str], update_columns: list[str],
+                 created_by: int | None = None):
+        self.table = table
+        self.schema = schema
+        self.key_columns = key_columns
+        self.update_columns = update_columns
+        self.created_by = created_by
+
+    @property
+    def staging_table(self) -> str:
+        return f"staging_{self.table}"
+
+    @property
+    def target_table(self) -> str:
+        return f'"{self.schema}"."{self.table}"'
+
+    def merge(self, data: pd.DataFrame, conn, update: bool = True, insert_method: str = 'copy') -> tuple[int, int]:
+        """
+        Charge data dans la table de staging et fusionne avec la table cible
+        Doit être appelée dans une transaction, la table de staging est supprimée au commit ou rollback
+        :param data: lignes à fusionner, les colonnes doivent exister dans la table cible
+        :param conn: connexion sqlalchemy avec une transaction ouverte
+        :param update: si à False, on n'ajoute que les nouvelles lignes
+        :param insert_method: méthode utilisée pour charger la table de staging, 'copy' ou 'insert'
+        :return: le nombre de lignes ajoutées et le nombre de lignes mises à jour
+        """
+        columns = list(data.columns)
+        quoted_columns = ', '.join(f'"{column}"' for column in columns)
+
+        # La table de staging reprend les types de la table cible, sans les contraintes
+        conn.execute(text(f"""
+            create temporary table {self.staging_table} on commit drop as
+            select {quoted_columns} from {self.target_table} with no data
+        """))
+        data.to_sql(self.staging_table, con=conn, index=False, if_exists='append',
+                    method=WriteMethods.insert_method(conn, insert_method))
+
+        join_condition = ' and '.join(f'cible."{column}" = staging."{column}"' for column in self.key_columns)
+        params = {}
+
+        updated = 0
+        update_columns = [column for column in self.update_columns if column in columns]
+        if update and update_columns:
+            set_clause = ', '.join(f'"{column}" = staging."{column}"' for column in update_columns)
+            update_sql = f"""
+                update {self.target_table} as cible
+                set {set_clause}
+                from {self.staging_table} as staging
+                where {join_condition}
+            """
+            # On ne modifie que les lignes créées par la migration si demandé
+            if self.created_by is not None:
+                update_sql += ' and cible.created_by = :created_by'
+                params['created_by'] = self.created_by
+            updated = conn.execute(text(update_sql), params).rowcount
+
+        # On n'ajoute que les lignes sans correspondance dans la table cible,
+        # qu'elles aient été créées par la migration ou non
+        staging_columns = ', '.join(f'staging."{column}"' for column in columns)
+        inserted = conn.execute(text(f"""
+            insert into {self.target_table} ({quoted_columns})
+            select {staging_columns}
+            from {self.staging_table} as staging
+            where not exists (
+                select 1 from {self.target_table} as cible
+                where {join_condition}
+            )
+        """)).rowcount
+
+        return inserted, updated
@@ -0,0 +1,74 @@
+import os
+from pathlib import Path
+
+import pandas as pd
+
+# Clé d'un enseignant : un même matricule peut exister dans plusieurs bases Proeco
+CLES = ['source_proeco', 'matric']
+
+
+class DeltaState:
+    """
+    Magasin local des hash de contenu par enseignant (base Proeco et matricule), pour la synchro delta :
+    seuls les enseignants dont les colonnes Proeco ont changé depuis la dernière synchro sont envoyés aux étapes
+    :param: state_file : fichier dans lequel les hash sont sauvegardés
+    :param: entites : colonnes Proeco utilisées pour le hash de chaque entité, ex: {'emails': ['email', 'email2']}
+    """
+
+    def __init__(self, state_file: str, entites: dict[str, list[str]]):
+        self.state_file = state_file
+        self.entites = entites
+        self._previous: pd.DataFrame | None = None
+
+    def compute(self, enseignants_proeco: pd.DataFrame) -> pd.DataFrame:
+        """
+        Calcule un hash par enseignant et par entité
+        :param enseignants_proeco: enseignants extraits de Proeco, avec les colonnes source_proeco et matric
+        :return: une dataframe indexée par (source_proeco, matric), une colonne de hash par entité
+        """
+        hashes = pd.DataFrame(index=pd.MultiIndex.from_frame(enseignants_proeco[CLES]))
+        for entite, colonnes in self.entites.items():
+            hashes[entite] = pd.util.hash_pandas_object(enseignants_proeco[colonnes], index=False).values
+        return hashes
+
+    def load(self) -> pd.DataFrame | None:
+        """
+        Renvoie les hash de la dernière synchro, None si aucune synchro n'a encore été sauvegardée
+        Un état indexé par matricule seul (avant la prise en charge de plusieurs bases) est ignoré :
+        la synchro suivante est complète
+        """
+        if not os.path.exists(self.state_file):
+            return None
+        previous = pd.read_pickle(self.state_file)
+        if list(previous.index.names) != CLES:
+            return None
+        return previous
+
+    def changed(self, hashes: pd.DataFrame) -> dict[str, pd.Index]:
+        """
+        Renvoie, pour chaque entité, les enseignants (source_proeco, matric) nouveaux ou dont le hash a changé
+        depuis la dernière synchro
+        """
+        # On ne relit l'état qu'une fois, compute/changed pouvant être appelés pour chaque lot
+        if self._previous is None:
+            self._previous = self.load()
+        previous = self._previous
+        changes = {}
+        for entite in self.entites:
+            if previous is None or entite not in previous.columns:
+                changes[entite] = hashes.index
+                continue
+            # Les enseignants absents de la dernière synchro ont un hash à 0, donc différent
+            previous_hashes = previous[entite].reindex(hashes.index, fill_value=0)
+            changes[entite] = hashes.index[hashes[entite].ne(previous_hashes)]
+        return changes
+
+    def save(self, hashes: pd.DataFrame):
+        """
+        Sauvegarde les hash de la synchro, en conservant ceux des enseignants absents de cette synchro
+        """
+        previous = self.load()
+        if previous is not None:
+            hashes = pd.concat([previous[~previous.index.isin(hashes.index)], hashes])
+        Path(self.state_file).parent.mkdir(parents=True, exist_ok=True)
+        hashes.to_pickle(self.state_file)
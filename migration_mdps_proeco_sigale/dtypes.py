@@ -0,0 +1,86 @@
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from migration_mdps_proeco_sigale.db.sql_read_methods import iter_sql_stream
+
+try:
+    import pyarrow  # noqa: F401
+    # Chaînes stockées dans des buffers Arrow plutôt qu'en objets Python, beaucoup plus compact
+    STRING_DTYPE = pd.StringDtype('pyarrow')
+except ImportError:
+    STRING_DTYPE = object
+
+# Plan de types des colonnes extraites de Proeco (SQL_MDPS_PROECO)
+# - codes à faible cardinalité (sexe, pays, codes postaux, ...) : category
+# - identifiants et dates Proeco : entiers nullables
+# - texte libre : chaînes pyarrow si disponible
+DTYPES_PROECO: dict[str, str | pd.api.extensions.ExtensionDtype | type] = {
+    'matric': 'Int32',
+    'date_naissance': 'Int32',
+    'sexe': 'category',
+    'nation': 'category',
+    'paynaiss': 'category',
+    'etatcivil': 'category',
+    'paysdomi': 'category',
+    'cpostdomi': 'category',
+    'zonedomi': 'category',
+    'paysresi': 'category',
+    'cpostresi': 'category',
+    'zoneresi': 'category',
+    'lieunaiss': STRING_DTYPE,
+    'commdomi': STRING_DTYPE,
+    'commresi': STRING_DTYPE,
+    'locadomi': STRING_DTYPE,
+    'locaresi': STRING_DTYPE,
+    'nom': STRING_DTYPE,
+    'prenom': STRING_DTYPE,
+    'ruedomi': STRING_DTYPE,
+    'rueresi': STRING_DTYPE,
+    'teldomi': STRING_DTYPE,
+    'telresi': STRING_DTYPE,
+    'gsm': STRING_DTYPE,
+    'telbureau': STRING_DTYPE,
+    'email': STRING_DTYPE,
+    'email2': STRING_DTYPE,
+    'matriche': STRING_DTYPE,
+    'reserved': STRING_DTYPE,
+    'reservef': STRING_DTYPE,
+    'registre_national_numero': STRING_DTYPE,
+}
+
+
+def appliquer_dtypes(data: pd.DataFrame, dtypes: dict = None) -> pd.DataFrame:
+    """
+    Convertit les colonnes selon le plan de types, les colonnes absentes du plan ou de data sont ignorées
+    :param dtypes: plan de types, DTYPES_PROECO par défaut
+    """
+    dtypes = DTYPES_PROECO if dtypes is None else dtypes
+    return data.astype({colonne: dtype for colonne, dtype in dtypes.items() if colonne in data.columns})
+
+
+
+def lire_sql_compact(sql, con, dtypes: dict = None, chunksize: int = 50000, **kwargs) -> pd.DataFrame:
+    """
+    Lit le résultat d'une requête par lots, chaque lot étant converti selon le plan de types avant de lire le suivant :
+    le pic de mémoire ne dépend plus des objets Python de tout le résultat, mais de ceux d'un seul lot
+    :param dtypes: plan de types, DTYPES_PROECO par défaut
+    :param chunksize: lignes par lot, lues via un curseur côté serveur (voir iter_sql_stream)
+    :param kwargs: arguments passés à pd.read_sql_query
+    """
+    return concat_lots([appliquer_dtypes(lot, dtypes) for lot in iter_sql_stream(sql, con, chunksize, **kwargs)])
+
+
+def concat_lots(lots: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatène des lots convertis selon le plan de types, ex: lots d'une même requête ou résultats de plusieurs bases
+    """
+    if len(lots) == 1:
+        return lots[0]
+
+    # Les catégories diffèrent d'un lot à l'autre, on les unifie pour que la concaténation reste en category
+    colonnes_categories = [colonne for colonne, dtype in lots[0].dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    categories = {
+        colonne: pd.CategoricalDtype(union_categoricals([lot[colonne] for lot in lots], ignore_order=True).categories)
+        for colonne in colonnes_categories
+    }
+    return pd.concat([lot.astype(categories) for lot in lots], ignore_index=True)
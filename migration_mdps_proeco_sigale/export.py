@@ -0,0 +1,112 @@
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Literal
+
+import pandas as pd
+
+from migration_mdps_proeco_sigale.dtypes import concat_lots
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+ExportFormat = Literal['parquet', 'csv.gz', 'csv']
+EXPORT_FORMATS: tuple[str, ...] = ('parquet', 'csv.gz', 'csv')
+
+
+class Exporter:
+    """
+    Export des données intermédiaires de la migration (option --export)
+    Un même export peut être écrit plusieurs fois pendant un run (traitement par lots), les lignes sont alors ajoutées
+    - csv, csv.gz : un fichier nom.csv ou nom.csv.gz
+    - parquet : un dossier nom contenant un fichier parquet par écriture (part-00000.parquet, ...), chaque fichier
+      étant écrit par row groups de row_group_size lignes, sans convertir toute la dataframe en une fois
+    Les exports se relisent avec lire_export
+    :param: export_path : dossier d'export
+    :param: export_format : parquet (pyarrow requis), csv.gz ou csv
+    :param: row_group_size : nombre de lignes écrites à la fois
+    """
+
+    def __init__(self, export_path: str, export_format: ExportFormat = 'csv', row_group_size: int = 50000):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Format d'export {export_format} inconnu, formats disponibles : {', '.join(EXPORT_FORMATS)}")
+        if export_format == 'parquet' and pa is None:
+            raise ImportError("L'export en parquet nécessite pyarrow : pip install \".[parquet]\"")
+        self.export_path = export_path
+        self.export_format = export_format
+        self.row_group_size = row_group_size
+        # Nombre d'écritures par export, les étapes exécutées en parallèle écrivant chacune leurs exports
+        self._written: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def write(self, data: pd.DataFrame, nom: str):
+        """
+        Écrit data dans l'export nom (sans extension, ex: mdps_nouveaux),
+        ajoute les lignes si l'export a déjà été écrit par cet exporter
+        """
+        with self._lock:
+            numero = self._written.get(nom, 0)
+            self._written[nom] = numero + 1
+            if numero == 0:
+                Path(self.export_path).mkdir(parents=True, exist_ok=True)
+
+        if self.export_format == 'parquet':
+            dossier = os.path.join(self.export_path, nom)
+            # On remplace l'export d'un run précédent
+            if numero == 0:
+                shutil.rmtree(dossier, ignore_errors=True)
+                Path(dossier).mkdir(parents=True)
+            self._write_parquet(data, os.path.join(dossier, f"part-{numero:05d}.parquet"))
+            return
+
+        path = os.path.join(self.export_path, f"{nom}.{self.export_format}")
+        append = numero > 0
+        # chunksize : les lignes sont converties en texte par paquets, pas toute la dataframe en une fois
+        data.to_csv(path, index=False, mode='a' if append else 'w', header=not append, chunksize=self.row_group_size,
+                    compression='gzip' if self.export_format == 'csv.gz' else None)
+
+    def _write_parquet(self, data: pd.DataFrame, path: str):
+        """
+        Écrit data en parquet par row groups, seul un row group est converti en arrow à la fois
+        """
+        schema = schema_arrow(data)
+        with pq.ParquetWriter(path, schema) as writer:
+            for debut in range(0, len(data), self.row_group_size):
+                lignes = data.iloc[debut:debut + self.row_group_size]
+                writer.write_table(pa.Table.from_pandas(lignes, schema=schema, preserve_index=False))
+            if len(data) == 0:
+                writer.write_table(schema.empty_table())
+
+
+def schema_arrow(data: pd.DataFrame):
+    """
+    Schéma arrow de data, déduit sans convertir les données
+    Les colonnes entièrement nulles sont typées en chaînes, pour rester compatibles avec les lots suivants
+    """
+    schema = pa.Schema.from_pandas(data, preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+    return schema
+
+
+def lire_export(export_path: str, nom: str, colonnes: list[str] | None = None) -> pd.DataFrame:
+    """
+    Relit un export écrit par Exporter, quel que soit son format, ex: lire_export('exports', 'mdps_nouveaux')
+    :param colonnes: colonnes à lire, toutes par défaut (en parquet, seules ces colonnes sont lues du disque)
+    """
+    dossier = os.path.join(export_path, nom)
+    if os.path.isdir(dossier):
+        parts = sorted(Path(dossier).glob('part-*.parquet'))
+        # Les types peuvent différer d'un lot à l'autre (ex: category), concat_lots les unifie
+        return concat_lots([pd.read_parquet(part, columns=colonnes) for part in parts])
+    for extension in ('csv.gz', 'csv'):
+        path = os.path.join(export_path, f"{nom}.{extension}")
+        if os.path.exists(path):
+            return pd.read_csv(path, usecols=colonnes)
+    raise FileNotFoundError(f"Aucun export {nom} dans {export_path}")
@@ -0,0 +1,219 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # Module indisponible sous Windows, le pic de mémoire n'est alors pas mesuré
+    resource = None
+
+# Compteurs des étapes, renseignés par Span.compter
+COMPTEURS = ['lignes_entree', 'lignes_sortie', 'inseres', 'mis_a_jour', 'inchanges', 'ignores']
+
+# Métriques du fichier Prometheus par étape : (nom, aide, clé de la mesure agrégée)
+METRIQUES_PROMETHEUS = [
+    ('migration_mdps_stage_duration_seconds', "Durée cumulée de l'étape", 'duree'),
+    ('migration_mdps_stage_calls', "Nombre d'exécutions de l'étape (une par lot)", 'appels'),
+    ('migration_mdps_stage_rows_in', "Lignes reçues par l'étape", 'lignes_entree'),
+    ('migration_mdps_stage_rows_out', "Lignes produites par l'étape", 'lignes_sortie'),
+    ('migration_mdps_stage_inserted', "Lignes insérées dans Sigale (à insérer en dry run)", 'inseres'),
+    ('migration_mdps_stage_updated', "Lignes mises à jour dans Sigale (à mettre à jour en dry run)", 'mis_a_jour'),
+    ('migration_mdps_stage_unchanged', "Lignes existantes déjà à jour dans Sigale", 'inchanges'),
+    ('migration_mdps_stage_peak_rss_bytes', "Pic de mémoire du process à la fin de l'étape", 'pic_rss'),
+]
+
+
+def pic_rss() -> int | None:
+    """
+    Pic de mémoire (RSS) du process depuis son démarrage, en octets, None si non mesurable
+    """
+    if resource is None:
+        return None
+    # ru_maxrss est en Ko sous Linux, en octets sous macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+class Span:
+    """
+    Mesure d'une étape du run : durée, compteurs de lignes et pic de mémoire
+    Le pic de mémoire est celui du process à la fin de l'étape, hausse_pic_rss indique de combien l'étape l'a augmenté
+    :param: nom : nom de l'étape, ex: emails
+    """
+
+    def __init__(self, nom: str, lignes_entree: int | None = None):
+        self.nom = nom
+        self.debut = datetime.now()
+        self.duree: float | None = None
+        self.statut = 'en_cours'
+        self.compteurs: dict[str, int] = {}
+        if lignes_entree is not None:
+            self.compteurs['lignes_entree'] = lignes_entree
+        self.pic_rss: int | None = None
+        self._pic_rss_debut = pic_rss()
+
+    def compter(self, **compteurs: int):
+        """
+        Ajoute aux compteurs de l'étape, ex: compter(inseres=10, mis_a_jour=2)
+        """
+        for nom, valeur in compteurs.items():
+            self.compteurs[nom] = self.compteurs.get(nom, 0) + int(valeur)
+
+    def terminer(self, duree: float, statut: str):
+        self.duree = duree
+        self.statut = statut
+        self.pic_rss = pic_rss()
+
+    def to_dict(self) -> dict:
+        return {
+            'etape': self.nom,
+            'debut': self.debut.isoformat(timespec='milliseconds'),
+            'duree': self.duree,
+            'statut': self.statut,
+            **self.compteurs,
+            'pic_rss': self.pic_rss,
+            'hausse_pic_rss': self.pic_rss - self._pic_rss_debut if self.pic_rss is not None else None,
+        }
+
+
+class RunMetrics:
+    """
+    Mesures d'un run de migration, une span par étape (extraction Proeco, personnes, emails, ...) et par lot
+    Les spans sont imbriquées par thread : compter() renseigne l'étape en cours du thread appelant,
+    les étapes exécutées en parallèle (PARALLEL_STAGES) ont donc chacune leurs compteurs
+    :param: run_id : identifiant du run, utilisé dans le nom du rapport, date et heure du run par défaut
+    """
+
+    def __init__(self, run_id: str | None = None):
+        self.run_id = run_id or datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _pile(self) -> list[Span]:
+        if not hasattr(self._local, 'pile'):
+            self._local.pile = []
+        return self._local.pile
+
+    @contextmanager
+    def span(self, nom: str, lignes_entree: int | None = None):
+        """
+        Mesure le bloc comme une étape nommée nom
+        :param lignes_entree: nombre de lignes reçues par l'étape, peut aussi être renseigné via compter()
+        """
+        span = Span(nom, lignes_entree)
+        pile = self._pile()
+        pile.append(span)
+        debut = time.perf_counter()
+        statut = 'erreur'
+        try:
+            yield span
+            statut = 'ok'
+        finally:
+            span.terminer(time.perf_counter() - debut, statut)
+            pile.pop()
+            with self._lock:
+                self.spans.append(span)
+
+    def compter(self, **compteurs: int):
+        """
+        Ajoute aux compteurs de l'étape en cours du thread, ignoré hors de toute étape
+        """
+        pile = self._pile()
+        if pile:
+            pile[-1].compter(**compteurs)
+
+    def etapes(self) -> dict[str, dict]:
+        """
+        Mesures agrégées par étape, les étapes exécutées une fois par lot sont cumulées
+        """
+        etapes = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in sorted(spans, key=lambda s: s.debut):
+            etape = etapes.setdefault(span.nom, {'duree': 0.0, 'appels': 0, 'statut': 'ok', 'pic_rss': None})
+            etape['duree'] += span.duree
+            etape['appels'] += 1
+            if span.statut != 'ok':
+                etape['statut'] = span.statut
+            for nom, valeur in span.compteurs.items():
+                etape[nom] = etape.get(nom, 0) + valeur
+            if span.pic_rss is not None:
+                etape['pic_rss'] = max(etape['pic_rss'] or 0, span.pic_rss)
+        for etape in etapes.values():
+            lignes = etape.get('lignes_entree')
+            etape['lignes_par_seconde'] = lignes / etape['duree'] if lignes is not None and etape['duree'] else None
+        return etapes
+
+    def rapport(self, **infos) -> dict:
+        """
+        Rapport du run : informations générales, mesures agrégées par étape et détail des spans
+        :param infos: informations ajoutées au rapport, ex: options du run
+        """
+        with self._lock:
+            spans = [span.to_dict() for span in sorted(self.spans, key=lambda s: s.debut)]
+        return {'run_id': self.run_id, **infos, 'pic_rss': pic_rss(), 'etapes': self.etapes(), 'spans': spans}
+
+    def write_json(self, path: str, **infos):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as fichier:
+            json.dump(self.rapport(**infos), fichier, indent=2, ensure_ascii=False, default=str)
+
+    def write_prometheus(self, path: str, duree: float, succes: bool):
+        """
+        Écrit les mesures par étape au format texte de Prometheus (collecteur textfile de node_exporter)
+        Le fichier est écrit puis renommé, pour ne jamais être lu à moitié écrit
+        """
+        etapes = self.etapes()
+        lignes = [
+            "# HELP migration_mdps_run_duration_seconds Durée du dernier run",
+            "# TYPE migration_mdps_run_duration_seconds gauge",
+            f"migration_mdps_run_duration_seconds {duree}",
+            "# HELP migration_mdps_run_success 1 si le dernier run s'est terminé sans erreur",
+            "# TYPE migration_mdps_run_success gauge",
+            f"migration_mdps_run_success {int(succes)}",
+            "# HELP migration_mdps_run_last_timestamp_seconds Fin du dernier run (timestamp unix)",
+            "# TYPE migration_mdps_run_last_timestamp_seconds gauge",
+            f"migration_mdps_run_last_timestamp_seconds {time.time():.0f}",
+        ]
+        for metrique, aide, cle in METRIQUES_PROMETHEUS:
+            valeurs = [(nom, etape[cle]) for nom, etape in etapes.items() if etape.get(cle) is not None]
+            if not valeurs:
+                continue
+            lignes += [f"# HELP {metrique} {aide}", f"# TYPE {metrique} gauge"]
+            lignes += [f'{metrique}{{stage="{nom}"}} {valeur}' for nom, valeur in valeurs]
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        temporaire = f"{path}.tmp"
+        with open(temporaire, 'w', encoding='utf-8') as fichier:
+            fichier.write('\n'.join(lignes) + '\n')
+        os.replace(temporaire, path)
+
+    @contextmanager
+    def run(self, config, logger=None, **infos):
+        """
+        Mesure tout le run dans l'étape run, puis écrit le rapport json dans le dossier de LOGS_FILE,
+        et le fichier Prometheus si METRICS_PROMETHEUS_FILE est défini, que le run ait réussi ou non
+        :param infos: informations ajoutées au rapport, ex: options du run
+        """
+        debut = datetime.now()
+        succes = False
+        try:
+            with self.span('run') as span:
+                yield span
+            succes = True
+        finally:
+            duree = (datetime.now() - debut).total_seconds()
+            if config.METRICS_REPORT:
+                path = os.path.join(os.path.dirname(config.LOGS_FILE), f"metrics_{self.run_id}.json")
+                self.write_json(path, debut=debut.isoformat(timespec='seconds'), duree=duree,
+                                statut='ok' if succes else 'erreur', **infos)
+                if logger is not None:
+                    logger.info(f"Rapport des mesures du run écrit dans {path}")
+            if config.METRICS_PROMETHEUS_FILE:
+                self.write_prometheus(config.METRICS_PROMETHEUS_FILE, duree, succes)
@@ -1,89 +1,96 @@
-import os.path
 from logging import Logger
 
 import numpy as np
 import pandas as pd
 from sqlalchemy import Engine
-from unidecode import unidecode
 
 from migration_mdps_proeco_sigale import config as default_config
-from migration_mdps_proeco_sigale.db.requetes_sql import SQL_PARAMETER_SIGALE, SQL_MDPS_SIGALE, SQL_EMAILS_SIGALE, \
+from migration_mdps_proeco_sigale.db.requetes_sql import SQL_MDPS_SIGALE, SQL_EMAILS_SIGALE, \
     SQL_PHONES_SIGALE, \
-    SQL_ADRESSES_SIGALE, SQL_EIDS_MDPS_SIGALE, SQL_UTILISATEURS_SIGALE, SQL_DEFAULT_ROLE, SQL_DEFAULT_CULTURE
+    SQL_ADRESSES_SIGALE, SQL_EIDS_MDPS_SIGALE, SQL_UTILISATEURS_SIGALE, SQL_IDS_UTILISATEURS_SIGALE, \
+    SQL_DEFAULT_ROLE, SQL_DEFAULT_CULTURE
+from migration_mdps_proeco_sigale.db.connection_manager import SigaleSession
+from migration_mdps_proeco_sigale.db.sql_read_methods import read_sql_by_ids
 from migration_mdps_proeco_sigale.db.sql_write_methods import WriteMethods
+from migration_mdps_proeco_sigale.db.staging_merge import StagingMerge
+from migration_mdps_proeco_sigale.export import Exporter
+from migration_mdps_proeco_sigale.metrics import RunMetrics
+from migration_mdps_proeco_sigale.reference_cache import ReferenceCache
+from migration_mdps_proeco_sigale.sigale_diff import read_current_values, changed_fields, DiffReport
+from migration_mdps_proeco_sigale.tools import normaliser_texte, champs_config
+
+
+def migrate_personnes(enseignants_proeco: pd.DataFrame, sigale_engine, logger: Logger, export:bool = False, dry_run:bool = False, update:bool = True, config = default_config,
+                      staging_merge: bool = False, references: ReferenceCache | None = None,
+                      exporter: Exporter | None = None, sigale_session: SigaleSession | None = None,
+                      metrics: RunMetrics | None = None, diff_report: DiffReport | None = None):
+
+    # Rien à migrer, ex: aucun enseignant modifié en synchro delta
+    if len(enseignants_proeco) == 0:
+        logger.info("Aucun mdp à migrer")
+        return None
 
-
-def migrate_personnes(enseignants_proeco: pd.DataFrame, sigale_engine, logger: Logger, export:bool = False, dry_run:bool = False, update:bool = True, config = default_config):
+    # Données de référence de Sigale, chargées ici si elles ne sont pas fournies par run_migrations
+    if references is None:
+        references = ReferenceCache.from_config(sigale_engine, config, logger, dry_run=dry_run)
+    if exporter is None:
+        exporter = Exporter(config.EXPORT_PATH, config.EXPORT_FORMAT, config.EXPORT_ROW_GROUP_SIZE)
+    # Mesures de l'étape, fournies par run_migrations
+    if metrics is None:
+        metrics = RunMetrics()
 
     ### AJOUT DU CHAMP EID
-    enseignants_proeco = enseignants_proeco.assign(
-        eid=enseignants_proeco.apply(lambda row: config.get_eid(row), 1)
-    )
+    # get_eids calcule tous les EID en une fois, get_eid (ligne par ligne) reste supporté pour les anciennes configs
+    if hasattr(config, 'get_eids'):
+        eids = config.get_eids(enseignants_proeco)
+    else:
+        eids = enseignants_proeco.apply(lambda row: config.get_eid(row), 1)
+    enseignants_proeco = enseignants_proeco.assign(eid=eids)
     #### AJOUT DES SEXE_ID ####
     # On récupère les sexes de Sigale dans une table ['sexe_id', 'sexe']
-    sexes_sigale = pd.read_sql_query(SQL_PARAMETER_SIGALE, sigale_engine,
-                                     params={'type_parameter': 'sexes_sigale'}).rename(
-        columns={'id': 'sexe_id', 'code': 'sexe'})
+    sexes_sigale = references.parameter('sexes_sigale').rename(columns={'id': 'sexe_id', 'code': 'sexe'})
     # On récupère la première lettre du code sexe ( 'feminin', 'masculin' ) qu'on met en majuscule pour recoupement avec Proeco
-    sexes_sigale['sexe'] = sexes_sigale['sexe'].apply(lambda x: x[0].upper())
+    sexes_sigale['sexe'] = sexes_sigale['sexe'].str[0].str.upper()
     # On merge
     enseignants_proeco = enseignants_proeco.merge(sexes_sigale, on='sexe', how='inner', validate='m:1').drop(
         columns='sexe')
 
     ### AJOUT DES PAYS_ID_NATIONALITE
     # On reformate les codes pays dans notre liste d'enseignants, majuscules, suppression d'accents
-    enseignants_proeco['nation'] = enseignants_proeco['nation'].apply(str.upper).apply(unidecode).apply(str.strip)
+    enseignants_proeco['nation'] = normaliser_texte(enseignants_proeco['nation'])
     # On récupère les nationalités de Sigale dans une table ['pays_id_nationalite', 'code']
-    pays_sigale = pd.read_sql_query("select id as pays_id_nationalite, code as code_pays from core.countries",
-                                    sigale_engine)
+    pays_sigale = references.countries().rename(columns={'id': 'pays_id_nationalite', 'code': 'code_pays'})
     # On merge
     enseignants_proeco = enseignants_proeco.merge(pays_sigale, left_on='nation', right_on='code_pays', how='left',
                                                   validate='m:1').drop(columns=['nation']).drop(columns='code_pays')
 
     ### AJOUT DES PAYS_ID_NAISSANCE_PAYS
     # On reformate les codes pays dans notre liste d'enseignants, majuscules, suppression d'accents
-    enseignants_proeco['paynaiss'] = enseignants_proeco['paynaiss'].apply(
-        lambda x: unidecode(str(x).upper()).strip() if pd.notna(x) else None
-    )
-                                      # .apply(str.upper).apply(unidecode).apply(str.strip))
+    enseignants_proeco['paynaiss'] = normaliser_texte(enseignants_proeco['paynaiss'])
     # On renome l'id pour correspondre à la clé étrangère dans personnes.personnes
     pays_sigale.rename(columns={'pays_id_nationalite': 'pays_id_naissance_pays', 'code_pays': 'paynaiss'}, inplace=True)
     enseignants_proeco = enseignants_proeco.merge(pays_sigale, on='paynaiss', how='left', validate='m:1')
 
     ### AJOUT DES CITY_ID_NAISSANCE
-    # On récupère les villes de Sigale en ajoutant le code pays BE
-    villes_sigale = pd.read_sql_query(
-        "select id as city_id_naissance, name as city_name from core.cities order by postal_code asc", sigale_engine)
-    villes_sigale['code_pays'] = 'BE'
-    # On reformate les noms de villes pour s'assurer du match
-    villes_sigale['city_name'] = villes_sigale['city_name'].apply(
-        lambda x: unidecode(str(x).upper()).strip() if pd.notna(x) else None
-    )
-    enseignants_proeco['lieunaiss'] = enseignants_proeco['lieunaiss'].apply(
-        lambda x: unidecode(str(x).upper()).strip() if pd.notna(x) else None
-    )
-
-    # On supprime les doublons, (plusieurs fois la même ville avec codes postaux différents)
-    # keep first, pour garder le code postal le plus petit (on conserve 4000 au lieu de 4020)
-    villes_sigale.drop_duplicates(subset=['city_name', 'code_pays'], inplace=True, keep='first')
-    enseignants_proeco = (
-        enseignants_proeco.merge(villes_sigale, left_on=['lieunaiss', 'paynaiss'], right_on=['city_name', 'code_pays'],
-                                 how='left', validate='m:1')
-        .drop(columns=['city_name', 'code_pays']))
+    # On recherche les villes de naissance belges dans l'index des villes de Sigale, sur le nom normalisé
+    # (pas de code postal dans Proeco, on garde le code postal le plus petit : 4000 au lieu de 4020)
+    enseignants_proeco['lieunaiss'] = normaliser_texte(enseignants_proeco['lieunaiss'])
+    enseignants_proeco['city_id_naissance'] = references.city_index().match(
+        enseignants_proeco['lieunaiss'], approchant=config.CITY_INDEX_TRIGRAMMES,
+        seuil=config.CITY_INDEX_SEUIL_TRIGRAMMES,
+    ).where(enseignants_proeco['paynaiss'] == 'BE')
 
     # On ajoute la ville dans le champ lieu_naissance_hors_belgique quand le pays de naissance n'est pas BE
-    enseignants_proeco['lieu_naissance_hors_belgique'] = enseignants_proeco.apply(
-        lambda row: row['lieunaiss'] if row['paynaiss'] != 'BE' else None, axis=1)
+    enseignants_proeco['lieu_naissance_hors_belgique'] = enseignants_proeco['lieunaiss'].where(
+        enseignants_proeco['paynaiss'] != 'BE', None)
 
     ### AJOUT DES ETAT_CIVIL_ID
     # On récupère les états civils de Sigale
-    etats_civils_sigale = pd.read_sql_query(SQL_PARAMETER_SIGALE, sigale_engine,
-                                            params={'type_parameter': 'etats_civils'})
+    etats_civils_sigale = references.parameter('etats_civils')
     # On renomme pour correspondre aux champs existants dans Sigale et Proeco
     etats_civils_sigale.rename(columns={'id': 'etat_civil_id', 'code': 'etatcivil'}, inplace=True)
     # On remplace les états civils de Proeco avec ceux de Sigale pour préparer le merge
-    enseignants_proeco['etatcivil'] = enseignants_proeco['etatcivil'].apply(
-        lambda code: config.MAPPING_ETATS_CIVILS.get(code))
+    enseignants_proeco['etatcivil'] = enseignants_proeco['etatcivil'].map(config.MAPPING_ETATS_CIVILS)
     # On merge pour ajouter les id d'états civils à nos mdps
     enseignants_proeco = enseignants_proeco.merge(etats_civils_sigale, on='etatcivil', how='left', validate='m:1').drop(
         columns='etatcivil')
@@ -94,10 +101,18 @@ def migrate_personnes(enseignants_proeco: pd.DataFrame, sigale_engine, logger: L
     # On renomme les champs selon le mapping pour correspondre à Sigale
     enseignants_proeco.rename(columns=config.MAPPING_PROECO_SIGALE, inplace=True)
 
+    # Si fusion via table de staging, la séparation ajout/mise à jour est faite côté serveur
+    if staging_merge:
+        for key, value in {**config.SIGALE_METADATA_FIELDS, **config.SIGALE_PERSONNES_DEFAULT_FIELDS}.items():
+            enseignants_proeco[key] = value
+        merge_via_staging(enseignants_proeco, sigale_engine, logger, 'personnes', ['registre_national_numero'],
+                          config.SIGALE_UPDATE_FIELDS, export, dry_run, update, config=config, exporter=exporter,
+                          metrics=metrics)
+        return None
 
     ### RECOUPEMENT AVEC LES DONNEES DE SIGALE
-    # on récupère les personnes de Sigale
-    personnes_sigales = pd.read_sql_query(SQL_MDPS_SIGALE, sigale_engine)
+    # on récupère les personnes de Sigale, limitées aux enseignants traités
+    personnes_sigales = read_sql_by_ids(SQL_MDPS_SIGALE, sigale_session or sigale_engine, enseignants_proeco['registre_national_numero'])
     # On merge pour voir quels enseignants sont déjà dans Sigale
     enseignants_proeco = enseignants_proeco.merge(personnes_sigales, on='registre_national_numero', how='left',
                                                   indicator=True, validate='1:1')
@@ -105,11 +120,17 @@ def migrate_personnes(enseignants_proeco: pd.DataFrame, sigale_engine, logger: L
     nouveaux_enseignants = enseignants_proeco[enseignants_proeco['_merge'] == 'left_only'].drop(columns=['_merge', 'personne_id'])
     # Les enseignants à mettre à jour sont ceux existant déjà dans Sigale
     enseignants_existants = enseignants_proeco[enseignants_proeco['_merge'] == 'both'].drop(columns=['_merge'])
+    # On écarte les enseignants déjà à jour dans Sigale
+    nb_inchanges = 0
+    if update:
+        enseignants_existants, nb_inchanges = filtrer_inchanges(enseignants_existants, sigale_session or sigale_engine,
+                                                                'personnes', 'personne_id', config.SIGALE_UPDATE_FIELDS,
+                                                                config=config, diff_report=diff_report)
 
     # On exporte si option
     if export:
-        nouveaux_enseignants.to_csv(os.path.join(config.EXPORT_PATH, 'mdps_nouveaux.csv'), index=False)
-        enseignants_existants.to_csv(os.path.join(config.EXPORT_PATH, 'mdps_existants.csv'), index=False)
+        exporter.write(nouveaux_enseignants, 'mdps_nouveaux')
+        exporter.write(enseignants_existants, 'mdps_existants')
 
     # On ajoute les métadonnées
     for key, value in config.SIGALE_METADATA_FIELDS.items():
@@ -121,14 +142,20 @@ def migrate_personnes(enseignants_proeco: pd.DataFrame, sigale_engine, logger: L
         nouveaux_enseignants[key] = value
         enseignants_existants[key] = value
 
+    # Compteurs du rapport du run, en dry run les lignes qui seraient insérées ou mises à jour
+    metrics.compter(lignes_sortie=len(nouveaux_enseignants) + len(enseignants_existants) + nb_inchanges,
+                    inseres=len(nouveaux_enseignants), mis_a_jour=len(enseignants_existants) if update else 0,
+                    inchanges=nb_inchanges)
+
     # Si dry_run, on s'arrête avant les modifications en DB
     if dry_run:
         logger.info(
-            f"Dry run, pas de modification en DB, {len(nouveaux_enseignants)} mdps à insérer, {len(enseignants_existants)} mdps à mettre à jour")
+            f"Dry run, pas de modification en DB, {len(nouveaux_enseignants)} mdps à insérer, {len(enseignants_existants)} mdps à mettre à jour, {nb_inchanges} inchangés")
         return None
 
     # On insère les nouveaux enseignants dans Sigale
-    nouveaux_enseignants.to_sql('personnes', con=sigale_engine, schema='personnes', index=False, if_exists='append')
+    nouveaux_enseignants.to_sql('personnes', con=sigale_engine, schema='personnes', index=False, if_exists='append',
+                                method=WriteMethods.insert_method(sigale_engine, config.SIGALE_INSERT_METHOD))
     logger.info(f"{len(nouveaux_enseignants)} nouveaux mdps introduits dans Sigale")
 
     # Si no-update, on s'arrête
@@ -137,16 +164,29 @@ def migrate_personnes(enseignants_proeco: pd.DataFrame, sigale_engine, logger: L
 
 
     # On mets à jour les champs des enseignants existants basé sur la config
-    enseignants_existants.rename(columns={'personne_id': 'id'}).to_sql('personnes', con=sigale_engine, schema='personnes', index=False, if_exists='append',
-                                                                       method=WriteMethods(index_columns=['id'], update_columns=config.SIGALE_UPDATE_FIELDS).update_on_conflict)
-    logger.info(f"{len(enseignants_existants)} mdps mis à jour dans Sigale")
+    write_methods = WriteMethods(index_columns=['id'], update_columns=config.SIGALE_UPDATE_FIELDS,
+                                 batch_size=config.SIGALE_UPDATE_BATCH_SIZE,
+                                 adaptive_batch=config.SIGALE_UPDATE_ADAPTIVE_BATCH,
+                                 target_latency=config.SIGALE_UPDATE_TARGET_LATENCY)
+    enseignants_existants.rename(columns={'personne_id': 'id'}).to_sql(
+        'personnes', con=sigale_engine, schema='personnes', index=False, if_exists='append',
+        method=write_methods.update_on_conflict)
+    logger.info(f"{len(enseignants_existants)} mdps mis à jour dans Sigale, {nb_inchanges} inchangés")
 
     return None
 
 
-def migrate_users(mdps:pd.DataFrame, sigale_engine: Engine, logger: Logger, export:bool = False, dry_run:bool = False, update:bool = True, config = default_config):
+def migrate_users(mdps:pd.DataFrame, sigale_engine: Engine, logger: Logger, export:bool = False, dry_run:bool = False, update:bool = True, config = default_config,
+                  exporter: Exporter | None = None, sigale_session: SigaleSession | None = None,
+                  metrics: RunMetrics | None = None):
+
+    if exporter is None:
+        exporter = Exporter(config.EXPORT_PATH, config.EXPORT_FORMAT, config.EXPORT_ROW_GROUP_SIZE)
+    # Mesures de l'étape, fournies par run_migrations
+    if metrics is None:
+        metrics = RunMetrics()
 
-    mdps_sigale = pd.read_sql_query(SQL_EIDS_MDPS_SIGALE, sigale_engine)
+    mdps_sigale = read_sql_by_ids(SQL_EIDS_MDPS_SIGALE, sigale_session or sigale_engine, mdps['personne_id'])
 
     # On limite aux mdps nouvellement récupérés:
     mdps_sigale = mdps_sigale.merge(mdps, how='inner', on='personne_id')
@@ -154,7 +194,7 @@ def migrate_users(mdps:pd.DataFrame, sigale_engine: Engine, logger: Logger, expo
     mdps_sigale = mdps_sigale[['eid', 'display_name']]
 
     # On récupère les utilisateurs existants
-    utilisateurs_existants = pd.read_sql_query(SQL_UTILISATEURS_SIGALE, sigale_engine)
+    utilisateurs_existants = read_sql_by_ids(SQL_UTILISATEURS_SIGALE, sigale_session or sigale_engine, mdps_sigale['eid'])
 
     # On recoupe pour ne conserver que les nouveaux utilisateurs parmi les personnes dans Sigale
     mdps_utilisateurs = mdps_sigale.merge(utilisateurs_existants, how='left', on='eid', indicator=True)
@@ -187,7 +227,9 @@ def migrate_users(mdps:pd.DataFrame, sigale_engine: Engine, logger: Logger, expo
 
     # On exporte si option
     if export:
-        nouveaux_utilisateurs.to_csv(os.path.join(config.EXPORT_PATH, 'utilisateurs_nouveaux.csv'), index=False)
+        exporter.write(nouveaux_utilisateurs, 'utilisateurs_nouveaux')
+
+    metrics.compter(lignes_sortie=len(mdps_sigale), inseres=len(nouveaux_utilisateurs))
 
     logger.info(
         f"Dry run, pas de modification en DB, {len(nouveaux_utilisateurs)} utilisateurs à insérer")
@@ -195,17 +237,20 @@ def migrate_users(mdps:pd.DataFrame, sigale_engine: Engine, logger: Logger, expo
     # Sinon on créé en DB:
     with sigale_engine.begin() as conn:
         # On insère les nouveaux utilisateurs dans Sigale
-        nouveaux_utilisateurs.to_sql('oauth_users', con=conn, schema='core', index=False, if_exists='append')
+        nouveaux_utilisateurs.to_sql('oauth_users', con=conn, schema='core', index=False, if_exists='append',
+                                     method=WriteMethods.insert_method(conn, config.SIGALE_INSERT_METHOD))
 
-        # On récupère les ids utilisateurs
-        id_nouveaux_utilisateurs = pd.read_sql_query("select technical_id, id as user_id from core.oauth_users", conn)
+        # On récupère les ids des utilisateurs insérés, dans la transaction en cours
+        id_nouveaux_utilisateurs = read_sql_by_ids(SQL_IDS_UTILISATEURS_SIGALE, conn,
+                                                   nouveaux_utilisateurs['technical_id'])
         # On merge avec les nouveaux utilisateurs
         nouveaux_utilisateurs = nouveaux_utilisateurs.merge(id_nouveaux_utilisateurs, on='technical_id', how='inner')
 
         # On récupère les colonnes qui nous intéresse et on renomme pour marcher avec la table oauth_users_roles_roles
         oauth_users_roles = nouveaux_utilisateurs[['default_role_id', 'user_id']].copy()
         oauth_users_roles.rename(columns={'default_role_id': 'rolesId', 'user_id': 'oauthUsersId'}, inplace=True)
-        oauth_users_roles.to_sql('oauth_users_roles_roles', conn, schema='core', index=False, if_exists='append')
+        oauth_users_roles.to_sql('oauth_users_roles_roles', conn, schema='core', index=False, if_exists='append',
+                                 method=WriteMethods.insert_method(conn, config.SIGALE_INSERT_METHOD))
 
         if dry_run:
             conn.rollback()
@@ -215,7 +260,24 @@ def migrate_users(mdps:pd.DataFrame, sigale_engine: Engine, logger: Logger, expo
 
 
 
-def migrate_emails(personne_emails: pd.DataFrame, sigale_engine, logger: Logger, export:bool = False, dry_run:bool = False, update:bool = True, config = default_config):
+def migrate_emails(personne_emails: pd.DataFrame, sigale_engine, logger: Logger, export:bool = False, dry_run:bool = False, update:bool = True, config = default_config,
+                   staging_merge: bool = False, references: ReferenceCache | None = None,
+                   exporter: Exporter | None = None, sigale_session: SigaleSession | None = None,
+                   metrics: RunMetrics | None = None, diff_report: DiffReport | None = None):
+
+    # Rien à migrer, ex: aucun enseignant modifié en synchro delta
+    if len(personne_emails) == 0:
+        logger.info("Aucun email à migrer")
+        return None
+
+    # Données de référence de Sigale, chargées ici si elles ne sont pas fournies par run_migrations
+    if references is None:
+        references = ReferenceCache.from_config(sigale_engine, config, logger, dry_run=dry_run)
+    if exporter is None:
+        exporter = Exporter(config.EXPORT_PATH, config.EXPORT_FORMAT, config.EXPORT_ROW_GROUP_SIZE)
+    # Mesures de l'étape, fournies par run_migrations
+    if metrics is None:
+        metrics = RunMetrics()
 
     # Avec melt, on répartit nos colonnes email et email2 dans des nouvelles lignes
     # On passe d'une structure registre_national, email, email2
@@ -230,18 +292,17 @@ def migrate_emails(personne_emails: pd.DataFrame, sigale_engine, logger: Logger,
             ].index,
         inplace=True)
 
-    # en partant de la config, on ajoute le type d'email, None si le champ n'est pas dans la config
-    personne_emails['code_domaine'] = personne_emails.apply(lambda row: config.EMAILS_FIELDS.get(row['champ_proeco']).get('code_domaine') if row['champ_proeco'] in config.EMAILS_FIELDS else None, axis=1)
+    # en partant de la config, on ajoute le type d'email, est_individuel et est_principal
+    champs_emails = champs_config(config.EMAILS_FIELDS, ['code_domaine', 'est_individuel', 'est_principal'])
+    personne_emails = personne_emails.merge(champs_emails, left_on='champ_proeco', right_index=True, how='left')
     # On supprime là où le champ n'est pas déclaré dans la config
     personne_emails.dropna(subset=['code_domaine'], inplace=True)
-    personne_emails['est_individuel'] = personne_emails.apply(lambda row: config.EMAILS_FIELDS.get(row['champ_proeco']).get('est_individuel'), axis=1)
-    personne_emails['est_principal'] = personne_emails.apply(lambda row: config.EMAILS_FIELDS.get(row['champ_proeco']).get('est_principal'), axis=1)
 
     personne_emails.dropna(subset=['valeur'], inplace=True)
 
     ## AJOUT DES ID DOMAINES
     # On récupère les domaines emails de Sigale
-    emails_domaines = pd.read_sql_query(SQL_PARAMETER_SIGALE, sigale_engine, params={'type_parameter': 'email_domaines'})
+    emails_domaines = references.parameter('email_domaines')
     emails_domaines.rename(columns={'code': 'code_domaine', 'id': 'email_domaine_id'}, inplace=True)
     # On merge avec les nouveaux emails
     personne_emails = personne_emails.merge(emails_domaines, on='code_domaine', how='inner', validate='m:1')
@@ -251,21 +312,32 @@ def migrate_emails(personne_emails: pd.DataFrame, sigale_engine, logger: Logger,
     # On filtre les emails vides
     # personne_emails = personne_emails[~personne_emails['valeur'].isnull()]
 
+    # Si fusion via table de staging, la séparation ajout/mise à jour est faite côté serveur
+    if staging_merge:
+        for key, value in config.SIGALE_METADATA_FIELDS.items():
+            personne_emails[key] = value
+        merge_via_staging(personne_emails, sigale_engine, logger, 'personne_emails', ['personne_id', 'email_domaine_id'],
+                          config.SIGALE_EMAIL_UPDATE_FIELDS, export, dry_run, update,
+                          created_by=migration_created_by(config), config=config, exporter=exporter,
+                          metrics=metrics)
+        return None
+
     ### RECOUPEMENT AVEC DONNEES SIGALE
-    emails_sigale = pd.read_sql_query(SQL_EMAILS_SIGALE, sigale_engine)
+    emails_sigale = read_sql_by_ids(SQL_EMAILS_SIGALE, sigale_session or sigale_engine, personne_emails['personne_id'])
 
     # On merge pour voir quels enseignants sont déjà dans Sigale
     personne_emails = personne_emails.merge(emails_sigale, on=['personne_id', 'email_domaine_id'], how='left',
                                                   indicator=True, validate='1:m', suffixes=['_new', '_old'])
 
     # Si config pour ne remplacer que les created_by migration
+    nb_ignores = 0
     if config.UPDATE_ONLY_CREATED_BY_MIGRATION:
-        personne_emails.drop(
-            personne_emails[
-                (personne_emails['created_by'] != config.SIGALE_METADATA_FIELDS.get('created_by', 1))
-                    & (personne_emails['_merge'] == 'both')
-            ].index,
-            inplace=True)
+        non_modifiables = personne_emails[
+            (personne_emails['created_by'] != config.SIGALE_METADATA_FIELDS.get('created_by', 1))
+            & (personne_emails['_merge'] == 'both')
+        ].index
+        nb_ignores = len(non_modifiables)
+        personne_emails.drop(non_modifiables, inplace=True)
 
     # Suppression de la colonne created by, utilisée uniquement pour filtrer
     personne_emails.drop(columns=['created_by'], inplace=True)
@@ -275,28 +347,41 @@ def migrate_emails(personne_emails: pd.DataFrame, sigale_engine, logger: Logger,
     nouveaux_emails = personne_emails[personne_emails['_merge'] == 'left_only'].drop(columns=['_merge', 'email_id'])
     # Les emails à mettre à jour sont ceux existant déjà dans Sigale
     emails_existants = personne_emails[personne_emails['_merge'] == 'both'].drop(columns=['_merge'])
+    # On écarte les emails déjà à jour dans Sigale
+    nb_inchanges = 0
+    if update:
+        emails_existants, nb_inchanges = filtrer_inchanges(emails_existants, sigale_session or sigale_engine,
+                                                           'personne_emails', 'email_id', config.SIGALE_EMAIL_UPDATE_FIELDS,
+                                                           renames={'valeur_new': 'valeur'}, config=config,
+                                                           diff_report=diff_report)
 
     nouveaux_emails.drop(columns=['valeur_old'], inplace=True)
     nouveaux_emails.rename(columns={'valeur_new': 'valeur'}, inplace=True)
 
     # On exporte si option
     if export:
-        nouveaux_emails.to_csv(os.path.join(config.EXPORT_PATH, 'emails_nouveaux.csv'), index=False)
-        emails_existants.to_csv(os.path.join(config.EXPORT_PATH, 'emails_existants.csv'), index=False)
+        exporter.write(nouveaux_emails, 'emails_nouveaux')
+        exporter.write(emails_existants, 'emails_existants')
 
     # On ajoute les métadonnées
     for key, value in config.SIGALE_METADATA_FIELDS.items():
         nouveaux_emails[key] = value
         emails_existants[key] = value
 
+    # Compteurs du rapport du run, en dry run les lignes qui seraient insérées ou mises à jour
+    metrics.compter(lignes_sortie=len(nouveaux_emails) + len(emails_existants) + nb_inchanges + nb_ignores,
+                    inseres=len(nouveaux_emails), mis_a_jour=len(emails_existants) if update else 0,
+                    inchanges=nb_inchanges, ignores=nb_ignores)
+
     # Si dry_run, on s'arrête avant les modifications en DB
     if dry_run:
         logger.info(
-            f"Dry run, pas de modification en DB, {len(nouveaux_emails)} emails à insérer, {len(emails_existants)} emails à mettre à jour")
+            f"Dry run, pas de modification en DB, {len(nouveaux_emails)} emails à insérer, {len(emails_existants)} emails à mettre à jour, {nb_inchanges} inchangés, {nb_ignores} ignorés")
         return None
 
     # On insère les nouveaux enseignants dans Sigale
-    nouveaux_emails.to_sql('personne_emails', con=sigale_engine, schema='personnes', index=False, if_exists='append')
+    nouveaux_emails.to_sql('personne_emails', con=sigale_engine, schema='personnes', index=False, if_exists='append',
+                           method=WriteMethods.insert_method(sigale_engine, config.SIGALE_INSERT_METHOD))
     logger.info(f"{len(nouveaux_emails)} nouveaux emails introduits dans Sigale")
 
     # Si no-update, on s'arrête
@@ -307,17 +392,36 @@ def migrate_emails(personne_emails: pd.DataFrame, sigale_engine, logger: Logger,
     emails_existants.rename(columns={'valeur_new': 'valeur'}, inplace=True)
 
     # On mets à jour les champs des enseignants existants basé sur la config
-    emails_existants.rename(columns={'email_id': 'id'}).to_sql('personne_emails', con=sigale_engine,
-                                                               schema='personnes', index=False,
-                                                               if_exists='append',
-                                                               method=WriteMethods(index_columns=['id'],
-                                                                                   update_columns=config.SIGALE_EMAIL_UPDATE_FIELDS).update_on_conflict)
-    logger.info(f"{len(emails_existants)} emails mis à jour dans Sigale")
+    write_methods = WriteMethods(index_columns=['id'], update_columns=config.SIGALE_EMAIL_UPDATE_FIELDS,
+                                 batch_size=config.SIGALE_UPDATE_BATCH_SIZE,
+                                 adaptive_batch=config.SIGALE_UPDATE_ADAPTIVE_BATCH,
+                                 target_latency=config.SIGALE_UPDATE_TARGET_LATENCY)
+    emails_existants.rename(columns={'email_id': 'id'}).to_sql(
+        'personne_emails', con=sigale_engine, schema='personnes', index=False, if_exists='append',
+        method=write_methods.update_on_conflict)
+    logger.info(f"{len(emails_existants)} emails mis à jour dans Sigale, {nb_inchanges} inchangés, {nb_ignores} ignorés (non créés par la migration)")
 
     return None
 
 
-def migrate_phones(phones: pd.DataFrame, sigale_engine, logger: Logger, export:bool = False, dry_run:bool = False, update:bool = True, config = default_config):
+def migrate_phones(phones: pd.DataFrame, sigale_engine, logger: Logger, export:bool = False, dry_run:bool = False, update:bool = True, config = default_config,
+                   staging_merge: bool = False, references: ReferenceCache | None = None,
+                   exporter: Exporter | None = None, sigale_session: SigaleSession | None = None,
+                   metrics: RunMetrics | None = None, diff_report: DiffReport | None = None):
+
+    # Rien à migrer, ex: aucun enseignant modifié en synchro delta
+    if len(phones) == 0:
+        logger.info("Aucun téléphone à migrer")
+        return None
+
+    # Données de référence de Sigale, chargées ici si elles ne sont pas fournies par run_migrations
+    if references is None:
+        references = ReferenceCache.from_config(sigale_engine, config, logger, dry_run=dry_run)
+    if exporter is None:
+        exporter = Exporter(config.EXPORT_PATH, config.EXPORT_FORMAT, config.EXPORT_ROW_GROUP_SIZE)
+    # Mesures de l'étape, fournies par run_migrations
+    if metrics is None:
+        metrics = RunMetrics()
 
     # On ne conserve que les champs définis dans la config
     champs_utilises = [field for field in config.PHONE_FIELDS]
@@ -338,54 +442,58 @@ def migrate_phones(phones: pd.DataFrame, sigale_engine, logger: Logger, export:b
         inplace=True)
 
     # On ajoute les champs tels que définis dans la config
-    phones['code_domaine'] = phones.apply(
-        lambda row: config.PHONE_FIELDS.get(row['champ_proeco']).get('code_domaine'), axis=1)
-    phones['code_type'] = phones.apply(
-        lambda row: config.PHONE_FIELDS.get(row['champ_proeco']).get('code_type'), axis=1)
-    phones['est_individuel'] = phones.apply(
-        lambda row: config.PHONE_FIELDS.get(row['champ_proeco']).get('est_individuel'), axis=1)
-    phones['est_principal'] = phones.apply(
-        lambda row: config.PHONE_FIELDS.get(row['champ_proeco']).get('est_principal'), axis=1)
+    champs_phones = champs_config(config.PHONE_FIELDS, ['code_domaine', 'code_type', 'est_individuel', 'est_principal'])
+    phones = phones.merge(champs_phones, left_on='champ_proeco', right_index=True, how='left')
 
     ## AJOUT DES ID DOMAINES
     # On récupère les domaines phones de Sigale
-    phones_domaines = pd.read_sql_query(SQL_PARAMETER_SIGALE, sigale_engine,
-                                        params={'type_parameter': 'telephone_domaines'})
+    phones_domaines = references.parameter('telephone_domaines')
     phones_domaines.rename(columns={'code': 'code_domaine', 'id': 'telephone_domaine_id'}, inplace=True)
     # On merge avec les nouveaux emails
     phones = phones.merge(phones_domaines, on='code_domaine', how='inner', validate='m:1')
 
     ## AJOUT DES ID TYPES
     # On récupère les domaines phones de Sigale
-    phones_types = pd.read_sql_query(SQL_PARAMETER_SIGALE, sigale_engine,
-                                        params={'type_parameter': 'telephone_types'})
+    phones_types = references.parameter('telephone_types')
     phones_types.rename(columns={'code': 'code_type', 'id': 'telephone_type_id'}, inplace=True)
     # On merge avec les nouveaux emails
     phones = phones.merge(phones_types, on='code_type', how='inner', validate='m:1')
 
     ## NETTOYAGE
     phones.drop(columns=['code_domaine', 'code_type', 'champ_proeco'], inplace=True)
-    phones['numero'] = phones['numero'].apply(lambda x: x.replace(' ', '').replace('.', '').replace('/', ''))
+    phones['numero'] = phones['numero'].str.replace(r'[ ./]', '', regex=True)
     # On supprime là où le numéro de téléphone est vide
     phones.drop(phones[phones['numero'] == ''].index, inplace=True)
     phones.dropna(subset=['numero'], inplace=True)
 
+    # Si fusion via table de staging, la séparation ajout/mise à jour est faite côté serveur
+    if staging_merge:
+        for key, value in config.SIGALE_METADATA_FIELDS.items():
+            phones[key] = value
+        merge_via_staging(phones, sigale_engine, logger, 'personne_telephones',
+                          ['personne_id', 'telephone_domaine_id', 'telephone_type_id'],
+                          config.SIGALE_PHONE_UPDATE_FIELDS, export, dry_run, update,
+                          created_by=migration_created_by(config), config=config, exporter=exporter,
+                          metrics=metrics)
+        return None
+
     ### RECOUPEMENT AVEC DONNEES SIGALE
-    phones_sigale = pd.read_sql_query(SQL_PHONES_SIGALE, sigale_engine)
+    phones_sigale = read_sql_by_ids(SQL_PHONES_SIGALE, sigale_session or sigale_engine, phones['personne_id'])
 
     # On merge pour voir quels numéros sont déjà dans Sigale
     phones = phones.merge(phones_sigale, on=['personne_id', 'telephone_domaine_id', 'telephone_type_id'], how='left',
                                             indicator=True, validate='1:m', suffixes=['_new', '_old'])
 
     # Si config pour ne remplacer que les created_by migration
+    nb_ignores = 0
     if config.UPDATE_ONLY_CREATED_BY_MIGRATION:
         # On écarte les lignes non créées par la migration
-        phones.drop(
-            phones[
-                (phones['created_by'] != config.SIGALE_METADATA_FIELDS.get('created_by', 1))
-                & (phones['_merge'] == 'both')
-            ].index,
-            inplace=True)
+        non_modifiables = phones[
+            (phones['created_by'] != config.SIGALE_METADATA_FIELDS.get('created_by', 1))
+            & (phones['_merge'] == 'both')
+        ].index
+        nb_ignores = len(non_modifiables)
+        phones.drop(non_modifiables, inplace=True)
 
     # Suppression de la colonne created by, utilisée uniquement pour filtrer
     phones.drop(columns=['created_by'], inplace=True)
@@ -394,29 +502,41 @@ def migrate_phones(phones: pd.DataFrame, sigale_engine, logger: Logger, export:b
     nouveaux_phones = phones[phones['_merge'] == 'left_only'].drop(columns=['_merge', 'telephone_id'])
     # Les emails à mettre à jour sont ceux existant déjà dans Sigale
     phones_existants = phones[phones['_merge'] == 'both'].drop(columns=['_merge'])
+    # On écarte les téléphones déjà à jour dans Sigale
+    nb_inchanges = 0
+    if update:
+        phones_existants, nb_inchanges = filtrer_inchanges(phones_existants, sigale_session or sigale_engine,
+                                                           'personne_telephones', 'telephone_id', config.SIGALE_PHONE_UPDATE_FIELDS,
+                                                           renames={'numero_new': 'numero'}, config=config,
+                                                           diff_report=diff_report)
 
     nouveaux_phones.drop(columns=['numero_old'], inplace=True)
     nouveaux_phones.rename(columns={'numero_new': 'numero'}, inplace=True)
 
     # On exporte si option
     if export:
-        nouveaux_phones.to_csv(os.path.join(config.EXPORT_PATH, 'telephones_nouveaux.csv'), index=False)
-        phones_existants.to_csv(os.path.join(config.EXPORT_PATH, 'telephones_existants.csv'), index=False)
+        exporter.write(nouveaux_phones, 'telephones_nouveaux')
+        exporter.write(phones_existants, 'telephones_existants')
 
     # On ajoute les métadonnées
     for key, value in config.SIGALE_METADATA_FIELDS.items():
         nouveaux_phones[key] = value
         phones_existants[key] = value
 
+    # Compteurs du rapport du run, en dry run les lignes qui seraient insérées ou mises à jour
+    metrics.compter(lignes_sortie=len(nouveaux_phones) + len(phones_existants) + nb_inchanges + nb_ignores,
+                    inseres=len(nouveaux_phones), mis_a_jour=len(phones_existants) if update else 0,
+                    inchanges=nb_inchanges, ignores=nb_ignores)
+
     # Si dry_run, on s'arrête avant les modifications en DB
     if dry_run:
         logger.info(
-            f"Dry run, pas de modification en DB, {len(nouveaux_phones)} téléphones à insérer, {len(phones_existants)} téléphones à mettre à jour")
+            f"Dry run, pas de modification en DB, {len(nouveaux_phones)} téléphones à insérer, {len(phones_existants)} téléphones à mettre à jour, {nb_inchanges} inchangés, {nb_ignores} ignorés")
         return None
 
     # On insère les nouveaux téléphones dans Sigale
     nouveaux_phones.to_sql('personne_telephones', con=sigale_engine, schema='personnes', index=False,
-                           if_exists='append')
+                           if_exists='append', method=WriteMethods.insert_method(sigale_engine, config.SIGALE_INSERT_METHOD))
     logger.info(f"{len(nouveaux_phones)} nouveaux téléphones introduits dans Sigale")
 
     # Si no-update, on s'arrête
@@ -427,22 +547,118 @@ def migrate_phones(phones: pd.DataFrame, sigale_engine, logger: Logger, export:b
     phones_existants.rename(columns={'numero_new': 'numero'}, inplace=True)
 
     # On mets à jour les champs des enseignants existants basé sur la config
-    phones_existants.rename(columns={'telephone_id': 'id'}).to_sql('personne_telephones', con=sigale_engine,
-                                                                   schema='personnes', index=False,
-                                                                   if_exists='append',
-                                                                   method=WriteMethods(
-                                                                   index_columns=['id'],
-                                                                   update_columns=config.SIGALE_PHONE_UPDATE_FIELDS).update_on_conflict)
-    logger.info(f"{len(phones_existants)} téléphones mis à jour dans Sigale")
+    write_methods = WriteMethods(index_columns=['id'], update_columns=config.SIGALE_PHONE_UPDATE_FIELDS,
+                                 batch_size=config.SIGALE_UPDATE_BATCH_SIZE,
+                                 adaptive_batch=config.SIGALE_UPDATE_ADAPTIVE_BATCH,
+                                 target_latency=config.SIGALE_UPDATE_TARGET_LATENCY)
+    phones_existants.rename(columns={'telephone_id': 'id'}).to_sql(
+        'personne_telephones', con=sigale_engine, schema='personnes', index=False, if_exists='append',
+        method=write_methods.update_on_conflict)
+    logger.info(f"{len(phones_existants)} téléphones mis à jour dans Sigale, {nb_inchanges} inchangés, {nb_ignores} ignorés (non créés par la migration)")
 
     return None
 
 
 
+def migration_created_by(config = default_config) -> int | None:
+    """
+    Renvoie l'utilisateur created_by des lignes modifiables par la migration,
+    None si UPDATE_ONLY_CREATED_BY_MIGRATION est à False ( toutes les lignes sont modifiables )
+    """
+    if config.UPDATE_ONLY_CREATED_BY_MIGRATION:
+        return config.SIGALE_METADATA_FIELDS.get('created_by', 1)
+    return None
+
+
+def filtrer_inchanges(existants: pd.DataFrame, sigale_engine, table: str, id_column: str, update_fields: list[str],
+                      renames: dict | None = None, config = default_config,
+                      diff_report: DiffReport | None = None) -> tuple[pd.DataFrame, int]:
+    """
+    Écarte les lignes existantes dont les champs à mettre à jour ont déjà les mêmes valeurs dans Sigale,
+    une mise à jour sans changement réécrit quand même updated_on et génère des dead tuples et du WAL
+    :param existants: lignes existantes dans Sigale, à mettre à jour
+    :param table: table dans le schéma personnes
+    :param id_column: colonne de existants contenant l'id Sigale, ex: personne_id
+    :param update_fields: champs mis à jour, les champs de métadonnées ne sont pas comparés
+    :param renames: renommage des colonnes de existants vers celles de la table, ex: {'valeur_new': 'valeur'}
+    :param diff_report: rapport des différences champ par champ, alimenté avec les valeurs comparées
+    :return: les lignes à mettre à jour et le nombre de lignes inchangées
+    """
+    proposed = existants.rename(columns=renames or {})
+    columns = [field for field in update_fields
+               if field not in config.SIGALE_METADATA_FIELDS and field in proposed.columns]
+    if (not config.SKIP_UNCHANGED_UPDATES and diff_report is None) or len(existants) == 0 or not columns:
+        return existants, 0
+
+    current = read_current_values(sigale_engine, 'personnes', table, id_column, columns, proposed[id_column])
+    differences = changed_fields(proposed, current, id_column, columns)
+    if diff_report is not None:
+        diff_report.ajouter(table, proposed, current, differences, id_column)
+    if not config.SKIP_UNCHANGED_UPDATES:
+        return existants, 0
+    changed = differences.any(axis=1)
+    return existants[changed], int((~changed).sum())
+
+
+def merge_via_staging(data: pd.DataFrame, sigale_engine, logger: Logger, table: str, key_columns: list[str],
+                      update_columns: list[str], export: bool = False, dry_run: bool = False, update: bool = True,
+                      created_by: int | None = None, config = default_config, exporter: Exporter | None = None,
+                      metrics: RunMetrics | None = None):
+    """
+    Ajout/mise à jour des lignes via une table de staging et une fusion côté serveur,
+    sans récupérer les lignes existantes de Sigale
+    :param data: lignes transformées, avec les colonnes de la table cible
+    :param table: table cible dans le schéma personnes
+    :param key_columns: colonnes servant à recouper avec les lignes existantes
+    :param update_columns: colonnes mises à jour sur les lignes existantes
+    :param created_by: si renseigné, ne met à jour que les lignes existantes créées par cet utilisateur
+    :param exporter: exporter utilisé si export
+    :param metrics: mesures du run, reçoit les nombres de lignes insérées et mises à jour
+    :return:
+    """
+    # On exporte si option
+    if export:
+        exporter = exporter or Exporter(config.EXPORT_PATH, config.EXPORT_FORMAT, config.EXPORT_ROW_GROUP_SIZE)
+        exporter.write(data, f'{table}_staging')
+
+    staging = StagingMerge(table, 'personnes', key_columns, update_columns, created_by=created_by)
+    with sigale_engine.connect() as conn:
+        with conn.begin() as transaction:
+            inserted, updated = staging.merge(data, conn, update=update, insert_method=config.SIGALE_INSERT_METHOD)
+            if metrics is not None:
+                metrics.compter(lignes_sortie=len(data), inseres=inserted, mis_a_jour=updated)
+            # Si dry_run, on annule la fusion, les compteurs restent exacts
+            if dry_run:
+                transaction.rollback()
+                logger.info(
+                    f"Dry run, pas de modification en DB, {table} : {inserted} lignes à insérer, {updated} lignes à mettre à jour")
+                return None
+
+    logger.info(f"{table} : {inserted} lignes introduites et {updated} lignes mises à jour dans Sigale via table de staging")
+    return None
+
+
 def split_column_name(col_name:str):
     return col_name.replace('domi', '_domi').replace('resi', '_resi')
 
-def migrate_adresses(adresses: pd.DataFrame, sigale_engine, logger: Logger, export:bool = False, dry_run:bool = False, update:bool = True, config = default_config):
+def migrate_adresses(adresses: pd.DataFrame, sigale_engine, logger: Logger, export:bool = False, dry_run:bool = False, update:bool = True, config = default_config,
+                     staging_merge: bool = False, references: ReferenceCache | None = None,
+                     exporter: Exporter | None = None, sigale_session: SigaleSession | None = None,
+                     metrics: RunMetrics | None = None, diff_report: DiffReport | None = None):
+
+    # Rien à migrer, ex: aucun enseignant modifié en synchro delta
+    if len(adresses) == 0:
+        logger.info("Aucune adresse à migrer")
+        return None
+
+    # Données de référence de Sigale, chargées ici si elles ne sont pas fournies par run_migrations
+    if references is None:
+        references = ReferenceCache.from_config(sigale_engine, config, logger, dry_run=dry_run)
+    if exporter is None:
+        exporter = Exporter(config.EXPORT_PATH, config.EXPORT_FORMAT, config.EXPORT_ROW_GROUP_SIZE)
+    # Mesures de l'étape, fournies par run_migrations
+    if metrics is None:
+        metrics = RunMetrics()
 
     adresses.columns = [split_column_name(col) for col in adresses.columns]
     # On sépare les champs proeco _resi et _domi en lignes différentes
@@ -456,33 +672,29 @@ def migrate_adresses(adresses: pd.DataFrame, sigale_engine, logger: Logger, expo
     ).reset_index()
 
     # Si resi ou domi n'est pas dans les champs à importer en config, on supprime
-    adresses.drop(adresses[adresses['type'].apply(lambda x: False if config.ADRESSES_FIELDS.get(x) else True)].index, inplace=True)
+    champs_adresses = champs_config(config.ADRESSES_FIELDS, ['code_type', 'est_principale'])
+    adresses.drop(adresses[~adresses['type'].isin(champs_adresses.index)].index, inplace=True)
 
     # On supprime également les adresses vides
     adresses.replace(r'^\s*$', np.nan,  regex=True, inplace=True)
     adresses.dropna(subset=['rue', 'comm', 'cpost'], inplace=True, how='all')
 
-    # On remplace les types resi ou domi par les types Sigale définis dans la config
-    adresses['code_type'] = adresses.apply(
-        lambda row: config.ADRESSES_FIELDS.get(row['type']).get('code_type'), axis=1)
-    # On ajoute la valeur est_principale tel que défini dans la config
-    adresses['est_principale'] = adresses.apply(
-        lambda row: config.ADRESSES_FIELDS.get(row['type']).get('est_principale'), axis=1)
+    # On remplace les types resi ou domi par les types Sigale définis dans la config,
+    # et on ajoute la valeur est_principale tel que défini dans la config
+    adresses = adresses.merge(champs_adresses, left_on='type', right_index=True, how='left')
 
     ## AJOUT DES ID TYPES
     # On récupère les types d'adresses de Sigale
-    adresses_types = pd.read_sql_query(SQL_PARAMETER_SIGALE, sigale_engine,
-                                     params={'type_parameter': 'adresse_types'})
+    adresses_types = references.parameter('adresse_types')
     adresses_types.rename(columns={'code': 'code_type', 'id': 'adresse_type_id'}, inplace=True)
     # On merge avec les adresses
     adresses = adresses.merge(adresses_types, on='code_type', how='inner', validate='m:1')
 
     ## AJOUT DES COUNTRY ID
     # On reformate les codes pays dans notre liste d'adresses, majuscules, suppression d'accents
-    adresses['pays'] = adresses['pays'].apply(str.upper).apply(unidecode).apply(str.strip)
+    adresses['pays'] = normaliser_texte(adresses['pays'])
     # On récupère les nationalités de Sigale dans une table ['pays_id_nationalite', 'code']
-    pays_sigale = pd.read_sql_query("select id as country_id, code as code_pays from core.countries",
-                                    sigale_engine)
+    pays_sigale = references.countries().rename(columns={'id': 'country_id', 'code': 'code_pays'})
     # Pour les adresses n'ayant pas de pays, on met BE par défaut
     adresses.fillna({'pays':'BE'},  inplace=True)
 
@@ -491,45 +703,52 @@ def migrate_adresses(adresses: pd.DataFrame, sigale_engine, logger: Logger, expo
                                                   validate='m:1').drop(columns='code_pays')
 
     ### AJOUT DES CITY_ID
-    # On récupère les villes de Sigale en ajoutant le code pays BE
-    villes_sigale = pd.read_sql_query(
-        "select id as city_id, name as city_name from core.cities order by postal_code asc", sigale_engine)
-    villes_sigale['code_pays'] = 'BE'
-    # On reformate les noms de villes pour s'assurer du match
-    villes_sigale['city_name'] = villes_sigale['city_name'].apply(str.upper).apply(unidecode).apply(str.strip)
-    adresses['comm'] = adresses['comm'].apply(str.upper).apply(unidecode).apply(str.strip)
-
-    # On supprime les doublons, (plusieurs fois la même ville avec codes postaux différents)
-    # keep first, pour garder le code postal le plus petit (on conserve 4000 au lieu de 4020)
-    villes_sigale.drop_duplicates(subset=['city_name', 'code_pays'], inplace=True, keep='first')
-    adresses = (
-        adresses.merge(villes_sigale, left_on=['comm', 'pays'], right_on=['city_name', 'code_pays'],
-                                 how='left', validate='m:1')
-        .drop(columns=['city_name', 'code_pays']))
+    # On recherche les villes belges dans l'index des villes de Sigale, sur le code postal et le nom normalisé,
+    # à défaut sur le nom seul
+    adresses['comm'] = normaliser_texte(adresses['comm'])
+    villes = references.city_index().match_detail(adresses['comm'], adresses['cpost'],
+                                                  approchant=config.CITY_INDEX_TRIGRAMMES,
+                                                  seuil=config.CITY_INDEX_SEUIL_TRIGRAMMES)
+    villes = villes[adresses['pays'] == 'BE']
+    adresses['city_id'] = villes['city_id']
+    logger.debug("Villes des adresses trouvées : "
+                 + ', '.join(f"{nombre} par {methode}" for methode, nombre in villes['methode'].value_counts().items())
+                 + f", {villes['city_id'].isna().sum()} non trouvées")
 
     ### NETTOYAGE ET RENOMMAGE DES COLONNES POUR CORRESPONDANCE SIGALE
     # On supprime les colonnes inutiles
     adresses.drop(columns=['index', 'type', 'code_type', 'loca', 'zone', 'pays'], inplace=True)
     # On renomme pour correspondre aux champs Sigale
     adresses.rename(columns={'rue': 'street', 'cpost': 'postal_code', 'comm': 'city_name'}, inplace=True)
-    adresses['city_name'] = adresses['city_name'].apply(str.title)
+    adresses['city_name'] = adresses['city_name'].str.title()
+
+    # Si fusion via table de staging, la séparation ajout/mise à jour est faite côté serveur
+    if staging_merge:
+        for key, value in config.SIGALE_METADATA_FIELDS.items():
+            adresses[key] = value
+        merge_via_staging(adresses, sigale_engine, logger, 'personne_adresses', ['personne_id', 'adresse_type_id'],
+                          config.SIGALE_ADRESSES_UPDATE_FIELDS, export, dry_run, update,
+                          created_by=migration_created_by(config), config=config, exporter=exporter,
+                          metrics=metrics)
+        return None
 
     ### RECOUPEMENT AVEC DONNEES SIGALE
-    adresses_sigale = pd.read_sql_query(SQL_ADRESSES_SIGALE, sigale_engine)
+    adresses_sigale = read_sql_by_ids(SQL_ADRESSES_SIGALE, sigale_session or sigale_engine, adresses['personne_id'])
 
     # On merge pour voir quels adresses sont déjà dans Sigale
     adresses = adresses.merge(adresses_sigale, on=['personne_id', 'adresse_type_id'], how='left',
                           indicator=True, validate='1:m', suffixes=['_new', '_old'])
 
     # Si config pour ne remplacer que les created_by migration
+    nb_ignores = 0
     if config.UPDATE_ONLY_CREATED_BY_MIGRATION:
         # On écarte les lignes non créées par la migration
-        adresses.drop(
-            adresses[
-                (adresses['created_by'] != config.SIGALE_METADATA_FIELDS.get('created_by', 1))
-                & (adresses['_merge'] == 'both')
-            ].index,
-            inplace=True)
+        non_modifiables = adresses[
+            (adresses['created_by'] != config.SIGALE_METADATA_FIELDS.get('created_by', 1))
+            & (adresses['_merge'] == 'both')
+        ].index
+        nb_ignores = len(non_modifiables)
+        adresses.drop(non_modifiables, inplace=True)
 
     # Suppression de la colonne created by, utilisée uniquement pour filtrer
     adresses.drop(columns=['created_by'], inplace=True)
@@ -538,26 +757,37 @@ def migrate_adresses(adresses: pd.DataFrame, sigale_engine, logger: Logger, expo
     nouvelles_adresses = adresses[adresses['_merge'] == 'left_only'].drop(columns=['_merge', 'adresse_id'])
     # Les emails à mettre à jour sont ceux existant déjà dans Sigale
     adresses_existantes = adresses[adresses['_merge'] == 'both'].drop(columns=['_merge'])
+    # On écarte les adresses déjà à jour dans Sigale
+    nb_inchanges = 0
+    if update:
+        adresses_existantes, nb_inchanges = filtrer_inchanges(adresses_existantes, sigale_session or sigale_engine,
+                                                              'personne_adresses', 'adresse_id', config.SIGALE_ADRESSES_UPDATE_FIELDS,
+                                                              config=config, diff_report=diff_report)
 
     # On exporte si option
     if export:
-        nouvelles_adresses.to_csv(os.path.join(config.EXPORT_PATH, 'adresses_nouvelles.csv'), index=False)
-        adresses_existantes.to_csv(os.path.join(config.EXPORT_PATH, 'adresses_existantes.csv'), index=False)
+        exporter.write(nouvelles_adresses, 'adresses_nouvelles')
+        exporter.write(adresses_existantes, 'adresses_existantes')
 
     # On ajoute les métadonnées
     for key, value in config.SIGALE_METADATA_FIELDS.items():
         nouvelles_adresses[key] = value
         adresses_existantes[key] = value
 
+    # Compteurs du rapport du run, en dry run les lignes qui seraient insérées ou mises à jour
+    metrics.compter(lignes_sortie=len(nouvelles_adresses) + len(adresses_existantes) + nb_inchanges + nb_ignores,
+                    inseres=len(nouvelles_adresses), mis_a_jour=len(adresses_existantes) if update else 0,
+                    inchanges=nb_inchanges, ignores=nb_ignores)
+
     # Si dry_run, on s'arrête avant les modifications en DB
     if dry_run:
         logger.info(
-            f"Dry run, pas de modification en DB, {len(nouvelles_adresses)} adresses à insérer, {len(adresses_existantes)} adresses à mettre à jour")
+            f"Dry run, pas de modification en DB, {len(nouvelles_adresses)} adresses à insérer, {len(adresses_existantes)} adresses à mettre à jour, {nb_inchanges} inchangées, {nb_ignores} ignorées")
         return None
 
     # On insère les nouvelles adresses dans Sigale
     nouvelles_adresses.to_sql('personne_adresses', con=sigale_engine, schema='personnes', index=False,
-                           if_exists='append')
+                           if_exists='append', method=WriteMethods.insert_method(sigale_engine, config.SIGALE_INSERT_METHOD))
     logger.info(f"{len(nouvelles_adresses)} nouvelles adresses introduites dans Sigale")
 
     # Si no-update, on s'arrête
@@ -565,12 +795,13 @@ def migrate_adresses(adresses: pd.DataFrame, sigale_engine, logger: Logger, expo
         return None
 
     # On mets à jour les champs des enseignants existants basé sur la config
-    adresses_existantes.rename(columns={'adresse_id': 'id'}).to_sql('personne_adresses', con=sigale_engine,
-                                                                    schema='personnes', index=False,
-                                                                    if_exists='append',
-                                                                    method=WriteMethods(
-                                                                       index_columns=['id'],
-                                                                       update_columns=config.SIGALE_ADRESSES_UPDATE_FIELDS).update_on_conflict)
-    logger.info(f"{len(adresses_existantes)} adresses mises à jour dans Sigale")
+    write_methods = WriteMethods(index_columns=['id'], update_columns=config.SIGALE_ADRESSES_UPDATE_FIELDS,
+                                 batch_size=config.SIGALE_UPDATE_BATCH_SIZE,
+                                 adaptive_batch=config.SIGALE_UPDATE_ADAPTIVE_BATCH,
+                                 target_latency=config.SIGALE_UPDATE_TARGET_LATENCY)
+    adresses_existantes.rename(columns={'adresse_id': 'id'}).to_sql(
+        'personne_adresses', con=sigale_engine, schema='personnes', index=False, if_exists='append',
+        method=write_methods.update_on_conflict)
+    logger.info(f"{len(adresses_existantes)} adresses mises à jour dans Sigale, {nb_inchanges} inchangées, {nb_ignores} ignorées (non créées par la migration)")
 
     return None
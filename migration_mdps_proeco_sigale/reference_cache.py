@@ -0,0 +1,136 @@
+import os
+import time
+from logging import Logger
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import Engine
+
+from migration_mdps_proeco_sigale.city_index import CityIndex
+from migration_mdps_proeco_sigale.db.sql_read_methods import read_sql
+from migration_mdps_proeco_sigale.db.requetes_sql import SQL_PARAMETERS_SIGALE, SQL_COUNTRIES_SIGALE, \
+    SQL_CITIES_SIGALE
+from migration_mdps_proeco_sigale.tools import normaliser_texte
+
+
+class ReferenceCache:
+    """
+    Cache des données de référence de Sigale (parameter_values, pays, villes) pour la durée d'un run,
+    chargées une seule fois puis partagées entre les étapes de migration
+    Optionnellement sauvegardé sur disque, pour démarrer instantanément les dry runs suivants tant que le snapshot
+    est valide. Le snapshot n'est relu que pour la même base Sigale (url de connexion, sans le mot de passe)
+    :param: sigale_engine : connexion à Sigale, engine ou SigaleSession
+    :param: snapshot_path : chemin du snapshot sur disque, None pour ne pas utiliser de snapshot
+    :param: snapshot_ttl : durée de validité du snapshot en secondes
+    :param: logger : logger utilisé pour les logs
+    """
+
+    #: Types de paramètres utilisés par les migrations
+    PARAMETER_TYPES: list[str] = [
+        'sexes_sigale',
+        'etats_civils',
+        'email_domaines',
+        'telephone_domaines',
+        'telephone_types',
+        'adresse_types',
+    ]
+
+    def __init__(self, sigale_engine, snapshot_path: str | None = None, snapshot_ttl: int = 3600,
+                 logger: Logger | None = None):
+        self.sigale_engine = sigale_engine
+        self.snapshot_path = snapshot_path
+        self.snapshot_ttl = snapshot_ttl
+        self.logger = logger
+        self._tables: dict[str, pd.DataFrame] | None = None
+        self._city_index: CityIndex | None = None
+
+    @classmethod
+    def from_config(cls, sigale_engine, config, logger: Logger | None = None,
+                    dry_run: bool = False) -> 'ReferenceCache':
+        """
+        :param dry_run: le snapshot REFERENCE_CACHE_SNAPSHOT n'est utilisé qu'en dry run, un run réel relit toujours
+                        les ids de référence qu'il écrit dans Sigale
+        """
+        return cls(sigale_engine, snapshot_path=config.REFERENCE_CACHE_SNAPSHOT if dry_run else None,
+                   snapshot_ttl=config.REFERENCE_CACHE_TTL, logger=logger)
+
+    def load(self) -> 'ReferenceCache':
+        """
+        Charge les tables de référence, depuis le snapshot s'il est valide, sinon depuis Sigale
+        """
+        if self._tables is not None:
+            return self
+
+        self._tables = self._read_snapshot()
+        if self._tables is None:
+            self._tables = self._read_sigale()
+            self._write_snapshot()
+        return self
+
+    def parameter(self, type_parameter: str) -> pd.DataFrame:
+        """
+        Renvoie les valeurs d'un type de paramètre, colonnes ['id', 'code']
+        """
+        parameters = self.load()._tables['parameters']
+        return parameters.loc[parameters['type_parameter'] == type_parameter, ['id', 'code']].reset_index(drop=True)
+
+    def countries(self) -> pd.DataFrame:
+        """
+        Renvoie les pays de Sigale, colonnes ['id', 'code']
+        """
+        return self.load()._tables['countries'].copy()
+
+    def cities(self) -> pd.DataFrame:
+        """
+        Renvoie les villes de Sigale triées par code postal, colonnes ['id', 'name', 'postal_code', 'city_name'],
+        city_name étant le nom normalisé (majuscules, sans accents) utilisé pour les recoupements
+        """
+        return self.load()._tables['cities'].copy()
+
+    def city_index(self) -> CityIndex:
+        """
+        Renvoie l'index des villes de Sigale, construit une seule fois et partagé entre les étapes
+        """
+        if self._city_index is None:
+            self._city_index = CityIndex(self.load()._tables['cities'])
+        return self._city_index
+
+    def _read_sigale(self) -> dict[str, pd.DataFrame]:
+        parameters = read_sql(SQL_PARAMETERS_SIGALE, self.sigale_engine,
+                              params={'types_parameter': self.PARAMETER_TYPES})
+        countries = read_sql(SQL_COUNTRIES_SIGALE, self.sigale_engine)
+        cities = read_sql(SQL_CITIES_SIGALE, self.sigale_engine)
+        # On normalise les noms de villes une seule fois pour s'assurer du match
+        cities['city_name'] = normaliser_texte(cities['name'])
+        return {'parameters': parameters, 'countries': countries, 'cities': cities}
+
+    def _url(self) -> str | None:
+        """
+        Url de la base Sigale, sans le mot de passe, None si la connexion n'est pas une base (ex: snapshot local)
+        """
+        engine = getattr(self.sigale_engine, 'sigale_engine', self.sigale_engine)
+        if not isinstance(engine, Engine):
+            return None
+        return engine.url.render_as_string(hide_password=True)
+
+    def _read_snapshot(self) -> dict[str, pd.DataFrame] | None:
+        url = self._url()
+        if not self.snapshot_path or url is None or not os.path.exists(self.snapshot_path):
+            return None
+        age = time.time() - os.path.getmtime(self.snapshot_path)
+        if age > self.snapshot_ttl:
+            return None
+        snapshot = pd.read_pickle(self.snapshot_path)
+        # Snapshot d'une autre base Sigale (ex: base de test) : ses ids ne sont pas valables pour celle-ci
+        if snapshot.get('url') != url:
+            return None
+        if self.logger:
+            self.logger.debug(f"Données de référence chargées depuis le snapshot {self.snapshot_path}")
+        return snapshot['tables']
+
+    def _write_snapshot(self):
+        url = self._url()
+        if not self.snapshot_path or url is None:
+            return
+        Path(self.snapshot_path).parent.mkdir(parents=True, exist_ok=True)
+        pd.to_pickle({'url': url, 'tables': self._tables}, self.snapshot_path)
@@ -1,66 +1,325 @@
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
 from datetime import date
-from typing import Literal
+from functools import partial
+from typing import Literal, Callable
 
 import pandas as pd
 from sqlalchemy import Engine
 from migration_mdps_proeco_sigale import config as default_config
+from migration_mdps_proeco_sigale.checkpoint import RunCheckpoint
 from migration_mdps_proeco_sigale.date_utils import DateUtils
-from migration_mdps_proeco_sigale.db.requetes_sql import SQL_MDPS_PROECO, SQL_CONTRATS_EN_COURS_PROECO, SQL_MDPS_SIGALE
+from migration_mdps_proeco_sigale.db.connection_manager import SigaleSession
+from migration_mdps_proeco_sigale.db.sql_read_methods import read_sql_by_ids, read_sql_stream, iter_sql_stream
+from migration_mdps_proeco_sigale.delta_sync import DeltaState, CLES
+from migration_mdps_proeco_sigale.dtypes import appliquer_dtypes, lire_sql_compact, concat_lots
+from migration_mdps_proeco_sigale.export import Exporter
+from migration_mdps_proeco_sigale.metrics import RunMetrics
+from migration_mdps_proeco_sigale.db.requetes_sql import SQL_MDPS_SIGALE, COLONNES_MDPS_PROECO, \
+    COLONNES_CLES_PROECO, requete_personnes_proeco
 from migration_mdps_proeco_sigale.migrations import migrate_personnes, migrate_emails, migrate_phones, migrate_adresses, \
     migrate_users
-from migration_mdps_proeco_sigale.tools import clean_numero_registre_national
+from migration_mdps_proeco_sigale.reference_cache import ReferenceCache
+from migration_mdps_proeco_sigale.sigale_diff import DiffReport
+from migration_mdps_proeco_sigale.snapshot import SnapshotLocal
+from migration_mdps_proeco_sigale.tools import clean_numeros_registre_national, registre_national_valide
+
+# Colonnes Proeco utilisées par chaque étape de migration
+ATTRIBUTS_PERSONNES = ['matric', 'nom', 'prenom', 'sexe', 'nation', 'paynaiss', 'lieunaiss', 'etatcivil',
+                       'registre_national_numero', 'date_naissance', 'matriche', 'reserved']
+ATTRIBUTS_EMAILS = ['email', 'email2']
+ATTRIBUTS_PHONES = ['teldomi', 'telresi', 'gsm', 'telbureau']
+ATTRIBUTS_ADRESSES = ['ruedomi', 'paysdomi', 'cpostdomi', 'commdomi', 'locadomi', 'zonedomi',
+                      'rueresi', 'paysresi', 'cpostresi', 'commresi', 'locaresi', 'zoneresi']
 
 
 def run_migrations(
-        proeco_engine: Engine,
+        proeco_engine: Engine | dict[str, Engine] | None,
         sigale_engine: Engine,
         logger: logging.Logger,
         action_when_duplicates: Literal['drop', 'stop'] = 'stop',
         export: bool = False,
+        export_format: str | None = None,
         contrat_en_cours_uniquement:bool = True,
         create_users: bool = False,
         update: bool = False,
         dry_run: bool = False,
-        config = default_config
+        staging_merge: bool = False,
+        delta_sync: bool = False,
+        full_sync: bool = False,
+        chunk_size: int | None = None,
+        parallel_stages: int | None = None,
+        config = default_config,
+        metrics: RunMetrics | None = None,
+        resume: str | None = None,
+        from_snapshot: str | None = None,
+        diff_report: bool = False
 ):
     """
 
-    :param proeco_engine: connexion à Proeco
+    :param proeco_engine: connexion à Proeco, ou connexions à plusieurs bases Proeco par nom de base,
+                          ignoré si from_snapshot
     :param sigale_engine: connexion à Sigale
     :param logger: logger utilisé pour les logs
     :param action_when_duplicates: action en cas de doublons, par défaut arrête la migration, 'drop' permet de les supprimer
     :param export: permet d'exporter les données en csv
+    :param export_format: format des exports, csv, csv.gz ou parquet, EXPORT_FORMAT de la config par défaut
     :param contrat_en_cours_uniquement: Si on traite uniquement les contrats en cours
     :param create_users: Créé les utilisateurs manquants après création des personnes
     :param update: si on update les mdps existants
     :param dry_run: Permet de tester, on insère pas les données en DB
+    :param staging_merge: fusion côté serveur via des tables de staging, sans récupérer les données existantes de Sigale
+    :param delta_sync: ne migre que les enseignants nouveaux ou modifiés dans Proeco depuis la dernière synchro delta
+    :param full_sync: avec delta_sync, force une synchro complète et réinitialise l'état de la synchro delta
+    :param chunk_size: si défini, lit Proeco par lots de chunk_size enseignants, chaque lot passant par toutes les étapes
+    :param parallel_stages: si supérieur à 1, exécute les étapes emails, téléphones et adresses en parallèle
     :param config: permet d'importer un autre fichier de configuration
+    :param metrics: mesures du run (durée, lignes, mémoire par étape), un nouveau RunMetrics par défaut
+    :param resume: identifiant d'un run interrompu à reprendre, à partir de ses points de reprise
+    :param from_snapshot: dossier d'un snapshot local (python main.py snapshot), Proeco est lu depuis le snapshot,
+                          et Sigale aussi en dry run si le snapshot contient Sigale
+    :param diff_report: écrit le rapport des différences champ par champ entre les valeurs proposées et celles de Sigale
+                        pour les lignes existantes (exports diff_champs et diff_<table>)
     :return:
     """
+    if resume and dry_run:
+        raise ValueError("Un run interrompu ne peut pas être repris en dry run")
+    metrics = metrics or RunMetrics()
+
+    # Snapshot local : Proeco n'est pas interrogé, les requêtes sont servies par les fichiers du snapshot
+    snapshot = SnapshotLocal(from_snapshot) if from_snapshot else None
+    lectures_sigale = None
+    if snapshot is not None:
+        logger.info(f"Lecture de Proeco depuis le snapshot {from_snapshot} du {snapshot.infos['date']}")
+        proeco_engine = snapshot.proeco()
+        # Sigale n'est lu depuis le snapshot qu'en dry run, un run réel doit voir les personnes qu'il ajoute
+        if snapshot.sigale and dry_run:
+            logger.info("Lecture de Sigale depuis le snapshot")
+            lectures_sigale = snapshot.lectures_sigale()
+        elif snapshot.sigale:
+            logger.info("Tables de Sigale du snapshot ignorées hors dry run, Sigale est lu directement")
+
+    # Les mesures de chaque étape sont écrites dans le rapport du run à la fin, même en cas d'erreur
+    # Toutes les lectures de Sigale du run passent par une même connexion, dans un snapshot cohérent
+    with (metrics.run(config, logger, dry_run=dry_run, update=update, staging_merge=staging_merge,
+                      delta_sync=delta_sync, chunk_size=chunk_size, parallel_stages=parallel_stages,
+                      from_snapshot=from_snapshot),
+          lectures_sigale or SigaleSession(sigale_engine, config.SIGALE_READ_ISOLATION_LEVEL,
+                                           config.SIGALE_ITERSIZE) as sigale_session):
+        # On charge une seule fois les données de référence de Sigale (parameter_values, pays, villes) pour toutes les étapes
+        with metrics.span('references_sigale'):
+            references = ReferenceCache.from_config(sigale_session, config, logger, dry_run=dry_run).load()
+        # Un seul exporter pour le run, les exports de chaque lot sont ajoutés aux mêmes fichiers
+        exporter = Exporter(config.EXPORT_PATH, export_format or config.EXPORT_FORMAT, config.EXPORT_ROW_GROUP_SIZE)
+        rapport_differences = None
+        if diff_report:
+            rapport_differences = DiffReport(exporter)
+            if staging_merge or not update:
+                logger.warning("Rapport des différences vide avec --staging-merge ou --no-update, "
+                               "les lignes existantes ne sont pas comparées à Sigale")
+
+        delta_state = None
+        if delta_sync:
+            delta_state = DeltaState(config.DELTA_STATE_FILE, {
+                'personnes': ATTRIBUTS_PERSONNES,
+                # le registre national est inclus, pour renvoyer les contacts si la personne change dans Sigale
+                'emails': ['registre_national_numero', *ATTRIBUTS_EMAILS],
+                'phones': ['registre_national_numero', *ATTRIBUTS_PHONES],
+                'adresses': ['registre_national_numero', *ATTRIBUTS_ADRESSES],
+            })
+
+        # Une ou plusieurs bases Proeco (une par établissement), lues en parallèle avec une connexion par base
+        proeco_engines = proeco_engine if isinstance(proeco_engine, dict) else {nom_base(proeco_engine): proeco_engine}
+
+        # Points de reprise : enseignants extraits et étapes terminées, pour reprendre le run s'il est interrompu
+        checkpoint = None
+        options_reprise = dict(contrat_en_cours_uniquement=contrat_en_cours_uniquement,
+                               action_when_duplicates=action_when_duplicates, update=update, create_users=create_users,
+                               staging_merge=staging_merge, delta_sync=delta_sync, full_sync=full_sync,
+                               chunk_size=chunk_size, sources_proeco=list(proeco_engines), snapshot=from_snapshot)
+        if resume:
+            checkpoint = RunCheckpoint.reprendre(config.CHECKPOINT_PATH, resume, options_reprise)
+            logger.info(f"Reprise du run {resume}, étapes déjà terminées : "
+                        f"{', '.join(checkpoint.etapes_terminees) or 'aucune'}")
+        elif config.CHECKPOINTS and not dry_run:
+            checkpoint = RunCheckpoint(config.CHECKPOINT_PATH, metrics.run_id, options_reprise)
+            logger.info(f"Points de reprise dans {checkpoint.dossier}, en cas d'interruption reprendre avec "
+                        f"--resume {metrics.run_id}")
+
+        options = dict(export=export, dry_run=dry_run, update=update, create_users=create_users,
+                       staging_merge=staging_merge, references=references, exporter=exporter,
+                       parallel_stages=parallel_stages, sigale_session=sigale_session, metrics=metrics,
+                       checkpoint=checkpoint, diff_report=rapport_differences, config=config)
+        hashes = []
+
+        # Les filtres sur le numéro de registre national (11 chiffres) et le contrat en cours sont évalués par Proeco
+        params = {'date_proeco': DateUtils.convert_date_to_dateproeco(date.today())} if contrat_en_cours_uniquement else {}
+        sql_enseignants = requete_personnes_proeco(COLONNES_MDPS_PROECO, contrat_en_cours_uniquement)
+        sql_cles = requete_personnes_proeco(COLONNES_CLES_PROECO, contrat_en_cours_uniquement)
+        # Lectures Proeco via un curseur côté serveur, par fetch de PROECO_FETCH_SIZE lignes
+        lire_cles = partial(read_sql_stream, itersize=config.PROECO_FETCH_SIZE, params=params,
+                            dtype={'registre_national_numero': str})
+        # En reprise, les enseignants (les clés en traitement par lots) déjà extraits et contrôlés sont relus
+        extraits = checkpoint.load_frame('cles' if chunk_size else 'enseignants_proeco') if checkpoint else None
+        if extraits is None:
+            # Les enseignants écartés par Proeco sont uniquement lus pour le rapport des rejets
+            with metrics.span('extraction_proeco_rejets') as span:
+                exclus_proeco = lire_proeco(
+                    proeco_engines,
+                    partial(lire_cles, requete_personnes_proeco(COLONNES_CLES_PROECO, contrat_en_cours_uniquement,
+                                                                registre_national_valide=False)))
+                span.compter(lignes_sortie=len(exclus_proeco))
+
+        if chunk_size:
+            # Les doublons doivent être détectés sur toutes les bases, on détermine d'abord les matricules à migrer
+            # à partir des seules clés, puis on lit les enseignants complets par lots, base par base
+            cles = extraits
+            if cles is None:
+                with metrics.span('extraction_proeco') as span:
+                    cles = lire_proeco(proeco_engines, partial(lire_cles, sql_cles))
+                    span.compter(lignes_sortie=len(cles))
+                with metrics.span('registres_nationaux', lignes_entree=len(cles)) as span:
+                    cles = nettoyer_registres_nationaux(cles, logger, exporter, exclus_proeco, config=config)
+                    cles = traiter_doublons(cles, action_when_duplicates, logger)
+                    span.compter(lignes_sortie=len(cles) if cles is not None else 0)
+                if cles is None:
+                    return None
+                if checkpoint is not None:
+                    checkpoint.save_frame('cles', cles)
+
+            numero_lot = 0
+            for source, engine in proeco_engines.items():
+                matrics_retenus = cles.loc[cles['source_proeco'] == source, 'matric']
+                # Un fetch par lot, la connexion Proeco reste ouverte jusqu'au dernier lot
+                lots = iter_sql_stream(sql_enseignants, engine, chunk_size, params=params,
+                                       dtype={'registre_national_numero': str})
+                for lot in lots:
+                    numero_lot += 1
+                    # Les lots sont relus dans Proeco en reprise et leurs limites peuvent changer : les points de reprise
+                    # d'un lot sont identifiés par sa base et sa plage de matricules, et non par son numéro
+                    identifiant = f"{source}_{lot['matric'].min()}_{lot['matric'].max()}" if len(lot) \
+                        else f"{source}_vide"
+                    with metrics.span('lot_proeco', lignes_entree=len(lot)) as span:
+                        if config.COMPACT_DTYPES:
+                            lot = appliquer_dtypes(lot)
+                        lot = nettoyer_registres_nationaux(lot.assign(source_proeco=source), config=config)
+                        lot = lot[lot['matric'].isin(matrics_retenus)]
+                        span.compter(lignes_sortie=len(lot))
+                    logger.info(f"Lot {numero_lot} ({identifiant}) : {len(lot)} enseignants à migrer")
+                    # En reprise, les étapes terminées du lot sont ignorées s'il contient toujours les mêmes enseignants
+                    if checkpoint is not None and not checkpoint.verifier_lot(prefixe_lot(identifiant), lot[CLES]):
+                        logger.warning(f"Lot {numero_lot} ({identifiant}) modifié dans Proeco depuis l'interruption, "
+                                       f"il est entièrement migré à nouveau")
+                    hashes_lot, changes = calculer_delta(lot, delta_state, full_sync, logger, metrics)
+                    hashes.append(hashes_lot)
+                    migrer_enseignants(lot, sigale_engine, logger, changes=changes, lot=identifiant, **options)
+        else:
+            # On récupère le résulat de la SQL dans un dataframe
+            # Types compacts (category, entiers nullables, chaînes pyarrow) appliqués pendant la lecture, pour limiter la mémoire
+            if config.COMPACT_DTYPES:
+                lire_enseignants = partial(lire_sql_compact, sql_enseignants, chunksize=config.PROECO_FETCH_SIZE,
+                                           params=params, dtype={'registre_national_numero': str})
+            else:
+                lire_enseignants = partial(lire_cles, sql_enseignants)
+            enseignants_proeco = extraits
+            if enseignants_proeco is None:
+                with metrics.span('extraction_proeco') as span:
+                    enseignants_proeco = lire_proeco(proeco_engines, lire_enseignants)
+                    span.compter(lignes_sortie=len(enseignants_proeco))
+                with metrics.span('registres_nationaux', lignes_entree=len(enseignants_proeco)) as span:
+                    enseignants_proeco = nettoyer_registres_nationaux(enseignants_proeco, logger, exporter,
+                                                                      exclus_proeco, config=config)
+                    # Les doublons entre bases passent par la même règle que les doublons d'une base
+                    enseignants_proeco = traiter_doublons(enseignants_proeco, action_when_duplicates, logger)
+                    span.compter(lignes_sortie=len(enseignants_proeco) if enseignants_proeco is not None else 0)
+                if enseignants_proeco is None:
+                    return None
+                if checkpoint is not None:
+                    checkpoint.save_frame('enseignants_proeco', enseignants_proeco)
+            hashes_run, changes = calculer_delta(enseignants_proeco, delta_state, full_sync, logger, metrics)
+            hashes.append(hashes_run)
+            migrer_enseignants(enseignants_proeco, sigale_engine, logger, changes=changes, **options)
+
+        if rapport_differences is not None:
+            rapport_differences.ecrire(logger)
+        # On sauvegarde l'état de la synchro delta une fois toutes les étapes terminées
+        # Sans aucun lot lu (sélection Proeco vide), il n'y a pas de hash et l'état précédent est conservé
+        if delta_state is not None and not dry_run and hashes:
+            delta_state.save(pd.concat(hashes))
+        # Run terminé, plus rien à reprendre
+        if checkpoint is not None:
+            checkpoint.terminer(config.CHECKPOINT_KEEP)
+        return None
+
+
+def nom_base(proeco_engine: Engine) -> str:
+    """
+    Nom de la base d'une connexion Proeco, ex: PROF.FDB
+    """
+    return os.path.basename(proeco_engine.url.database or '') or str(proeco_engine.url)
 
 
-    # On récupère le résulat de la SQL dans un dataframe
-    enseignants_proeco = pd.read_sql_query(SQL_MDPS_PROECO, proeco_engine, dtype={'registre_national_numero': str})
+def lire_proeco(proeco_engines: dict[str, Engine], lecture: Callable[[Engine], pd.DataFrame]) -> pd.DataFrame:
+    """
+    Exécute une lecture sur chaque base Proeco, en parallèle avec une connexion par base, puis concatène les résultats
+    La base d'origine est ajoutée dans la colonne source_proeco, les enseignants sont triés par matricule
+    comme dans la requête, à matricule égal dans l'ordre des bases
+    :param proeco_engines: connexions Proeco par nom de base
+    :param lecture: fonction lisant une base, ex: partial(read_sql_stream, sql, params=params)
+    """
+    if len(proeco_engines) == 1:
+        source, engine = next(iter(proeco_engines.items()))
+        return lecture(engine).assign(source_proeco=source)
 
-    # On nettoie le numéro de registre national des éventuels espaces inutiles
-    enseignants_proeco['registre_national_numero'] = enseignants_proeco['registre_national_numero'].apply(clean_numero_registre_national)
+    with ThreadPoolExecutor(max_workers=len(proeco_engines), thread_name_prefix='proeco') as executor:
+        futures = {source: executor.submit(lecture, engine) for source, engine in proeco_engines.items()}
+        resultats = [future.result().assign(source_proeco=source) for source, future in futures.items()]
+    return concat_lots(resultats).sort_values('matric', kind='stable', ignore_index=True)
 
-    # On ne garde que les lignes où le numéro de registre national est 11
-    enseignants_proeco = enseignants_proeco[enseignants_proeco['registre_national_numero'].str.len() == 11]
 
-    # Si option pour ne prendre que les contrats en cours
-    if contrat_en_cours_uniquement:
-        # On calcule la date proeco d'aujourd'hui
-        today_proeco = DateUtils.convert_date_to_dateproeco(date.today())
-        # On récupère les contrats en cours
-        contrats_en_cours = pd.read_sql_query(SQL_CONTRATS_EN_COURS_PROECO, proeco_engine,
-                                              params={'date_proeco': today_proeco})
-        contrats_en_cours.drop_duplicates(subset='matric', inplace=True)
-        # Inner join pour ne garder que les enseignants avec contrat en cours
-        enseignants_proeco = enseignants_proeco.merge(contrats_en_cours, on='matric', how='inner', validate='1:1')
+def nettoyer_registres_nationaux(enseignants_proeco: pd.DataFrame, logger: logging.Logger | None = None,
+                                 exporter: Exporter | None = None, exclus_proeco: pd.DataFrame | None = None,
+                                 config = default_config) -> pd.DataFrame:
+    """
+    Nettoie les numéros de registre national et ne garde que les enseignants avec un numéro valide
+    Les enseignants rejetés sont loggés et exportés dans rejets_registre_national si logger et exporter sont fournis
+    :param exclus_proeco: enseignants déjà écartés par la requête Proeco (numéro sans 11 chiffres), ajoutés au rapport
+    """
+    enseignants_proeco = enseignants_proeco.copy()
+    # On nettoie le numéro de registre national des éventuels espaces, points, tirets
+    numeros = clean_numeros_registre_national(enseignants_proeco['registre_national_numero'])
+
+    # On rejette les numéros qui n'ont pas 11 chiffres, puis ceux dont le checksum est invalide
+    motifs = pd.Series(None, index=enseignants_proeco.index, dtype=object)
+    motifs[numeros.str.len() != 11] = 'longueur'
+    if config.CONTROLE_CHECKSUM_REGISTRE_NATIONAL:
+        motifs[motifs.isna() & ~registre_national_valide(numeros)] = 'checksum'
+    rejets = motifs.notna()
 
-    # On vérifie si il y a des doublons sur le numéro national
+    if logger is not None:
+        colonnes = [colonne for colonne in ['source_proeco', 'matric', 'registre_national_numero']
+                    if colonne in enseignants_proeco.columns]
+        rapport = enseignants_proeco.loc[rejets, colonnes].assign(motif=motifs[rejets])
+        if exclus_proeco is not None and len(exclus_proeco) > 0:
+            rapport = pd.concat([exclus_proeco[colonnes].assign(motif='longueur'), rapport], ignore_index=True)
+    if logger is not None and len(rapport) > 0:
+        logger.warning(f"{len(rapport)} enseignants rejetés pour numéro de registre national invalide : "
+                       + ', '.join(f"{nombre} {motif}" for motif, nombre in rapport['motif'].value_counts().items()))
+        if exporter is not None:
+            exporter.write(rapport, 'rejets_registre_national')
+
+    enseignants_proeco['registre_national_numero'] = numeros
+    return enseignants_proeco[~rejets]
+
+
+def traiter_doublons(enseignants_proeco: pd.DataFrame, action_when_duplicates: Literal['drop', 'stop'],
+                     logger: logging.Logger) -> pd.DataFrame | None:
+    """
+    Vérifie les doublons sur le numéro de registre national
+    :return: les enseignants sans doublons, None si la migration doit être arrêtée
+    """
     duplicated = enseignants_proeco[enseignants_proeco.duplicated(subset=['registre_national_numero'])]
     if len(duplicated) > 0:
         logger.error(f"{len(duplicated)} enseignants ont des numéros de registre nationaux dupliqués : {duplicated}")
@@ -69,37 +328,184 @@ def run_migrations(
             return None
         # Sinon, on supprime les doublons avec les matricules les plus anciens
         if action_when_duplicates == 'drop':
-            enseignants_proeco.drop_duplicates(subset=['registre_national_numero'], inplace=True, keep='last')
+            enseignants_proeco = enseignants_proeco.drop_duplicates(subset=['registre_national_numero'], keep='last')
+    return enseignants_proeco
+
+
+def calculer_delta(enseignants_proeco: pd.DataFrame, delta_state: DeltaState | None, full_sync: bool,
+                   logger: logging.Logger, metrics: RunMetrics | None = None
+                   ) -> tuple[pd.DataFrame | None, dict[str, pd.Index] | None]:
+    """
+    Synchro delta, calcule le hash de chaque entité pour ne migrer que les enseignants nouveaux ou modifiés
+    :param metrics: mesures du run, le calcul est mesuré dans l'étape delta
+    :return: les hash calculés et les enseignants (source_proeco, matric) modifiés par entité,
+             (None, None) si pas de synchro delta
+    """
+    if delta_state is None:
+        return None, None
+    metrics = metrics or RunMetrics()
+    with metrics.span('delta', lignes_entree=len(enseignants_proeco)) as span:
+        hashes = delta_state.compute(enseignants_proeco)
+        # Si synchro complète forcée, on considère tous les enseignants comme modifiés
+        if full_sync:
+            changes = {entite: hashes.index for entite in delta_state.entites}
+        else:
+            changes = delta_state.changed(hashes)
+        # Enseignants modifiés pour au moins une entité
+        span.compter(lignes_sortie=hashes.index[:0].append(list(changes.values())).nunique())
+    logger.info(f"Synchro delta, enseignants nouveaux ou modifiés sur {len(hashes)} : "
+                + ', '.join(f"{len(matrics)} {entite}" for entite, matrics in changes.items()))
+    return hashes, changes
+
+
+def migrer_enseignants(enseignants_proeco: pd.DataFrame, sigale_engine: Engine, logger: logging.Logger,
+                       changes: dict[str, pd.Index] | None, export: bool, dry_run: bool, update: bool,
+                       create_users: bool, staging_merge: bool, references: ReferenceCache, exporter: Exporter,
+                       parallel_stages: int | None = None, sigale_session: SigaleSession | None = None,
+                       metrics: RunMetrics | None = None, checkpoint: RunCheckpoint | None = None,
+                       lot: str | None = None, diff_report: DiffReport | None = None, config = default_config):
+    """
+    Migre des enseignants Proeco (toute la table ou un lot) dans Sigale : personnes, utilisateurs, emails,
+    téléphones puis adresses
+    :param changes: enseignants (source_proeco, matric) nouveaux ou modifiés par entité en synchro delta,
+                    None pour tout migrer
+    :param parallel_stages: nombre d'étapes emails/téléphones/adresses exécutées en parallèle
+    :param sigale_session: connexion partagée pour les lectures de Sigale, None pour lire via sigale_engine
+    :param metrics: mesures du run, une étape par fonction migrate_*
+    :param checkpoint: points de reprise du run, les étapes déjà terminées sont ignorées
+    :param lot: identifiant du lot en traitement par lots (base et plage de matricules), pour distinguer les points
+                de reprise de chaque lot
+    :param diff_report: rapport des différences avec Sigale, alimenté par les étapes personnes, emails, téléphones
+                        et adresses
+    """
+    metrics = metrics or RunMetrics()
+    prefixe = prefixe_lot(lot)
+
+    def executer_etape(nom: str, migration: Callable, donnees: pd.DataFrame, **kwargs):
+        # Étape terminée avant l'interruption du run repris
+        if checkpoint is not None and checkpoint.etape_terminee(prefixe + nom):
+            logger.info(f"Étape {prefixe + nom} déjà terminée, ignorée")
+            return
+        etape_mesuree(metrics, nom, migration, donnees, **kwargs)
+        if checkpoint is not None:
+            checkpoint.terminer_etape(prefixe + nom)
 
     # On transforme les dates de naissances proeco en dates normales
-    enseignants_proeco['date_naissance'] = enseignants_proeco['date_naissance'].apply(
-        lambda x: DateUtils.convert_dateproeco_to_date(x))
+    enseignants_proeco = enseignants_proeco.copy()
+    enseignants_proeco['date_naissance'] = DateUtils.dateproeco_to_datetime64(enseignants_proeco['date_naissance'])
 
     # On migre les personnes, gestion de l'ajout/mise à jour dans personnes.personnes
-    attributs_personnes = ['matric', 'nom', 'prenom', 'sexe', 'nation', 'paynaiss', 'lieunaiss', 'etatcivil',
-                           'registre_national_numero', 'date_naissance', 'matriche', 'reserved']
-    migrate_personnes(enseignants_proeco[attributs_personnes], sigale_engine, logger, export, dry_run, update, config=config)
+    executer_etape('personnes', migrate_personnes,
+                   filtrer_delta(enseignants_proeco, changes, 'personnes')[ATTRIBUTS_PERSONNES],
+                   sigale_engine=sigale_engine, logger=logger, export=export, dry_run=dry_run, update=update,
+                   config=config, staging_merge=staging_merge, references=references, exporter=exporter,
+                   sigale_session=sigale_session, diff_report=diff_report)
 
+    # Nouveau snapshot, pour voir les personnes qui viennent d'être ajoutées
+    if sigale_session is not None:
+        sigale_session.nouveau_snapshot()
 
     ## AJOUT DES ID PERSONNES
-    # On récupère les personnes existantes dans Sigale
-    personnes = pd.read_sql_query(SQL_MDPS_SIGALE, sigale_engine)
-    # On ajoute les ids dans les emails
-    enseignants_proeco = enseignants_proeco.merge(personnes, on='registre_national_numero', how='inner', validate='m:1')
+    # En reprise, les enseignants avec leurs ids Sigale sont relus du point de reprise
+    avec_ids = checkpoint.load_frame(f"{prefixe}enseignants_ids") if checkpoint is not None else None
+    if avec_ids is not None:
+        enseignants_proeco = avec_ids
+    else:
+        # On récupère les personnes existantes dans Sigale
+        with metrics.span('ids_personnes', lignes_entree=len(enseignants_proeco)) as span:
+            personnes = read_sql_by_ids(SQL_MDPS_SIGALE, sigale_session or sigale_engine,
+                                        enseignants_proeco['registre_national_numero'])
+            # On ajoute les ids dans les emails
+            enseignants_proeco = enseignants_proeco.merge(personnes, on='registre_national_numero', how='inner',
+                                                          validate='m:1')
+            span.compter(lignes_sortie=len(enseignants_proeco))
+        if checkpoint is not None:
+            checkpoint.save_frame(f"{prefixe}enseignants_ids", enseignants_proeco)
 
     # Si création des utilisateurs
     if create_users:
-        migrate_users(enseignants_proeco, sigale_engine, logger, export, dry_run, update, config=config)
+        executer_etape('users', migrate_users, enseignants_proeco, sigale_engine=sigale_engine, logger=logger,
+                       export=export, dry_run=dry_run, update=update, config=config, exporter=exporter,
+                       sigale_session=sigale_session)
+
+    # Les étapes emails, téléphones et adresses sont indépendantes, elles peuvent être exécutées en parallèle
+    arguments = dict(sigale_engine=sigale_engine, logger=logger, export=export, dry_run=dry_run, update=update,
+                     config=config, staging_merge=staging_merge, references=references, exporter=exporter,
+                     diff_report=diff_report)
+    with ExitStack() as sessions:
+        def session_etape():
+            # En parallèle, chaque étape lit via sa propre connexion, dans le snapshot de la session du run
+            if sigale_session is None or not parallel_stages or parallel_stages <= 1:
+                return sigale_session
+            return sessions.enter_context(sigale_session.session_parallele())
+
+        etapes = {
+            # On migre les emails, gestion de l'ajout/mise à jour dans personnes.personne_emails
+            'emails': partial(executer_etape, 'emails', migrate_emails,
+                              filtrer_delta(enseignants_proeco, changes, 'emails')[['personne_id', *ATTRIBUTS_EMAILS]],
+                              sigale_session=session_etape(), **arguments),
+            # On migre les téléphones, gestion de l'ajout/mise à jour dans personnes.personne_telephones
+            'phones': partial(executer_etape, 'phones', migrate_phones,
+                              filtrer_delta(enseignants_proeco, changes, 'phones')[['personne_id', *ATTRIBUTS_PHONES]],
+                              sigale_session=session_etape(), **arguments),
+            'adresses': partial(executer_etape, 'adresses', migrate_adresses,
+                                filtrer_delta(enseignants_proeco, changes, 'adresses')[['personne_id', *ATTRIBUTS_ADRESSES]],
+                                sigale_session=session_etape(), **arguments),
+        }
+        executer_etapes(etapes, parallel_stages, logger)
 
-    # On migre les emails, gestion de l'ajout/mise à jour dans personnes.personne_emails
-    attributs_emails = ['personne_id', 'email', 'email2']
-    migrate_emails(enseignants_proeco[attributs_emails], sigale_engine, logger, export, dry_run, update, config=config)
 
-    # On migre les téléphones, gestion de l'ajout/mise à jour dans personnes.personne_telephones
-    attributs_phones = ['personne_id', 'teldomi', 'telresi', 'gsm', 'telbureau']
-    migrate_phones(enseignants_proeco[attributs_phones], sigale_engine, logger, export, dry_run, update, config=config)
+def prefixe_lot(lot: str | None) -> str:
+    """
+    Préfixe des points de reprise d'un lot (étapes terminées, données), vide hors traitement par lots
+    """
+    return f"lot_{lot}." if lot else ''
+
 
-    attributs_adresses = ['personne_id', 'ruedomi', 'paysdomi', 'cpostdomi', 'commdomi', 'locadomi', 'zonedomi',
-                          'rueresi', 'paysresi', 'cpostresi', 'commresi', 'locaresi', 'zoneresi']
-    migrate_adresses(enseignants_proeco[attributs_adresses], sigale_engine, logger, export, dry_run, update, config=config)
-    return None
+def etape_mesuree(metrics: RunMetrics, nom: str, migration: Callable, donnees: pd.DataFrame, **kwargs):
+    """
+    Exécute une fonction migrate_* dans l'étape nom des mesures du run, dans le thread appelant
+    :param donnees: premier paramètre de la fonction, ses lignes sont les lignes en entrée de l'étape
+    :param kwargs: autres paramètres de la fonction
+    """
+    with metrics.span(nom, lignes_entree=len(donnees)):
+        return migration(donnees, metrics=metrics, **kwargs)
+
+
+def executer_etapes(etapes: dict[str, Callable], parallel_stages: int | None, logger: logging.Logger):
+    """
+    Exécute des étapes de migration indépendantes, l'une après l'autre ou sur un pool de threads
+    En parallèle, chaque étape lit et écrit via ses propres connexions du pool de sigale_engine (voir
+    SigaleSession.session_parallele), les erreurs de chaque étape sont collectées et loggées, puis une RuntimeError
+    est levée une fois toutes les étapes terminées
+    :param etapes: fonctions à exécuter par nom d'étape
+    :param parallel_stages: nombre d'étapes exécutées en même temps, None ou 1 pour les exécuter l'une après l'autre
+    """
+    if not parallel_stages or parallel_stages <= 1:
+        for etape in etapes.values():
+            etape()
+        return
+
+    erreurs = {}
+    with ThreadPoolExecutor(max_workers=parallel_stages, thread_name_prefix='etape') as executor:
+        futures = {executor.submit(etape): nom for nom, etape in etapes.items()}
+        for future in as_completed(futures):
+            nom = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Erreur lors de l'étape {nom} : {e!r}")
+                erreurs[nom] = e
+
+    if erreurs:
+        raise RuntimeError(f"{len(erreurs)} étape(s) en erreur : {', '.join(erreurs)}") from next(iter(erreurs.values()))
+
+
+def filtrer_delta(enseignants_proeco: pd.DataFrame, changes: dict[str, pd.Index] | None, entite: str) -> pd.DataFrame:
+    """
+    Ne garde que les enseignants nouveaux ou modifiés pour une entité, tous si pas de synchro delta
+    Les enseignants sont comparés sur la base Proeco et le matricule, un matricule pouvant exister dans plusieurs bases
+    """
+    if changes is None:
+        return enseignants_proeco
+    return enseignants_proeco[pd.MultiIndex.from_frame(enseignants_proeco[CLES]).isin(changes[entite])]
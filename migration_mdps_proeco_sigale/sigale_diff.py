@@ -0,0 +1,169 @@
+import threading
+from logging import Logger
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text, bindparam
+
+from migration_mdps_proeco_sigale.db.sql_read_methods import read_sql_by_ids, SourceHorsLigne
+from migration_mdps_proeco_sigale.export import Exporter
+
+
+class DiffReport:
+    """
+    Rapport des différences champ par champ entre les valeurs proposées pour les lignes existantes (personnes, emails,
+    téléphones, adresses) et leurs valeurs actuelles dans Sigale, alimenté par filtrer_inchanges à chaque étape
+    et à chaque lot (option --diff-report)
+    - export diff_<table> : uniquement les champs modifiés, une ligne par champ, écrit au fur et à mesure
+    - export diff_champs : lignes comparées et modifiées par table et par champ, écrit à la fin du run par ecrire()
+    :param: exporter : exporter du run, utilisé que l'option --export soit active ou non
+    """
+
+    def __init__(self, exporter: Exporter):
+        self.exporter = exporter
+        # (table, champ) -> [lignes comparées, lignes modifiées]
+        self._compteurs: dict[tuple[str, str], list[int]] = {}
+        self._lock = threading.Lock()
+
+    def ajouter(self, table: str, proposed: pd.DataFrame, current: pd.DataFrame, differences: pd.DataFrame,
+                id_column: str):
+        """
+        Ajoute au rapport les différences des lignes d'une table
+        :param differences: résultat de changed_fields(proposed, current, id_column, columns)
+        """
+        with self._lock:
+            for champ, nombre in differences.sum().items():
+                compteur = self._compteurs.setdefault((table, champ), [0, 0])
+                compteur[0] += len(differences)
+                compteur[1] += int(nombre)
+        changements = table_changements(proposed, current, differences, id_column)
+        if len(changements) > 0:
+            self.exporter.write(changements, f"diff_{table}")
+
+    def champs(self) -> pd.DataFrame:
+        """
+        Nombre de lignes comparées et modifiées par table et par champ
+        """
+        with self._lock:
+            lignes = [(table, champ, comparees, modifiees)
+                      for (table, champ), (comparees, modifiees) in self._compteurs.items()]
+        return pd.DataFrame(lignes, columns=['table', 'champ', 'lignes_comparees', 'lignes_modifiees'])
+
+    def ecrire(self, logger: Logger | None = None):
+        """
+        Écrit le nombre de changements par champ dans l'export diff_champs, et le résume dans les logs
+        """
+        champs = self.champs()
+        self.exporter.write(champs, 'diff_champs')
+        if logger is None:
+            return
+        for table, lignes in champs.groupby('table', sort=False):
+            modifies = lignes[lignes['lignes_modifiees'] > 0]
+            logger.info(f"Différences avec Sigale, {table} sur {lignes['lignes_comparees'].max()} lignes existantes : "
+                        + (', '.join(f"{champ} {nombre}" for champ, nombre
+                                     in zip(modifies['champ'], modifies['lignes_modifiees'])) or 'aucune'))
+
+
+def read_current_values(sigale_engine, schema: str, table: str, id_column: str, columns: list[str],
+                        ids) -> pd.DataFrame:
+    """
+    Récupère les valeurs actuelles dans Sigale de certaines colonnes, pour une liste d'ids
+    :param schema: schéma de la table dans Sigale
+    :param table: table dans Sigale
+    :param id_column: nom donné à la colonne id dans le résultat, ex: personne_id
+    :param columns: colonnes à récupérer
+    :param ids: ids des lignes à récupérer
+    :return: une dataframe [id_column, *columns]
+    """
+    if isinstance(sigale_engine, SourceHorsLigne):
+        # Snapshot local de Sigale, les lignes de la table y ont été enregistrées entières
+        current = sigale_engine.lire_table(schema, table, ids)
+        return current.rename(columns={'id': id_column})[[id_column, *columns]]
+    quoted_columns = ', '.join(f'"{column}"' for column in columns)
+    sql = text(f"""
+        select id as {id_column}, {quoted_columns}
+        from "{schema}"."{table}"
+        where id in :ids
+    """).bindparams(bindparam('ids', expanding=True))
+    return read_sql_by_ids(sql, sigale_engine, ids)
+
+
+def values_differ(proposed: pd.Series, current: pd.Series) -> pd.Series:
+    """
+    Compare deux colonnes ligne à ligne, de façon vectorisée
+    Deux valeurs nulles sont égales, les colonnes de types différents (ex: 12.0 et '12') sont comparées en texte
+    :return: une série booléenne, True si la valeur diffère
+    """
+    proposed_null = proposed.isna()
+    current_null = current.isna()
+    comparable = ~proposed_null & ~current_null
+
+    if pd.api.types.is_numeric_dtype(proposed) and pd.api.types.is_numeric_dtype(current):
+        equal = proposed == current
+    else:
+        # Les flottants entiers (id devenus float après un merge) sont comparés sans décimale
+        equal = _as_text(proposed) == _as_text(current)
+
+    return ~((proposed_null & current_null) | (comparable & equal))
+
+
+def changed_fields(proposed: pd.DataFrame, current: pd.DataFrame, id_column: str, columns: list[str]) -> pd.DataFrame:
+    """
+    Indique, pour chaque ligne proposée et chaque colonne, si la valeur diffère de la valeur actuelle dans Sigale
+    Une ligne absente de current est considérée comme modifiée
+    :param proposed: lignes à envoyer dans Sigale
+    :param current: valeurs actuelles dans Sigale, voir read_current_values
+    :param id_column: colonne servant à recouper les deux dataframes
+    :param columns: colonnes à comparer
+    :return: une dataframe booléenne avec le même index que proposed, une colonne par colonne comparée
+    """
+    merged = proposed[[id_column, *columns]].merge(current[[id_column, *columns]], on=id_column, how='left',
+                                                   suffixes=('', '_sigale'), validate='m:1')
+    differences = pd.DataFrame(
+        {column: values_differ(merged[column], merged[f"{column}_sigale"]).values for column in columns},
+        index=proposed.index,
+    )
+    return differences
+
+
+def table_changements(proposed: pd.DataFrame, current: pd.DataFrame, differences: pd.DataFrame,
+                      id_column: str) -> pd.DataFrame:
+    """
+    Table compacte des seuls champs modifiés, calculée sans parcourir les lignes
+    :param differences: résultat de changed_fields, une colonne booléenne par champ comparé
+    :return: une dataframe [id, personne_id, champ, valeur_sigale, valeur_proposee], une ligne par champ modifié,
+             valeurs en texte (None si nulle)
+    """
+    columns = list(differences.columns)
+    # Valeurs actuelles alignées sur les lignes proposées
+    actuelles = proposed[[id_column]].merge(current[[id_column, *columns]], on=id_column, how='left', validate='m:1')
+    lignes, colonnes = np.nonzero(differences.to_numpy(dtype=bool))
+    valeurs_sigale = np.column_stack([_as_display(actuelles[column]) for column in columns])
+    valeurs_proposees = np.column_stack([_as_display(proposed[column]) for column in columns])
+    personnes = proposed['personne_id'] if 'personne_id' in proposed.columns else proposed[id_column]
+    return pd.DataFrame({
+        'id': _as_integers(proposed[id_column]).to_numpy()[lignes],
+        'personne_id': _as_integers(personnes).to_numpy()[lignes],
+        'champ': np.asarray(columns, dtype=object)[colonnes],
+        'valeur_sigale': valeurs_sigale[lignes, colonnes],
+        'valeur_proposee': valeurs_proposees[lignes, colonnes],
+    })
+
+
+def _as_display(values: pd.Series) -> np.ndarray:
+    texte = _as_text(values).to_numpy(dtype=object)
+    texte[values.isna().to_numpy()] = None
+    return texte
+
+
+def _as_integers(values: pd.Series) -> pd.Series:
+    # Ids devenus float après un merge
+    if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+        return values.astype('Int64')
+    return values
+
+
+def _as_text(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+        values = values.astype('Int64')
+    return values.astype(str)
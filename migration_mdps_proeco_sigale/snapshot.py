@@ -0,0 +1,342 @@
+import json
+import os
+import shutil
+import threading
+from datetime import date, datetime
+from functools import partial
+from logging import Logger
+from pathlib import Path
+from typing import Iterator
+
+import pandas as pd
+from sqlalchemy import Engine, TextClause, text, bindparam
+
+from migration_mdps_proeco_sigale import config as default_config
+from migration_mdps_proeco_sigale.date_utils import DateUtils
+from migration_mdps_proeco_sigale.db.connection_manager import SigaleSession
+from migration_mdps_proeco_sigale.db.requetes_sql import COLONNES_MDPS_PROECO, COLONNES_CLES_PROECO, \
+    SQL_CONTRATS_EN_COURS_PROECO, SQL_MDPS_SIGALE, SQL_EIDS_MDPS_SIGALE, SQL_UTILISATEURS_SIGALE, SQL_EMAILS_SIGALE, \
+    SQL_PHONES_SIGALE, SQL_ADRESSES_SIGALE, SQL_PARAMETERS_SIGALE, SQL_COUNTRIES_SIGALE, SQL_CITIES_SIGALE, \
+    requete_personnes_proeco
+from migration_mdps_proeco_sigale.db.sql_read_methods import SourceHorsLigne, read_sql_stream, read_sql_by_ids
+from migration_mdps_proeco_sigale.reference_cache import ReferenceCache
+from migration_mdps_proeco_sigale.tools import clean_numeros_registre_national
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
+# Colonnes de COLONNES_CLES_PROECO
+COLONNES_CLES = ['matric', 'registre_national_numero']
+
+# Requêtes Proeco auxquelles répond le snapshot : texte -> (table du snapshot, colonnes, filtre contrat en cours)
+# Les enseignants sont enregistrés sans le filtre sur le contrat en cours, appliqué à la lecture via contrats_en_cours
+REQUETES_PROECO: dict[str, tuple[str, list[str] | None, bool]] = {
+    **{requete_personnes_proeco(COLONNES_MDPS_PROECO, contrat_en_cours).text: ('enseignants', None, contrat_en_cours)
+       for contrat_en_cours in (False, True)},
+    **{requete_personnes_proeco(COLONNES_CLES_PROECO, contrat_en_cours).text:
+           ('enseignants', COLONNES_CLES, contrat_en_cours) for contrat_en_cours in (False, True)},
+    **{requete_personnes_proeco(COLONNES_CLES_PROECO, contrat_en_cours, registre_national_valide=False).text:
+           ('exclus', None, contrat_en_cours) for contrat_en_cours in (False, True)},
+    SQL_CONTRATS_EN_COURS_PROECO.text: ('contrats_en_cours', None, False),
+}
+
+# Requêtes Sigale enregistrées dans le snapshot : nom -> (requête, paramètre filtré, colonne filtrée du résultat)
+REQUETES_SIGALE: dict[str, tuple[TextClause, str | None, str | None]] = {
+    'parametres': (SQL_PARAMETERS_SIGALE, 'types_parameter', 'type_parameter'),
+    'pays': (SQL_COUNTRIES_SIGALE, None, None),
+    'villes': (SQL_CITIES_SIGALE, None, None),
+    'personnes': (SQL_MDPS_SIGALE, 'ids', 'registre_national_numero'),
+    'eids': (SQL_EIDS_MDPS_SIGALE, 'ids', 'personne_id'),
+    'utilisateurs': (SQL_UTILISATEURS_SIGALE, 'ids', 'eid'),
+    'emails': (SQL_EMAILS_SIGALE, 'ids', 'personne_id'),
+    'telephones': (SQL_PHONES_SIGALE, 'ids', 'personne_id'),
+    'adresses': (SQL_ADRESSES_SIGALE, 'ids', 'personne_id'),
+}
+
+# Tables du schéma personnes enregistrées entières (valeurs actuelles, voir sigale_diff.read_current_values) :
+# table -> (requête donnant les ids, colonne des ids)
+TABLES_SIGALE: dict[str, tuple[str, str]] = {
+    'personnes': ('personnes', 'personne_id'),
+    'personne_emails': ('emails', 'email_id'),
+    'personne_telephones': ('telephones', 'telephone_id'),
+    'personne_adresses': ('adresses', 'adresse_id'),
+}
+
+
+class SnapshotLocal:
+    """
+    Snapshot local de Proeco, et optionnellement de Sigale, créé par creer_snapshot (`python main.py snapshot`)
+    et lu par run_migrations avec --from-snapshot : les dry runs successifs n'interrogent plus Proeco
+    Chaque table est un fichier Arrow IPC, lu par memory map sans être copié en mémoire avant d'être filtré
+    - proeco/<base>/ : enseignants (sans le filtre contrat en cours), exclus (numéro de registre national invalide)
+      et contrats_en_cours (matricules avec un contrat en cours à la date du snapshot)
+    - sigale/ : résultats des lectures de la migration (références, personnes, contacts) pour les enseignants du snapshot,
+      et lignes des tables du schéma personnes correspondantes
+    :param: path : dossier du snapshot
+    """
+
+    def __init__(self, path: str):
+        if pa is None:
+            raise ImportError("Le snapshot local nécessite pyarrow : pip install \".[parquet]\"")
+        self.path = path
+        path_infos = os.path.join(path, 'snapshot.json')
+        if not os.path.exists(path_infos):
+            raise FileNotFoundError(f"Aucun snapshot dans {path}, à créer avec `python main.py snapshot`")
+        with open(path_infos, encoding='utf-8') as fichier:
+            self.infos = json.load(fichier)
+        self._tables: dict[str, pa.Table] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def sources(self) -> list[str]:
+        """
+        Bases Proeco du snapshot
+        """
+        return self.infos['sources']
+
+    @property
+    def sigale(self) -> bool:
+        """
+        True si le snapshot contient les tables de Sigale
+        """
+        return self.infos['sigale']
+
+    def table(self, nom: str) -> 'pa.Table':
+        """
+        Table du snapshot, ex: proeco/PROF.FDB/enseignants, ouverte par memory map à la première lecture
+        """
+        with self._lock:
+            if nom not in self._tables:
+                source = pa.memory_map(os.path.join(self.path, f"{nom}.arrow"), 'r')
+                self._tables[nom] = pa.ipc.open_file(source).read_all()
+            return self._tables[nom]
+
+    def proeco(self) -> dict[str, 'ProecoHorsLigne']:
+        """
+        Lectures de chaque base Proeco du snapshot, à utiliser à la place des engines Proeco
+        """
+        return {source: ProecoHorsLigne(self, source) for source in self.sources}
+
+    def lectures_sigale(self) -> 'SigaleHorsLigne':
+        """
+        Lectures de Sigale depuis le snapshot, à utiliser à la place de la SigaleSession
+        """
+        if not self.sigale:
+            raise ValueError(f"Le snapshot {self.path} ne contient pas les tables de Sigale (option --sigale)")
+        return SigaleHorsLigne(self)
+
+
+class ProecoHorsLigne(SourceHorsLigne):
+    """
+    Base Proeco lue depuis le snapshot, répond aux requêtes de REQUETES_PROECO comme Firebird
+    Le filtre sur le contrat en cours utilise la date du snapshot, le paramètre :date_proeco est ignoré
+    """
+
+    def __init__(self, snapshot: SnapshotLocal, source: str):
+        self.snapshot = snapshot
+        self.source = source
+
+    def iter_sql(self, sql: TextClause | str, params: dict | None, itersize: int) -> Iterator[pd.DataFrame]:
+        texte = sql if isinstance(sql, str) else sql.text
+        if texte not in REQUETES_PROECO:
+            raise ValueError(f"Requête Proeco absente du snapshot : {texte}")
+        nom, colonnes, contrat_en_cours = REQUETES_PROECO[texte]
+        table = self.snapshot.table(f"proeco/{self.source}/{nom}")
+        if contrat_en_cours:
+            contrats = self.snapshot.table(f"proeco/{self.source}/contrats_en_cours")
+            table = filtrer(table, 'matric', contrats['matric'])
+        if colonnes:
+            table = table.select(colonnes)
+        yield from iter_lots(table, itersize)
+
+    def lire_table(self, schema: str, table: str, ids) -> pd.DataFrame:
+        # Seules les requêtes de REQUETES_PROECO sont enregistrées, pas les tables
+        raise ValueError(f"Table {schema}.{table} absente du snapshot de Proeco {self.source}")
+
+
+class SigaleHorsLigne(SourceHorsLigne):
+    """
+    Lectures de Sigale depuis le snapshot, à la place de la SigaleSession d'un dry run
+    Répond aux requêtes de REQUETES_SIGALE en filtrant les résultats enregistrés, les données restent celles
+    du snapshot pendant tout le run
+    """
+
+    def __init__(self, snapshot: SnapshotLocal):
+        self.snapshot = snapshot
+        self._requetes = {sql.text: (nom, param, colonne) for nom, (sql, param, colonne) in REQUETES_SIGALE.items()}
+
+    def iter_sql(self, sql: TextClause | str, params: dict | None, itersize: int) -> Iterator[pd.DataFrame]:
+        texte = sql if isinstance(sql, str) else sql.text
+        if texte not in self._requetes:
+            raise ValueError(f"Requête Sigale absente du snapshot : {texte}")
+        nom, param, colonne = self._requetes[texte]
+        table = self.snapshot.table(f"sigale/{nom}")
+        if param is not None:
+            table = filtrer(table, colonne, params[param])
+        yield from iter_lots(table, itersize)
+
+    def lire_table(self, schema: str, table: str, ids) -> pd.DataFrame:
+        if schema != 'personnes' or table not in TABLES_SIGALE:
+            raise ValueError(f"Table {schema}.{table} absente du snapshot")
+        return filtrer(self.snapshot.table(f"sigale/table_{table}"), 'id', ids).to_pandas()
+
+    def nouveau_snapshot(self):
+        # Données figées au moment du snapshot, rien à relire
+        pass
+
+    def session_parallele(self) -> 'SigaleHorsLigne':
+        # Lectures sans connexion, les tables du snapshot sont partagées entre les étapes parallèles
+        return self
+
+    def close(self):
+        pass
+
+    def __enter__(self) -> 'SigaleHorsLigne':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def filtrer(table: 'pa.Table', colonne: str, valeurs) -> 'pa.Table':
+    """
+    Lignes de table dont la colonne est dans valeurs, équivalent de `colonne in :ids`
+    :param valeurs: liste, série pandas ou colonne arrow
+    """
+    type_colonne = table.schema.field(colonne).type
+    if table.num_rows == 0 or pa.types.is_null(type_colonne):
+        return table.slice(0, 0)
+    if isinstance(valeurs, pa.ChunkedArray):
+        valeurs = valeurs.combine_chunks().cast(type_colonne)
+    else:
+        # Types python, comme pour read_sql_by_ids
+        valeurs = pa.array(pd.Series(valeurs).dropna().drop_duplicates().tolist(), type=type_colonne)
+    return table.filter(pc.is_in(table[colonne], value_set=valeurs))
+
+
+def iter_lots(table: 'pa.Table', itersize: int) -> Iterator[pd.DataFrame]:
+    """
+    Découpe une table en dataframes de itersize lignes, comme un curseur côté serveur : les types sont déduits
+    lot par lot (ex: entiers avec des valeurs nulles en float), un seul lot vide si la table est vide
+    """
+    if table.num_rows == 0:
+        yield table.to_pandas()
+        return
+    for debut in range(0, table.num_rows, itersize):
+        yield table.slice(debut, itersize).to_pandas()
+
+
+def ecrire_table(dossier: str, nom: str, data: pd.DataFrame) -> int:
+    """
+    Écrit une dataframe dans le fichier Arrow IPC dossier/nom.arrow
+    Les colonnes non convertibles en arrow (ex: json en objets python) sont enregistrées en texte
+    :return: le nombre de lignes écrites
+    """
+    path = Path(dossier, f"{nom}.arrow")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        table = pa.Table.from_pandas(data, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        colonnes = [colonne for colonne in data.columns if not convertible(data[colonne])]
+        table = pa.Table.from_pandas(
+            data.assign(**{colonne: data[colonne].map(str, na_action='ignore') for colonne in colonnes}),
+            preserve_index=False)
+    # Sans les métadonnées pandas, les types nullables d'écriture ne sont pas restaurés à la lecture
+    table = table.replace_schema_metadata(None)
+    with pa.OSFile(str(path), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return table.num_rows
+
+
+def convertible(valeurs: pd.Series) -> bool:
+    try:
+        pa.array(valeurs, from_pandas=True)
+        return True
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return False
+
+
+def creer_snapshot(snapshot_path: str, proeco_engines: dict[str, Engine], sigale_engine: Engine | None = None,
+                   logger: Logger | None = None, config = default_config) -> SnapshotLocal:
+    """
+    Enregistre un snapshot local de Proeco, et de Sigale si sigale_engine est fourni, lisible avec --from-snapshot
+    Le snapshot est écrit dans un dossier temporaire, puis remplace le précédent une fois complet
+    :param snapshot_path: dossier du snapshot, SNAPSHOT_PATH de la config
+    :param proeco_engines: connexions Proeco par nom de base
+    :param sigale_engine: connexion à Sigale, None pour ne pas enregistrer Sigale
+    """
+    if pa is None:
+        raise ImportError("Le snapshot local nécessite pyarrow : pip install \".[parquet]\"")
+    temporaire = f"{os.path.normpath(snapshot_path)}.tmp"
+    shutil.rmtree(temporaire, ignore_errors=True)
+    date_contrats = date.today()
+    # Les types nullables conservent les entiers avec des valeurs nulles en entiers dans arrow,
+    # à la lecture ils sont déduits lot par lot comme lors d'une lecture de la base
+    lire = partial(read_sql_stream, itersize=config.PROECO_FETCH_SIZE, dtype_backend='numpy_nullable')
+    lignes = {}
+
+    registres_nationaux = []
+    for source, engine in proeco_engines.items():
+        dossier = os.path.join(temporaire, 'proeco', source)
+        enseignants = lire(requete_personnes_proeco(COLONNES_MDPS_PROECO), engine,
+                           dtype={'registre_national_numero': str})
+        lignes[f"proeco/{source}/enseignants"] = ecrire_table(dossier, 'enseignants', enseignants)
+        lignes[f"proeco/{source}/exclus"] = ecrire_table(dossier, 'exclus', lire(
+            requete_personnes_proeco(COLONNES_CLES_PROECO, registre_national_valide=False), engine,
+            dtype={'registre_national_numero': str}))
+        lignes[f"proeco/{source}/contrats_en_cours"] = ecrire_table(dossier, 'contrats_en_cours', lire(
+            SQL_CONTRATS_EN_COURS_PROECO, engine,
+            params={'date_proeco': DateUtils.convert_date_to_dateproeco(date_contrats)}))
+        registres_nationaux.append(enseignants['registre_national_numero'])
+        if logger:
+            logger.info(f"Snapshot de Proeco {source} : {len(enseignants)} enseignants")
+
+    if sigale_engine is not None:
+        with SigaleSession(sigale_engine, config.SIGALE_READ_ISOLATION_LEVEL, config.SIGALE_ITERSIZE) as session:
+            lignes.update(enregistrer_sigale(session, os.path.join(temporaire, 'sigale'),
+                                             pd.concat(registres_nationaux, ignore_index=True)))
+        if logger:
+            logger.info(f"Snapshot de Sigale : {lignes['sigale/personnes']} personnes, {lignes['sigale/emails']} emails, "
+                        f"{lignes['sigale/telephones']} téléphones, {lignes['sigale/adresses']} adresses")
+
+    with open(os.path.join(temporaire, 'snapshot.json'), 'w', encoding='utf-8') as fichier:
+        json.dump({'date': datetime.now().isoformat(timespec='seconds'), 'date_contrats': date_contrats.isoformat(),
+                   'sources': list(proeco_engines), 'sigale': sigale_engine is not None, 'lignes': lignes},
+                  fichier, indent=2, ensure_ascii=False)
+    shutil.rmtree(snapshot_path, ignore_errors=True)
+    os.replace(temporaire, snapshot_path)
+    if logger:
+        logger.info(f"Snapshot enregistré dans {snapshot_path}, à utiliser avec --from-snapshot")
+    return SnapshotLocal(snapshot_path)
+
+
+def enregistrer_sigale(sigale_session: SigaleSession, dossier: str, registres_nationaux: pd.Series) -> dict[str, int]:
+    """
+    Enregistre les résultats des requêtes de REQUETES_SIGALE et les tables de TABLES_SIGALE,
+    limités aux enseignants du snapshot de Proeco
+    :param registres_nationaux: numéros de registre national des enseignants Proeco, avant nettoyage
+    :return: le nombre de lignes de chaque table enregistrée
+    """
+    lire = partial(read_sql_by_ids, con=sigale_session, dtype_backend='numpy_nullable')
+    # Paramètre de chaque requête : valeurs des ids, lues dans les résultats des requêtes précédentes
+    resultats = {
+        'parametres': lire(SQL_PARAMETERS_SIGALE, ids=ReferenceCache.PARAMETER_TYPES, param_name='types_parameter'),
+        'pays': read_sql_stream(SQL_COUNTRIES_SIGALE, sigale_session, dtype_backend='numpy_nullable'),
+        'villes': read_sql_stream(SQL_CITIES_SIGALE, sigale_session, dtype_backend='numpy_nullable'),
+        'personnes': lire(SQL_MDPS_SIGALE, ids=clean_numeros_registre_national(registres_nationaux)),
+    }
+    personne_ids = resultats['personnes']['personne_id']
+    for nom in ('eids', 'emails', 'telephones', 'adresses'):
+        resultats[nom] = lire(REQUETES_SIGALE[nom][0], ids=personne_ids)
+    resultats['utilisateurs'] = lire(SQL_UTILISATEURS_SIGALE, ids=resultats['eids']['eid'])
+
+    lignes = {f"sigale/{nom}": ecrire_table(dossier, nom, data) for nom, data in resultats.items()}
+    for table, (requete, colonne) in TABLES_SIGALE.items():
+        sql = text(f'select * from "personnes"."{table}" where id in :ids').bindparams(bindparam('ids', expanding=True))
+        lignes[f"sigale/table_{table}"] = ecrire_table(dossier, f"table_{table}",
+                                                      lire(sql, ids=resultats[requete][colonne]))
+    return lignes
@@ -1,7 +1,74 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from unidecode import unidecode
+
+
 def clean_numero_registre_national(num_reg_nat: str):
     """
     Ne renvoie que les caractères numériques
     :param num_reg_nat:
     :return:
     """
-    return ''.join(ch for ch in num_reg_nat if ch.isdigit())
\ No newline at end of file
+    return ''.join(ch for ch in num_reg_nat if ch.isdigit())
+
+@lru_cache(maxsize=65536)
+def normaliser_valeur(valeur: str) -> str:
+    """
+    Normalise une valeur pour les recoupements : majuscules, sans accents, sans espaces inutiles
+    Mémoïsée pour tout le processus, les mêmes pays et communes revenant à chaque étape et à chaque lot
+    """
+    return unidecode(valeur.upper()).strip()
+
+
+def normaliser_texte(valeurs: pd.Series) -> pd.Series:
+    """
+    Normalise une colonne de texte avec normaliser_valeur, en ne traitant que les valeurs distinctes
+    Les valeurs nulles restent nulles
+    """
+    codes, uniques = pd.factorize(valeurs)
+    # factorize renvoie -1 pour les valeurs nulles, qui pointent vers le None ajouté en fin de tableau
+    normalisees = np.array([normaliser_valeur(str(valeur)) for valeur in uniques] + [None], dtype=object)
+    return pd.Series(normalisees[codes], index=valeurs.index, name=valeurs.name)
+
+
+def champs_config(fields: dict[str, dict], colonnes: list[str]) -> pd.DataFrame:
+    """
+    Transforme un dictionnaire de champs de la config (EMAILS_FIELDS, PHONE_FIELDS, ...) en table de correspondance
+    indexée par champ Proeco, à merger avec les données plutôt que de parcourir la config ligne par ligne
+    :param colonnes: options à récupérer, une option absente de la config donne une valeur nulle
+    """
+    champs = pd.DataFrame.from_dict({champ: options for champ, options in fields.items() if options}, orient='index')
+    champs = champs.reindex(columns=colonnes)
+    champs.index.name = 'champ_proeco'
+    # Les options sont répétées sur chaque ligne après le merge : category pour les codes, booléens nullables sinon
+    for colonne in colonnes:
+        est_booleen = champs[colonne].map(lambda option: isinstance(option, bool) or pd.isna(option)).all()
+        champs[colonne] = champs[colonne].astype('boolean' if est_booleen else 'category')
+    return champs
+
+
+def clean_numeros_registre_national(numeros: pd.Series) -> pd.Series:
+    """
+    Version vectorisée de clean_numero_registre_national, ne garde que les chiffres de chaque numéro
+    """
+    return numeros.where(numeros.isna(), numeros.astype(str)).str.replace(r'\D+', '', regex=True)
+
+
+def registre_national_valide(numeros: pd.Series) -> pd.Series:
+    """
+    Vérifie de façon vectorisée le checksum modulo 97 des numéros de registre national belges (11 chiffres)
+    Le checksum vaut 97 - (9 premiers chiffres modulo 97), pour les personnes nées à partir de 2000
+    un 2 est ajouté devant les 9 premiers chiffres. La date de naissance n'étant pas toujours connue (numéros bis),
+    un numéro est valide si l'une des deux règles est respectée
+    :param numeros: numéros nettoyés, voir clean_numeros_registre_national
+    :return: une série booléenne, False pour les numéros invalides ou qui n'ont pas 11 chiffres
+    """
+    onze_chiffres = numeros.str.fullmatch(r'\d{11}', na=False)
+    numeros = numeros.where(onze_chiffres, '00000000000')
+    base = numeros.str[:9].astype('int64')
+    checksum = numeros.str[9:].astype('int64')
+    avant_2000 = 97 - base % 97 == checksum
+    apres_2000 = 97 - (2_000_000_000 + base) % 97 == checksum
+    return onze_chiffres & (avant_2000 | apres_2000)
@@ -0,0 +1,46 @@
+import tempfile
+import unittest
+
+import pandas as pd
+
+from migration_mdps_proeco_sigale.checkpoint import RunCheckpoint
+
+
+def cles(matrics: list[int]) -> pd.DataFrame:
+    return pd.DataFrame({'source_proeco': 'PROF.FDB', 'matric': pd.array(matrics, dtype='Int32')})
+
+
+class TestVerifierLot(unittest.TestCase):
+
+    def setUp(self):
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        self.checkpoint_path = dossier.name
+        self.options = {'chunk_size': 3}
+        checkpoint = RunCheckpoint(self.checkpoint_path, 'run', self.options)
+        self.assertTrue(checkpoint.verifier_lot('lot_PROF.FDB_1_5.', cles([1, 3, 5])))
+        checkpoint.save_frame('lot_PROF.FDB_1_5.enseignants_ids', cles([1, 3, 5]))
+        checkpoint.terminer_etape('lot_PROF.FDB_1_5.personnes')
+        checkpoint.terminer_etape('lot_PROF.FDB_1_50.personnes')
+
+    def test_meme_lot(self):
+        checkpoint = RunCheckpoint.reprendre(self.checkpoint_path, 'run', self.options)
+        self.assertTrue(checkpoint.verifier_lot('lot_PROF.FDB_1_5.', cles([1, 3, 5])))
+        self.assertTrue(checkpoint.etape_terminee('lot_PROF.FDB_1_5.personnes'))
+        self.assertIsNotNone(checkpoint.load_frame('lot_PROF.FDB_1_5.enseignants_ids'))
+
+    def test_lot_modifie_avec_la_meme_plage(self):
+        # Un enseignant supprimé et un autre ajouté dans Proeco : mêmes limites, enseignants différents
+        checkpoint = RunCheckpoint.reprendre(self.checkpoint_path, 'run', self.options)
+        self.assertFalse(checkpoint.verifier_lot('lot_PROF.FDB_1_5.', cles([1, 4, 5])))
+        self.assertFalse(checkpoint.etape_terminee('lot_PROF.FDB_1_5.personnes'))
+        self.assertIsNone(checkpoint.load_frame('lot_PROF.FDB_1_5.enseignants_ids'))
+        # Les autres lots ne sont pas concernés
+        self.assertTrue(checkpoint.etape_terminee('lot_PROF.FDB_1_50.personnes'))
+        # Le lot modifié est vérifié sur ses nouveaux enseignants à la reprise suivante
+        reprise = RunCheckpoint.reprendre(self.checkpoint_path, 'run', self.options)
+        self.assertTrue(reprise.verifier_lot('lot_PROF.FDB_1_5.', cles([1, 4, 5])))
+
+
+if __name__ == '__main__':
+    unittest.main()
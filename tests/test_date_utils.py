@@ -0,0 +1,101 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from migration_mdps_proeco_sigale.date_utils import DateUtils
+
+# Nombre de valeurs tirées au hasard par test, avec une graine fixe pour des échecs reproductibles
+TAILLE = 5000
+GRAINE = 20240601
+# Dates Proeco valides : du 01/01/1900 (000101) à la veille de la sentinelle 2559999
+DATE_MIN = pd.Timestamp('1900-01-01')
+DATE_MAX = pd.Timestamp('2155-12-31')
+SENTINELLES = [0, -1, -20000101, 2559999, 2560101, 9999999]
+DTYPES = ['Int32', 'Int64', 'int64', 'float64', 'object']
+
+
+def dates_aleatoires(rng: np.random.Generator, taille: int) -> pd.Series:
+    """
+    Dates tirées uniformément entre DATE_MIN et DATE_MAX
+    """
+    jours = rng.integers(0, (DATE_MAX - DATE_MIN).days + 1, taille)
+    return pd.Series(DATE_MIN + pd.to_timedelta(jours, unit='D'))
+
+
+def dates_proeco_aleatoires(rng: np.random.Generator, taille: int) -> list:
+    """
+    Dates Proeco valides, sentinelles et valeurs nulles mélangées
+    """
+    valeurs = [DateUtils.convert_date_to_dateproeco(d) for d in dates_aleatoires(rng, taille)]
+    tirage = rng.random(taille)
+    return [int(rng.choice(SENTINELLES)) if t < 0.1 else None if t < 0.2 else v for v, t in zip(valeurs, tirage)]
+
+
+def convertir_scalaire(date_proeco) -> pd.Timestamp:
+    """
+    Résultat attendu de dateproeco_to_datetime64, via convert_dateproeco_to_date (NaT pour les valeurs nulles)
+    """
+    if date_proeco is None:
+        return pd.NaT
+    resultat = DateUtils.convert_dateproeco_to_date(date_proeco)
+    return pd.NaT if resultat is None else pd.Timestamp(resultat)
+
+
+class TestDateproecoToDatetime64(unittest.TestCase):
+
+    def test_entiers_nullables_avec_sentinelle(self):
+        # date_naissance est en Int32 avec le plan de types compact (COMPACT_DTYPES)
+        dates_proeco = pd.Series([820101, 2559999, 0, pd.NA, 991231], dtype='Int32')
+        resultat = DateUtils.dateproeco_to_datetime64(dates_proeco)
+        attendu = pd.Series(pd.to_datetime(['1982-01-01', None, None, None, '1999-12-31']))
+        pd.testing.assert_series_equal(resultat, attendu)
+
+    def test_identique_a_la_version_scalaire(self):
+        rng = np.random.default_rng(GRAINE)
+        valeurs = dates_proeco_aleatoires(rng, TAILLE)
+        attendu = pd.Series([convertir_scalaire(v) for v in valeurs], dtype='datetime64[ns]')
+        for dtype in DTYPES:
+            with self.subTest(dtype=dtype):
+                if dtype == 'int64':
+                    # Sans valeur nulle possible, Proeco stocke 0
+                    dates_proeco = pd.Series([0 if v is None else v for v in valeurs], dtype=dtype)
+                    attendu_dtype = attendu.mask(pd.Series([v is None for v in valeurs]), pd.NaT)
+                else:
+                    dates_proeco = pd.Series(valeurs, dtype=dtype)
+                    attendu_dtype = attendu
+                resultat = DateUtils.dateproeco_to_datetime64(dates_proeco)
+                pd.testing.assert_series_equal(resultat, attendu_dtype, check_names=False)
+
+    def test_dates_invalides(self):
+        # La version scalaire lève une erreur, la version vectorisée rend NaT
+        dates_proeco = pd.Series([821301, 820230, 820100, 820132], dtype='Int32')
+        for date_proeco in dates_proeco:
+            with self.assertRaises(ValueError):
+                DateUtils.convert_dateproeco_to_date(date_proeco)
+        self.assertTrue(DateUtils.dateproeco_to_datetime64(dates_proeco).isna().all())
+
+
+class TestDatetime64ToDateproeco(unittest.TestCase):
+
+    def test_identique_a_la_version_scalaire(self):
+        rng = np.random.default_rng(GRAINE)
+        dates = dates_aleatoires(rng, TAILLE).mask(rng.random(TAILLE) < 0.1)
+        attendu = pd.Series([pd.NA if pd.isna(d) else DateUtils.convert_date_to_dateproeco(d) for d in dates],
+                            dtype='Int64')
+        pd.testing.assert_series_equal(DateUtils.datetime64_to_dateproeco(dates), attendu)
+        # Les dates Python (objets date, ex: colonnes lues de Sigale) donnent le même résultat
+        dates_python = pd.Series([None if pd.isna(d) else d.date() for d in dates], dtype=object)
+        pd.testing.assert_series_equal(DateUtils.datetime64_to_dateproeco(dates_python), attendu)
+
+    def test_aller_retour(self):
+        rng = np.random.default_rng(GRAINE)
+        dates = dates_aleatoires(rng, TAILLE)
+        for dtype in ['Int32', 'Int64']:
+            with self.subTest(dtype=dtype):
+                dates_proeco = DateUtils.datetime64_to_dateproeco(dates).astype(dtype)
+                pd.testing.assert_series_equal(DateUtils.dateproeco_to_datetime64(dates_proeco), dates)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from migration_mdps_proeco_sigale.delta_sync import DeltaState
+from migration_mdps_proeco_sigale.run import filtrer_delta
+
+ENTITES = {'personnes': ['nom'], 'emails': ['email']}
+
+
+def enseignants(emails: list[str]) -> pd.DataFrame:
+    """
+    Deux bases Proeco avec les mêmes matricules, des enseignants différents
+    """
+    return pd.DataFrame({
+        'source_proeco': ['A.FDB', 'A.FDB', 'B.FDB', 'B.FDB'],
+        'matric': pd.array([1, 2, 1, 2], dtype='Int32'),
+        'nom': ['Dupont', 'Durand', 'Martin', 'Lambert'],
+        'email': emails,
+    })
+
+
+class TestDeltaStatePlusieursBases(unittest.TestCase):
+
+    def setUp(self):
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        self.state_file = os.path.join(dossier.name, 'delta.pkl')
+
+    def test_matricules_identiques_dans_plusieurs_bases(self):
+        premiere = enseignants(['a1@x.be', 'a2@x.be', 'b1@x.be', 'b2@x.be'])
+        state = DeltaState(self.state_file, ENTITES)
+        state.save(state.compute(premiere))
+
+        # Seul l'email du matricule 1 de la base B change
+        seconde = enseignants(['a1@x.be', 'a2@x.be', 'b1@autre.be', 'b2@x.be'])
+        state = DeltaState(self.state_file, ENTITES)
+        hashes = state.compute(seconde)
+        changes = state.changed(hashes)
+        self.assertEqual(list(changes['personnes']), [])
+        self.assertEqual(list(changes['emails']), [('B.FDB', 1)])
+        pd.testing.assert_frame_equal(filtrer_delta(seconde, changes, 'emails'), seconde.iloc[[2]])
+
+        state.save(hashes)
+        self.assertEqual(len(state.load()), 4)
+
+    def test_etat_par_matricule_seul_ignore(self):
+        # État sauvegardé avant la clé (source_proeco, matric) : synchro complète
+        pd.DataFrame({'personnes': [1, 2]}, index=pd.Index([1, 2], name='matric')).to_pickle(self.state_file)
+        state = DeltaState(self.state_file, ENTITES)
+        hashes = state.compute(enseignants(['a1@x.be', 'a2@x.be', 'b1@x.be', 'b2@x.be']))
+        self.assertEqual(len(state.changed(hashes)['personnes']), 4)
+        state.save(hashes)
+        self.assertEqual(list(state.load().index.names), ['source_proeco', 'matric'])
+
+
+if __name__ == '__main__':
+    unittest.main()
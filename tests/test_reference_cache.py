@@ -0,0 +1,37 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from migration_mdps_proeco_sigale.reference_cache import ReferenceCache
+
+
+class TestSnapshotReferences(unittest.TestCase):
+
+    def setUp(self):
+        dossier = tempfile.TemporaryDirectory()
+        self.addCleanup(dossier.cleanup)
+        self.config = SimpleNamespace(REFERENCE_CACHE_SNAPSHOT=os.path.join(dossier.name, 'references.pkl'),
+                                      REFERENCE_CACHE_TTL=3600)
+        self.test = create_engine(f"sqlite:///{os.path.join(dossier.name, 'test.db')}")
+        self.production = create_engine(f"sqlite:///{os.path.join(dossier.name, 'production.db')}")
+        cache = ReferenceCache.from_config(self.test, self.config, dry_run=True)
+        cache._tables = {'parameters': pd.DataFrame({'id': [1], 'code': ['feminin'], 'type_parameter': ['sexes_sigale']})}
+        cache._write_snapshot()
+
+    def test_meme_base_en_dry_run(self):
+        self.assertIsNotNone(ReferenceCache.from_config(self.test, self.config, dry_run=True)._read_snapshot())
+
+    def test_autre_base(self):
+        # Les ids de référence d'une base de test ne doivent pas être écrits dans une autre base
+        self.assertIsNone(ReferenceCache.from_config(self.production, self.config, dry_run=True)._read_snapshot())
+
+    def test_run_reel(self):
+        self.assertIsNone(ReferenceCache.from_config(self.test, self.config)._read_snapshot())
+
+
+if __name__ == '__main__':
+    unittest.main()